@@ -10,11 +10,20 @@ from app.core.settings import get_settings, Settings
 from app.core.database import init_database, get_db_manager
 from app.services.embeddings_service import init_embeddings_service
 from app.services.vector_store_service import init_vector_store_service
+from app.services.index_sync import start_index_sync, stop_index_sync
 from app.services.faq_embedding_service import init_faq_embedding_service
 from app.services.langgraph_service import init_langgraph_service
+from app.services.agent_config_service import init_agent_config_service
+from app.services.chat_flags_cache import init_chat_flags_cache
+from app.services.intent_router import init_intent_router
+from app.services.retrieval_config_service import init_retrieval_config_service
+from app.services.reranker_service import init_reranker_service
+from app.services.context_assembler import init_context_assembler
+from app.services.conversation_memory import init_conversation_memory, get_conversation_memory
 from app.routes import ai, users, dashboard, knowledge_base, ai_agent_kb
 from app.services.website_crawler_service import init_website_crawler_service
 from app.services.file_processing_service import init_file_processing_service
+from app.services.document_extraction_engine import init_extraction_engine, shutdown_extraction_engine
 from app.services.redis_publisher import init_redis_publisher, close_redis_publisher
 
 
@@ -47,28 +56,54 @@ async def lifespan(app: FastAPI):
         print("📚 Initializing vector store service...")
         vector_store_service = init_vector_store_service(settings, embeddings_service)
         
+        db_manager_instance = get_db_manager()
+        db_instance = db_manager_instance.get_database() if db_manager_instance else None
+        
         # Initialize FAQ embedding service
         print("💬 Initializing FAQ embedding service...")
-        init_faq_embedding_service(vector_store_service, embeddings_service, settings)
+        faq_embedding_service = init_faq_embedding_service(vector_store_service, embeddings_service, settings, db=db_instance)
         
         # Initialize LangGraph service
         print("🧠 Initializing LangGraph service...")
-        init_langgraph_service(settings, vector_store_service)
+        config_service = init_agent_config_service(settings, db=db_instance)
+        langgraph_service = init_langgraph_service(settings, vector_store_service)
         
         # Initialize website crawler service
         print("🕷️  Initializing website crawler service...")
-        db_manager_instance = get_db_manager()
-        db_instance = db_manager_instance.get_database() if db_manager_instance else None
         init_website_crawler_service(settings, db=db_instance)
         
         # Initialize file processing service
         print("📄 Initializing file processing service...")
         init_file_processing_service(settings, db=db_instance)
+        init_extraction_engine()
+
+        # Initialize per-tenant retrieval settings (hybrid BM25 + vector by default)
+        init_retrieval_config_service(settings, db=db_instance)
+
+        # Initialize optional cross-encoder reranker (RERANKER_ENABLED)
+        init_reranker_service(settings)
+
+        # Initialize the token-budgeted context assembler for retrieved passages
+        init_context_assembler(settings)
+
+        # Initialize intent router (answers greetings and exact FAQ hits without the LLM)
+        print("⚡ Initializing intent router...")
+        langgraph_service.intent_router = init_intent_router(settings, faq_embedding_service, db=db_instance)
+
+        # Initialize conversation memory (recent turns plus a rolling summary per chat)
+        print("🧠 Initializing conversation memory...")
+        langgraph_service.memory = init_conversation_memory(settings, db=db_instance, llm=langgraph_service.background_llm())
 
         # Initialize Redis publisher for WebSocket microservice communication
         print("📡 Initializing Redis publisher...")
         await init_redis_publisher()
 
+        # Cache of per-chat flags checked on every AI turn
+        chat_flags_cache = init_chat_flags_cache()
+
+        # Reload the vector index, FAQ indexes, agent config and chat flags when another worker changes them
+        start_index_sync(vector_store_service, faq_embedding_service, config_service, chat_flags_cache)
+
         print("✅ Startup complete - API ready to serve requests!")
         
     except Exception as e:
@@ -81,8 +116,11 @@ async def lifespan(app: FastAPI):
     print("🛑 Shutting down Sakura Backend...")
     try:
         db_manager = get_db_manager()
+        await stop_index_sync()
         await db_manager.disconnect()
         await close_redis_publisher()
+        shutdown_extraction_engine()
+        get_conversation_memory().shutdown()
         print("✅ Shutdown complete")
     except Exception as e:
         print(f"❌ Shutdown error: {e}")
@@ -9,6 +9,7 @@ class ChatMessage(BaseModel):
     """Chat message model."""
     message: str
     session_id: str
+    dashboard_user_id: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
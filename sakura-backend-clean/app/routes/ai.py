@@ -1,11 +1,19 @@
 """
 AI and chat-related API routes.
 """
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException
 from datetime import datetime
 from app.models.chat_model import ChatMessage, ChatResponse, AOPRequest, AOPResponse, HealthResponse
 from app.services.langgraph_service import get_langgraph_service, LangGraphService
 from app.services.vector_store_service import get_vector_store_service, VectorStoreService
+from app.services.retrieval_config_service import get_retrieval_config_service, RetrievalConfigService
+from app.services.reranker_service import get_reranker_service
+from app.services.context_assembler import get_context_assembler
+from app.services.agent_config_service import get_agent_config_service, AgentConfigService
+from app.services.aop_runtime import AOPStateStore
+from app.services.chat_flags_cache import get_chat_flags_cache
+from app.services.conversation_memory import get_conversation_memory
 from app.core.database import get_database
 from pymongo.database import Database
 
@@ -26,14 +34,15 @@ async def chat(
         # Check if AI agent is enabled for this chat
         # session_id is typically the chat_id
         chat_id = message.session_id
+        dashboard_user_id = message.dashboard_user_id
         
         if db is not None:
-            chats_collection = db["customer-chats"]
-            chat_doc = chats_collection.find_one({"chat_id": chat_id})
+            # Cached flags, fetched with a projection on a miss (never the message history)
+            chat_flags = get_chat_flags_cache().get_flags(db, chat_id)
             
-            if chat_doc:
-                # Check AI agent enabled status (default to True for backward compatibility)
-                ai_agent_enabled = chat_doc.get("ai_agent_enabled", True)
+            if chat_flags:
+                dashboard_user_id = dashboard_user_id or chat_flags["dashboard_user_id"]
+                ai_agent_enabled = chat_flags["ai_agent_enabled"]
                 print(f"🤖 AI agent enabled status: {ai_agent_enabled}")
                 
                 if not ai_agent_enabled:
@@ -51,9 +60,12 @@ async def chat(
         
         # AI agent is enabled, process normally
         print(f"🚀 Processing message through LangGraph service...")
-        response = langgraph_service.process_chat_message(
-            message.message, 
-            message.session_id
+        # Run in a worker thread: the pipeline blocks, and the LLM scheduler queues concurrent chats
+        response = await asyncio.to_thread(
+            langgraph_service.process_chat_message,
+            message.message,
+            message.session_id,
+            dashboard_user_id=dashboard_user_id
         )
         
         print(f"✅ Successfully processed message, response length: {len(response) if response else 0}")
@@ -79,42 +91,19 @@ async def run_aop(
 ):
     """Run an Agent Operating Procedure workflow."""
     try:
-        # Create a simple storage interface for AOP state management
-        class SimpleStorage:
-            def __init__(self, db: Database):
-                self.db = db
-                self.collection = db.chat_states
-            
-            def get_state(self, chat_id: str):
-                doc = self.collection.find_one({"chat_id": chat_id})
-                return doc.get("state", {}) if doc else {}
-            
-            def set_chat_state(self, chat_id: str, state: dict):
-                self.collection.update_one(
-                    {"chat_id": chat_id},
-                    {"$set": {"state": state, "updated_at": datetime.now()}},
-                    upsert=True
-                )
-            
-            def clear_state(self, chat_id: str):
-                self.collection.delete_one({"chat_id": chat_id})
-        
-        storage = SimpleStorage(db)
-        response = langgraph_service.run_aop(
+        # Step progress is kept per chat in chat_states
+        result = await asyncio.to_thread(
+            langgraph_service.run_aop,
             request.aop_name,
             request.user_message,
             request.chat_id,
-            storage
+            AOPStateStore(db)
         )
         
-        # Check if AOP is completed
-        current_state = storage.get_state(request.chat_id)
-        completed = not current_state.get("current_step")
-        
         return AOPResponse(
-            response=response,
+            response=result["response"],
             chat_id=request.chat_id,
-            completed=completed
+            completed=result["completed"]
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -151,6 +140,24 @@ async def get_aops(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/aops/reload")
+async def reload_aops(
+    config_service: AgentConfigService = Depends(get_agent_config_service)
+):
+    """Re-read the AOP file on every worker."""
+    try:
+        changed = await asyncio.to_thread(config_service.reload_aops)
+        return {
+            "success": True,
+            "changed": changed,
+            "count": len(config_service.aops),
+            "version": config_service.aops_version
+        }
+    except Exception as e:
+        print(f"❌ Error reloading AOPs: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/agent/stats")
 async def get_agent_stats(
     db: Database = Depends(get_database),
@@ -191,6 +198,16 @@ async def get_agent_stats(
             "model": model_name,
             "status": status,
             "initialized": langgraph_service._initialized,
+            "router": langgraph_service.intent_router.get_metrics() if langgraph_service.intent_router else None,
+            "embeddings": langgraph_service.vector_store_service.embeddings_service.get_embeddings().get_stats(),
+            "reranker": get_reranker_service().get_metrics(),
+            "context": get_context_assembler().get_metrics(),
+            "config": get_agent_config_service().get_info(),
+            "aops": langgraph_service.aop_runtime.get_metrics(),
+            "chat_flags": get_chat_flags_cache().get_metrics(),
+            "memory": get_conversation_memory().get_metrics(),
+            "llm_scheduler": langgraph_service.scheduler.get_metrics(),
+            "llm": langgraph_service.llm.get_metrics() if langgraph_service.llm else None,
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -200,34 +217,16 @@ async def get_agent_stats(
 
 @router.get("/system-prompt")
 async def get_system_prompt(
-    db: Database = Depends(get_database)
+    config_service: AgentConfigService = Depends(get_agent_config_service)
 ):
     """Get the current AI agent system prompt."""
     try:
-        if db is not None:
-            collection = db["ai-settings"]
-            settings_doc = collection.find_one({"type": "system_prompt"})
-            
-            if settings_doc:
-                return {
-                    "success": True,
-                    "system_prompt": settings_doc.get("system_prompt", ""),
-                    "updated_at": settings_doc.get("updated_at", datetime.now().isoformat())
-                }
-        
-        # Default system prompt if not found in database
-        default_prompt = (
-            "You are an AI customer concierge for this company.\n"
-            "Your job is to answer user questions clearly and professionally using the company's verified knowledge base and FAQs.\n"
-            "Always provide the actual answer — do not restate your instructions.\n"
-            "Try to summarize the answer in a few sentences. And always make sure the customer understands the answer.\n"
-            "If no relevant information is available, say so politely and offer to escalate.\n"
-        )
-        
+        updated_at = config_service.prompt_updated_at
         return {
             "success": True,
-            "system_prompt": default_prompt,
-            "updated_at": datetime.now().isoformat()
+            "system_prompt": config_service.system_prompt,
+            "version": config_service.prompt_version,
+            "updated_at": updated_at.isoformat() if isinstance(updated_at, datetime) else (updated_at or datetime.now().isoformat())
         }
     except Exception as e:
         print(f"❌ Error getting system prompt: {e}")
@@ -237,37 +236,22 @@ async def get_system_prompt(
 @router.post("/system-prompt")
 async def update_system_prompt(
     request: dict,
-    db: Database = Depends(get_database),
-    langgraph_service: LangGraphService = Depends(get_langgraph_service)
+    config_service: AgentConfigService = Depends(get_agent_config_service)
 ):
-    """Update the AI agent system prompt."""
+    """Update the AI agent system prompt (every worker switches to it within a second)."""
     try:
         system_prompt = request.get("system_prompt", "").strip()
         
         if not system_prompt:
             raise HTTPException(status_code=400, detail="System prompt cannot be empty")
         
-        if db is not None:
-            collection = db["ai-settings"]
-            collection.update_one(
-                {"type": "system_prompt"},
-                {
-                    "$set": {
-                        "system_prompt": system_prompt,
-                        "updated_at": datetime.now()
-                    }
-                },
-                upsert=True
-            )
-            print(f"✅ System prompt updated in database")
-        
-        # Update the LangGraph service's system prompt immediately
-        langgraph_service.system_prompt = system_prompt
-        print(f"✅ System prompt updated in LangGraph service")
+        version = await asyncio.to_thread(config_service.update_system_prompt, system_prompt)
+        print(f"✅ System prompt updated to v{version}")
         
         return {
             "success": True,
             "message": "System prompt updated successfully",
+            "version": version,
             "updated_at": datetime.now().isoformat()
         }
     except HTTPException:
@@ -276,3 +260,45 @@ async def update_system_prompt(
         print(f"❌ Error updating system prompt: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@router.get("/retrieval-config")
+async def get_retrieval_config(
+    dashboard_user_id: str = None,
+    retrieval_config_service: RetrievalConfigService = Depends(get_retrieval_config_service)
+):
+    """Get the effective retrieval settings (hybrid/dense, fusion weights) for a tenant."""
+    try:
+        return {
+            "success": True,
+            "dashboard_user_id": dashboard_user_id,
+            "config": retrieval_config_service.get_config(dashboard_user_id)
+        }
+    except Exception as e:
+        print(f"❌ Error getting retrieval config: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/retrieval-config")
+async def update_retrieval_config(
+    request: dict,
+    retrieval_config_service: RetrievalConfigService = Depends(get_retrieval_config_service)
+):
+    """Override retrieval settings for a tenant."""
+    try:
+        dashboard_user_id = request.get("dashboard_user_id")
+        if not dashboard_user_id:
+            raise HTTPException(status_code=400, detail="dashboard_user_id is required")
+        
+        config = retrieval_config_service.update_config(dashboard_user_id, request.get("config", {}))
+        print(f"✅ Retrieval config updated for {dashboard_user_id}")
+        
+        return {
+            "success": True,
+            "dashboard_user_id": dashboard_user_id,
+            "config": config
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error updating retrieval config: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
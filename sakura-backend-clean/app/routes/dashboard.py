@@ -20,6 +20,8 @@ from app.services.faq_embedding_service import get_faq_embedding_service
 from app.services.langgraph_service import get_langgraph_service
 from app.services.embeddings_service import get_embeddings_service
 from app.services.redis_publisher import publish_event
+from app.services.chat_flags_cache import get_chat_flags_cache
+from app.services.index_sync import notify_chat_flags_update
 
 router = APIRouter(prefix="/api", tags=["Dashboard"])
 
@@ -808,6 +810,10 @@ async def toggle_ai_agent(chat_id: str, request: dict, db: Database = Depends(ge
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Chat not found")
         
+        # Apply to this worker's cached flags and have the other workers drop theirs
+        get_chat_flags_cache().set_ai_agent_enabled(chat_id, enabled)
+        await asyncio.to_thread(notify_chat_flags_update, chat_id)
+        
         return {
             "success": True,
             "ai_agent_enabled": enabled,
@@ -829,7 +835,7 @@ async def get_ai_agent_status(chat_id: str, db: Database = Depends(get_database)
             raise HTTPException(status_code=503, detail="Database not available")
         
         chats_collection = db["customer-chats"]
-        chat_doc = chats_collection.find_one({"chat_id": chat_id})
+        chat_doc = chats_collection.find_one({"chat_id": chat_id}, {"_id": 0, "ai_agent_enabled": 1})
         
         if not chat_doc:
             raise HTTPException(status_code=404, detail="Chat not found")
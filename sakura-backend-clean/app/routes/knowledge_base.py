@@ -104,8 +104,6 @@ def remove_website_chunks_from_vector_store(
         
         # Get all documents from the vector store
         # FAISS stores documents in docstore, we need to filter them
-        from app.core.settings import get_settings
-        settings = get_settings()
         
         # Access the docstore to get all documents
         docstore = vector_store.docstore
@@ -165,14 +163,10 @@ def remove_website_chunks_from_vector_store(
             print(f"🔄 Rebuilding vector store with {len(documents_to_keep)} documents (removed {removed_count} from website {website_id})...")
             
             # Create new vector store from remaining documents
-            embeddings = vector_store_service.embeddings_service.get_embeddings()
-            new_vector_store = FAISS.from_documents(documents_to_keep, embeddings)
-            
-            # Save the updated index
-            new_vector_store.save_local(str(settings.faiss_index_path))
+            new_vector_store = vector_store_service.build_vector_store(documents_to_keep)
             
-            # Update the vector store service instance
-            vector_store_service.vector_store = new_vector_store
+            # Publish as a new index version and hot-swap every worker onto it
+            vector_store_service.publish(new_vector_store)
             
             print(f"✅ Removed {removed_count} chunks from website {website_id}")
         else:
@@ -183,8 +177,8 @@ def remove_website_chunks_from_vector_store(
                 ["Welcome to Sakura AI Assistant!"],
                 embeddings
             )
-            new_vector_store.save_local(str(settings.faiss_index_path))
-            vector_store_service.vector_store = new_vector_store
+            # Publish as a new index version and hot-swap every worker onto it
+            vector_store_service.publish(new_vector_store)
             print(f"✅ Removed all chunks from website {website_id} (index now minimal)")
         
         return True
@@ -483,7 +477,8 @@ async def create_faq(
             faq_embedding_service.add_faq_embedding(
                 faq_id=faq_id,
                 question=request.question,
-                answer=request.answer
+                answer=request.answer,
+                dashboard_user_id=request.dashboard_user_id
             )
         
         background_tasks.add_task(generate_embedding)
@@ -546,7 +541,8 @@ async def update_faq(
             faq_embedding_service.update_faq_embedding(
                 faq_id=faq_id,
                 question=request.question,
-                answer=request.answer
+                answer=request.answer,
+                dashboard_user_id=request.dashboard_user_id or existing.get("dashboard_user_id")
             )
         
         background_tasks.add_task(update_embedding)
@@ -592,13 +588,9 @@ async def delete_faq(
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="FAQ not found")
         
-        # Delete embedding in background task and rebuild index
+        # Remove the FAQ from the FAQ indexes in the background
         def delete_embedding():
-            faq_embedding_service.delete_faq_embedding(
-                faq_id=faq_id,
-                db=db,
-                rebuild_after_delete=True
-            )
+            faq_embedding_service.delete_faq_embedding(faq_id=faq_id)
         
         background_tasks.add_task(delete_embedding)
         
@@ -640,13 +632,9 @@ async def delete_multiple_faqs(
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="No FAQs found to delete")
         
-        # Delete embeddings in background task and rebuild index
+        # Remove the FAQs from the FAQ indexes in the background
         def delete_embeddings():
-            faq_embedding_service.delete_multiple_faq_embeddings(
-                faq_ids=valid_faq_ids,
-                db=db,
-                rebuild_after_delete=True
-            )
+            faq_embedding_service.delete_multiple_faq_embeddings(faq_ids=valid_faq_ids)
         
         background_tasks.add_task(delete_embeddings)
         
@@ -664,6 +652,7 @@ class FAQSearchRequest(BaseModel):
     query: str = Field(..., min_length=1, max_length=500)
     top_k: int = Field(default=5, ge=1, le=20)
     score_threshold: float = Field(default=0.0, ge=0.0, le=1.0)
+    dashboard_user_id: Optional[str] = None  # Search all of this tenant's FAQs, not only enabled ones
 
 
 class FAQSearchResult(BaseModel):
@@ -689,32 +678,31 @@ async def search_faqs(
         results = faq_embedding_service.search_similar_faqs(
             query=request.query,
             top_k=request.top_k,
-            score_threshold=request.score_threshold
+            score_threshold=request.score_threshold,
+            dashboard_user_id=request.dashboard_user_id
         )
         
-        # Fetch full FAQ details from database for each result
-        if db is not None:
-            collection = db.faqs
-            enhanced_results = []
-            
-            for result in results:
-                faq_id = result["faq_id"]
-                if ObjectId.is_valid(faq_id):
-                    faq_doc = collection.find_one({"_id": ObjectId(faq_id)})
-                    if faq_doc:
-                        enhanced_results.append(FAQSearchResult(
-                            faq_id=faq_id,
-                            question=faq_doc.get("question", result.get("question", "")),
-                            answer=faq_doc.get("answer", result.get("answer", "")),
-                            score=result.get("score", 0.0),
-                            distance=result.get("distance", 0.0)
-                        ))
-            
-            # Return enhanced results if available, otherwise return basic results
-            if enhanced_results:
-                return enhanced_results
+        # Results already carry the question and answer from the FAQ index; one
+        # $in query picks up edits since indexing and drops deleted FAQs
+        if db is not None and results:
+            object_ids = [ObjectId(result["faq_id"]) for result in results if ObjectId.is_valid(result["faq_id"])]
+            current = {
+                str(faq_doc["_id"]): faq_doc
+                for faq_doc in db.faqs.find({"_id": {"$in": object_ids}}, {"question": 1, "answer": 1})
+            }
+            if current:
+                return [
+                    FAQSearchResult(
+                        faq_id=result["faq_id"],
+                        question=current[result["faq_id"]].get("question", result.get("question", "")),
+                        answer=current[result["faq_id"]].get("answer", result.get("answer", "")),
+                        score=result.get("score", 0.0),
+                        distance=result.get("distance", 0.0)
+                    )
+                    for result in results
+                    if result["faq_id"] in current
+                ]
         
-        # Fallback to basic results if database is not available
         return [
             FAQSearchResult(**result) for result in results
         ]
@@ -774,9 +762,6 @@ def remove_file_chunks_from_vector_store(
             logger.warning("❌ Vector store instance not available")
             return False
         
-        from app.core.settings import get_settings
-        settings = get_settings()
-        
         # Access the docstore to get all documents
         docstore = vector_store.docstore
         
@@ -807,10 +792,9 @@ def remove_file_chunks_from_vector_store(
         if documents_to_keep:
             logger.info(f"🔄 Rebuilding vector store with {len(documents_to_keep)} documents (removed {removed_count} from file {file_id})...")
             
-            embeddings = vector_store_service.embeddings_service.get_embeddings()
-            new_vector_store = FAISS.from_documents(documents_to_keep, embeddings)
-            new_vector_store.save_local(str(settings.faiss_index_path))
-            vector_store_service.vector_store = new_vector_store
+            new_vector_store = vector_store_service.build_vector_store(documents_to_keep)
+            # Publish as a new index version and hot-swap every worker onto it
+            vector_store_service.publish(new_vector_store)
             
             logger.info(f"✅ Removed {removed_count} chunks from file {file_id}")
         else:
@@ -821,8 +805,8 @@ def remove_file_chunks_from_vector_store(
                 ["Welcome to Sakura AI Assistant!"],
                 embeddings
             )
-            new_vector_store.save_local(str(settings.faiss_index_path))
-            vector_store_service.vector_store = new_vector_store
+            # Publish as a new index version and hot-swap every worker onto it
+            vector_store_service.publish(new_vector_store)
             logger.info(f"✅ Removed all chunks from file {file_id} (index now minimal)")
         
         return True
@@ -834,6 +818,27 @@ def remove_file_chunks_from_vector_store(
         return False
 
 
+async def save_upload_to_disk(upload: UploadFile, destination: Path, max_bytes: int, block_size: int) -> int:
+    """
+    Stream an upload to disk block by block, enforcing a size limit.
+    Returns the number of bytes written. Raises HTTPException(413) if the limit is exceeded.
+    """
+    written = 0
+    with open(destination, 'wb') as f:
+        while True:
+            block = await upload.read(block_size)
+            if not block:
+                break
+            written += len(block)
+            if written > max_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File too large. Maximum size is {max_bytes // (1024 * 1024)} MB"
+                )
+            f.write(block)
+    return written
+
+
 @router.post("/files", response_model=FileResponse, status_code=202)
 async def upload_file(
     file: UploadFile = FastAPIFile(...),
@@ -872,11 +877,13 @@ async def upload_file(
     temp_file_path = temp_dir / f"{file_id}_{file.filename}"
     
     try:
-        # Save uploaded file
-        with open(temp_file_path, 'wb') as f:
-            content = await file.read()
-            f.write(content)
-            file_size = len(content)
+        # Stream uploaded file to disk without buffering it in memory
+        file_size = await save_upload_to_disk(
+            file,
+            temp_file_path,
+            max_bytes=file_processing_service.max_upload_bytes,
+            block_size=file_processing_service.upload_block_size
+        )
         
         # Create initial file entry in database
         db = get_database()
@@ -956,6 +963,10 @@ async def upload_file(
         
         return FileResponse(**initial_file)
         
+    except HTTPException:
+        if temp_file_path.exists():
+            temp_file_path.unlink()
+        raise
     except Exception as e:
         # Clean up temp file on error
         if temp_file_path.exists():
@@ -1010,3 +1021,16 @@ async def delete_file(
     
     return {"message": "File deleted successfully", "file_id": file_id}
 
+
+
+# ==================== Vector Index Endpoints ====================
+
+@router.get("/index")
+async def get_vector_index_info(
+    vector_store_service: VectorStoreService = Depends(get_vector_store_service)
+):
+    """
+    Describe the live vector index (type, size, nprobe/efSearch, memory estimate)
+    and the recall-vs-latency report from the last rebuild.
+    """
+    return vector_store_service.get_index_info()
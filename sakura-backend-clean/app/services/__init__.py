@@ -1,14 +1,37 @@
 # Business logic services
-from .embeddings_service import EmbeddingsService, init_embeddings_service, get_embeddings_service
-from .vector_store_service import VectorStoreService, init_vector_store_service, get_vector_store_service
-from .langgraph_service import LangGraphService, init_langgraph_service, get_langgraph_service
-from .file_processing_service import FileProcessingService, init_file_processing_service, get_file_processing_service
-from .redis_publisher import (
-    init_redis_publisher,
-    get_redis_publisher,
-    publish_event,
-    close_redis_publisher,
-)
+#
+# Exports are resolved on first access: importing one service module (for
+# example in an extraction worker process, which unpickles its task functions
+# from app.services.document_extraction_engine) must not load torch, FAISS and
+# langchain through the others.
+import importlib
+
+_EXPORTS = {
+    "EmbeddingsService": "embeddings_service",
+    "init_embeddings_service": "embeddings_service",
+    "get_embeddings_service": "embeddings_service",
+    "VectorStoreService": "vector_store_service",
+    "init_vector_store_service": "vector_store_service",
+    "get_vector_store_service": "vector_store_service",
+    "LangGraphService": "langgraph_service",
+    "init_langgraph_service": "langgraph_service",
+    "get_langgraph_service": "langgraph_service",
+    "FileProcessingService": "file_processing_service",
+    "init_file_processing_service": "file_processing_service",
+    "get_file_processing_service": "file_processing_service",
+    "init_redis_publisher": "redis_publisher",
+    "get_redis_publisher": "redis_publisher",
+    "publish_event": "redis_publisher",
+    "close_redis_publisher": "redis_publisher",
+}
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(f".{module}", __name__), name)
+
 
 __all__ = [
     "EmbeddingsService",
@@ -0,0 +1,179 @@
+"""
+Hot-reloadable agent configuration: the system prompt and the AOPs.
+
+The system prompt lives in the ai-settings document {"type": "system_prompt"}
+together with a version counter that every update increments; AOPs come from
+the JSON file at AOPS_FILE_PATH, versioned by its modification time. Each worker
+keeps both in memory and reloads them when:
+- another worker announces a change on the config Redis channel (within a
+  second, via the index sync listener);
+- the periodic index sync poll finds a newer version (catches missed messages);
+- this worker makes the change itself.
+Listeners registered with add_listener (the LangGraph service) are called after
+every reload that changed something.
+"""
+import json
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.database import Database
+
+from app.core.settings import Settings
+from app.services.index_sync import notify_config_update
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYSTEM_PROMPT = (
+    "You are an AI customer concierge for this company.\n"
+    "Your job is to answer user questions clearly and professionally using the company's verified knowledge base and FAQs.\n"
+    "Always provide the actual answer — do not restate your instructions.\n"
+    "Try to summarize the answer in a few sentences. And always make sure the customer understands the answer.\n"
+    "If no relevant information is available, say so politely and offer to escalate.\n"
+)
+
+DEFAULT_AOPS = [
+    {
+        "aop_name": "Customer Support",
+        "description": "Handle general customer inquiries",
+        "steps": [
+            {
+                "id": "greet_customer",
+                "type": "action",
+                "action": "greet_customer",
+                "user_prompt": "Hello! How can I help you today?",
+                "success_next": "handle_inquiry"
+            }
+        ]
+    }
+]
+
+
+class AgentConfigService:
+    """Cached, versioned system prompt and AOPs shared by every worker."""
+
+    def __init__(self, settings: Settings, db: Optional[Database] = None):
+        self.settings = settings
+        self.db = db
+        self.system_prompt: str = DEFAULT_SYSTEM_PROMPT
+        self.prompt_version = 0
+        self.prompt_updated_at: Optional[datetime] = None
+        self.aops: List[Dict] = []
+        self.aops_version: Optional[int] = None
+        self._listeners: List[Callable[["AgentConfigService"], None]] = []
+        self._lock = threading.Lock()
+        self.reload()
+
+    def add_listener(self, listener: Callable[["AgentConfigService"], None]) -> None:
+        """Call listener(config) after every reload that changed the prompt or AOPs."""
+        self._listeners.append(listener)
+
+    def _load_prompt(self) -> bool:
+        if self.db is None:
+            return False
+        doc = self.db["ai-settings"].find_one(
+            {"type": "system_prompt"}, {"system_prompt": 1, "version": 1, "updated_at": 1}
+        )
+        if not doc or not doc.get("system_prompt"):
+            return False
+        version = doc.get("version", 0)
+        if version == self.prompt_version and doc["system_prompt"] == self.system_prompt:
+            return False
+        self.system_prompt = doc["system_prompt"]
+        self.prompt_version = version
+        self.prompt_updated_at = doc.get("updated_at")
+        print(f"✅ Loaded system prompt v{version} from database")
+        return True
+
+    def _load_aops(self) -> bool:
+        aop_path = Path(self.settings.aops_file_path)
+        if not aop_path.exists():
+            if self.aops_version is None:
+                self.aops = DEFAULT_AOPS
+                self.aops_version = 0
+                print("📂 Created default AOPs")
+                return True
+            return False
+        mtime = aop_path.stat().st_mtime_ns
+        if mtime == self.aops_version:
+            return False
+        with open(aop_path, "r", encoding="utf-8") as f:
+            self.aops = json.load(f)
+        self.aops_version = mtime
+        print(f"📂 Loaded {len(self.aops)} AOPs")
+        return True
+
+    def reload(self) -> bool:
+        """Reload whatever changed since the last load; True if anything did. Cheap when nothing did."""
+        with self._lock:
+            changed = False
+            try:
+                changed |= self._load_prompt()
+            except Exception as e:
+                logger.warning(f"⚠️ Error loading system prompt from database: {e}")
+            try:
+                changed |= self._load_aops()
+            except Exception as e:
+                logger.error(f"❌ Error loading AOPs: {e}")
+        if changed:
+            for listener in self._listeners:
+                listener(self)
+        return changed
+
+    def update_system_prompt(self, system_prompt: str) -> int:
+        """Store a new system prompt, apply it here and announce it to the other workers. Returns its version."""
+        updated_at = datetime.now()
+        if self.db is not None:
+            doc = self.db["ai-settings"].find_one_and_update(
+                {"type": "system_prompt"},
+                {"$set": {"system_prompt": system_prompt, "updated_at": updated_at}, "$inc": {"version": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+                projection={"version": 1},
+            )
+            version = doc["version"]
+        else:
+            version = self.prompt_version + 1
+        with self._lock:
+            self.system_prompt = system_prompt
+            self.prompt_version = version
+            self.prompt_updated_at = updated_at
+        for listener in self._listeners:
+            listener(self)
+        notify_config_update("system_prompt", version)
+        return version
+
+    def reload_aops(self) -> bool:
+        """Re-read the AOP file now and tell the other workers to do the same."""
+        changed = self.reload()
+        notify_config_update("aops", self.aops_version)
+        return changed
+
+    def get_info(self) -> Dict:
+        return {
+            "prompt_version": self.prompt_version,
+            "prompt_updated_at": self.prompt_updated_at.isoformat() if isinstance(self.prompt_updated_at, datetime) else self.prompt_updated_at,
+            "aops_version": self.aops_version,
+            "aop_count": len(self.aops),
+        }
+
+
+# Global config instance
+_agent_config_service: Optional[AgentConfigService] = None
+
+
+def init_agent_config_service(settings: Settings, db: Optional[Database] = None) -> AgentConfigService:
+    """Initialize the agent configuration and load it."""
+    global _agent_config_service
+    _agent_config_service = AgentConfigService(settings, db=db)
+    return _agent_config_service
+
+
+def get_agent_config_service() -> AgentConfigService:
+    """Get the agent configuration instance."""
+    if _agent_config_service is None:
+        raise Exception("Agent config service not initialized. Call init_agent_config_service() first.")
+    return _agent_config_service
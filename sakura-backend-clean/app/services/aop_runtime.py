@@ -0,0 +1,530 @@
+"""
+Agent Operating Procedure (AOP) runtime.
+
+Each AOP in aops.json is compiled once (and again after a config reload) into a
+state machine indexed by step id, with decision conditions pre-parsed. A turn
+then runs locally: it resumes the chat's current step and keeps taking
+transitions until a step needs the customer's input or the procedure ends. The
+chat's progress is written back with one upsert per turn.
+
+Most steps need no LLM:
+- decisions over procedure variables ("booking_status == 'confirmed'") are
+  evaluated directly;
+- customer input with a recognisable shape (booking references, payment
+  methods, yes/no answers) is extracted with patterns;
+- actions run through registered handlers (see register_aop_action). An
+  action without a handler fails, like a handler that fails, so the procedure
+  takes its failure branch (by default the escalation step) rather than telling
+  the customer something happened that did not. Identity verification looks the
+  booking up in the bookings collection (AOP_BOOKINGS_COLLECTION), checks it
+  belongs to the chat's customer, and sets booking_status and the fare fields
+  the later steps branch on. Escalation turns the AI agent off for the chat so
+  a human agent takes over.
+The LLM is only called to read free-form input that no pattern covers, or to
+pick a decision branch from an ambiguous reply.
+"""
+import os
+import ast
+import re
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pymongo.database import Database
+
+from app.services.chat_flags_cache import get_chat_flags_cache
+from app.services.index_sync import notify_chat_flags_update
+
+logger = logging.getLogger(__name__)
+
+# Transitions per turn before the runtime assumes a cycle and escalates
+MAX_TRANSITIONS = 50
+# Invalid replies to one step before its failure branch is taken
+MAX_INPUT_ATTEMPTS = 3
+ESCALATION_STEP = "escalate_to_human"
+# Said when a step fails and the chat cannot be handed to a human either
+UNAVAILABLE_MESSAGE = os.getenv(
+    "AOP_UNAVAILABLE_MESSAGE",
+    "I'm sorry, I couldn't complete this request. Please contact our support team for help.",
+)
+
+_YES = {"yes", "y", "yeah", "yep", "sure", "ok", "okay", "confirm", "confirmed", "accept", "proceed", "correct", "please do"}
+_NO = {"no", "n", "nope", "cancel", "decline", "stop", "don't", "dont", "not now", "never mind", "nevermind"}
+_PAYMENT_METHODS = {
+    "card": "card", "credit": "card", "debit": "card", "visa": "card", "mastercard": "card", "amex": "card",
+    "paypal": "paypal", "wallet": "wallet", "apple pay": "wallet", "google pay": "wallet",
+    "bank": "bank_transfer", "transfer": "bank_transfer",
+}
+_BOOKING_REFERENCE = re.compile(r"\b(?=[A-Za-z0-9]*\d)[A-Za-z0-9]{6,8}\b")
+
+# action name -> handler(variables, step, db, chat_id) -> (success, variable updates)
+ActionHandler = Callable[[Dict, Dict, Optional[Database], str], Tuple[bool, Dict]]
+_action_handlers: Dict[str, ActionHandler] = {}
+
+
+def register_aop_action(name: str):
+    """Decorator registering the handler that performs an AOP action."""
+    def decorator(handler: ActionHandler) -> ActionHandler:
+        _action_handlers[name] = handler
+        return handler
+    return decorator
+
+
+# Booking fields copied into the procedure's variables, by variable name
+_BOOKING_FIELDS = {
+    "booking_status": "status",
+    "ticket_class": "ticket_class",
+    "promo_or_flex": "fare_type",
+    "fare_paid": "fare_paid",
+}
+
+
+def _booking_email_field() -> str:
+    return os.getenv("AOP_BOOKING_EMAIL_FIELD", "customer_email")
+
+
+def _lookup_booking(db: Optional[Database], booking_reference: str) -> Optional[Dict]:
+    if db is None:
+        return None
+    collection = os.getenv("AOP_BOOKINGS_COLLECTION", "bookings")
+    projection = {"_id": 0, _booking_email_field(): 1, **{field: 1 for field in _BOOKING_FIELDS.values()}}
+    return db[collection].find_one({"booking_reference": booking_reference.upper()}, projection)
+
+
+def _chat_customer_email(db: Database, chat_id: str) -> Optional[str]:
+    """Email of the customer a chat belongs to (customer-chats.user_id -> customers._id)."""
+    chat = db["customer-chats"].find_one({"chat_id": chat_id}, {"_id": 0, "user_id": 1})
+    if not chat or chat.get("user_id") is None:
+        return None
+    customer = db.customers.find_one({"_id": chat["user_id"]}, {"_id": 0, "email": 1})
+    return (customer or {}).get("email")
+
+
+@register_aop_action("verify_customer_identity")
+def _verify_customer_identity(variables: Dict, step: Dict, db: Optional[Database], chat_id: str) -> Tuple[bool, Dict]:
+    """
+    Find the booking and check it belongs to the chat's customer (the booking's
+    AOP_BOOKING_EMAIL_FIELD matches the customer's email). An unknown reference,
+    or one booked by someone else, fails verification.
+    """
+    reference = variables.get("booking_reference")
+    if not reference:
+        return False, {}
+    booking = _lookup_booking(db, reference)
+    if booking is None:
+        logger.info(f"🔍 No booking found for reference {reference}")
+        return False, {}
+    customer_email = _chat_customer_email(db, chat_id)
+    booking_email = booking.get(_booking_email_field())
+    if not customer_email or not booking_email or customer_email.strip().lower() != str(booking_email).strip().lower():
+        logger.info(f"🔍 Booking {reference} does not belong to the customer of chat {chat_id}")
+        return False, {}
+    updates = {name: booking[field] for name, field in _BOOKING_FIELDS.items() if booking.get(field) is not None}
+    if isinstance(updates.get("booking_status"), str):
+        updates["booking_status"] = updates["booking_status"].lower()
+    return True, updates
+
+
+@register_aop_action("escalate_ticket_to_agent")
+def _escalate_ticket_to_agent(variables: Dict, step: Dict, db: Optional[Database], chat_id: str) -> Tuple[bool, Dict]:
+    """Hand the chat to a human agent: the AI agent stops answering it."""
+    if db is None:
+        return False, {}
+    reason = variables.get("reason") or f"AOP escalation at step {variables.get('escalated_from', 'unknown')}"
+    result = db["customer-chats"].update_one(
+        {"chat_id": chat_id},
+        {"$set": {"ai_agent_enabled": False, "escalation_reason": reason, "updated_at": datetime.now()}},
+    )
+    if result.matched_count == 0:
+        return False, {}
+    # Same path as a dashboard toggle: this worker's cached flags, then the other workers'
+    try:
+        get_chat_flags_cache().set_ai_agent_enabled(chat_id, False)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not update cached flags for chat {chat_id}: {e}")
+    try:
+        notify_chat_flags_update(chat_id)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not announce AI agent hand-over for chat {chat_id}: {e}")
+    print(f"🙋 Escalated chat {chat_id} to a human agent: {reason}")
+    return True, {"escalated": True, "reason": reason}
+
+
+@register_aop_action("log_case_closure")
+def _log_case_closure(variables: Dict, step: Dict, db: Optional[Database], chat_id: str) -> Tuple[bool, Dict]:
+    """Record how the procedure ended; the run's state is saved as completed by the runtime."""
+    resolution = variables.get("resolution") or ("escalated" if variables.get("escalated") else "resolved")
+    logger.info(f"📁 Closed AOP case for chat {chat_id}: {resolution}")
+    return True, {"resolution": resolution}
+
+
+# ---------- Input extraction ----------
+
+def _words(text: str) -> str:
+    return " " + " ".join(re.findall(r"[a-z']+", text.lower())) + " "
+
+
+def _yes_no(text: str) -> Optional[bool]:
+    words = _words(text)
+    said_yes = any(f" {word} " in words for word in _YES)
+    said_no = any(f" {word} " in words for word in _NO)
+    if said_yes != said_no:
+        return said_yes
+    return None
+
+
+def _extract_pattern(expected_input: str, text: str) -> Tuple[bool, Optional[str]]:
+    """(handled, value): handled is False when no pattern covers this kind of input."""
+    expected = expected_input.lower()
+    if "booking reference" in expected:
+        match = _BOOKING_REFERENCE.search(text)
+        return True, match.group(0).upper() if match else None
+    if "payment method" in expected:
+        lowered = text.lower()
+        return True, next((method for keyword, method in _PAYMENT_METHODS.items() if keyword in lowered), None)
+    if "yes or no" in expected:
+        answer = _yes_no(text)
+        return True, None if answer is None else ("yes" if answer else "no")
+    return False, None
+
+
+# ---------- Conditions ----------
+
+class _Undetermined(Exception):
+    """A condition refers to a variable the procedure does not have yet."""
+
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.Compare, ast.Eq, ast.NotEq,
+    ast.In, ast.NotIn, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Name, ast.Load, ast.Constant, ast.Tuple, ast.List,
+)
+
+
+def _compile_condition(condition: str) -> Optional[ast.Expression]:
+    try:
+        tree = ast.parse(condition, mode="eval")
+    except SyntaxError:
+        return None
+    if not all(isinstance(node, _ALLOWED_NODES) for node in ast.walk(tree)):
+        return None
+    return tree
+
+
+def _evaluate(node: ast.AST, variables: Dict) -> Any:
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body, variables)
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        if node.id not in variables:
+            raise _Undetermined(node.id)
+        return variables[node.id]
+    if isinstance(node, (ast.Tuple, ast.List)):
+        return [_evaluate(element, variables) for element in node.elts]
+    if isinstance(node, ast.UnaryOp):
+        return not _evaluate(node.operand, variables)
+    if isinstance(node, ast.BoolOp):
+        values = (_evaluate(value, variables) for value in node.values)
+        return all(values) if isinstance(node.op, ast.And) else any(values)
+    left = _evaluate(node.left, variables)
+    for op, comparator in zip(node.ops, node.comparators):
+        right = _evaluate(comparator, variables)
+        if isinstance(op, ast.Eq):
+            ok = left == right
+        elif isinstance(op, ast.NotEq):
+            ok = left != right
+        elif isinstance(op, ast.In):
+            ok = left in right
+        elif isinstance(op, ast.NotIn):
+            ok = left not in right
+        elif isinstance(op, ast.Lt):
+            ok = left < right
+        elif isinstance(op, ast.LtE):
+            ok = left <= right
+        elif isinstance(op, ast.Gt):
+            ok = left > right
+        else:
+            ok = left >= right
+        if not ok:
+            return False
+        left = right
+    return True
+
+
+# ---------- Compiled procedures ----------
+
+class CompiledAOP:
+    """An AOP's steps indexed by id, with decision conditions parsed once."""
+
+    def __init__(self, aop: Dict):
+        self.name = aop["aop_name"]
+        self.steps: Dict[str, Dict] = {}
+        self.conditions: Dict[str, List[Tuple[str, Optional[ast.Expression], Optional[str]]]] = {}
+        for step in aop.get("steps", []):
+            self.steps[step["id"]] = step
+            if step.get("type") == "decision":
+                self.conditions[step["id"]] = [
+                    (branch.get("condition", ""), _compile_condition(branch.get("condition", "")), branch.get("next"))
+                    for branch in step.get("decision_logic", [])
+                ]
+        self.start = aop["steps"][0]["id"] if aop.get("steps") else None
+        self.escalation = ESCALATION_STEP if ESCALATION_STEP in self.steps else None
+        # Actions no handler is registered for; those steps always take their failure branch
+        self.missing_actions = sorted({
+            step["action"] for step in self.steps.values()
+            if step.get("type") != "decision" and step.get("action") and step["action"] not in _action_handlers
+        })
+
+
+class AOPStateStore:
+    """Per-chat AOP progress in the chat_states collection, one document per chat."""
+
+    def __init__(self, db: Optional[Database]):
+        self.db = db
+        self._memory: Dict[str, Dict] = {}  # Used when there is no database
+
+    def get_state(self, chat_id: str) -> Dict:
+        if self.db is None:
+            return dict(self._memory.get(chat_id, {}))
+        doc = self.db.chat_states.find_one({"chat_id": chat_id}, {"state": 1})
+        return doc.get("state", {}) if doc else {}
+
+    def set_chat_state(self, chat_id: str, state: Dict) -> None:
+        if self.db is None:
+            self._memory[chat_id] = dict(state)
+            return
+        self.db.chat_states.update_one(
+            {"chat_id": chat_id},
+            {"$set": {"state": state, "updated_at": datetime.now()}},
+            upsert=True
+        )
+
+    def clear_state(self, chat_id: str) -> None:
+        if self.db is None:
+            self._memory.pop(chat_id, None)
+            return
+        self.db.chat_states.delete_one({"chat_id": chat_id})
+
+
+class AOPRuntime:
+    """Runs compiled AOPs turn by turn for each chat."""
+
+    def __init__(self, llm_invoke: Optional[Callable[[str], str]] = None):
+        # Takes a prompt and returns the model's text; only used for free-form input
+        self.llm_invoke = llm_invoke
+        self._compiled: Dict[str, CompiledAOP] = {}
+        self._lock = threading.Lock()
+        self._metrics = {"turns": 0, "transitions": 0, "llm_calls": 0, "completed": 0}
+
+    def load(self, aops: List[Dict]) -> None:
+        """Compile the AOPs; runs once per config version, not per turn."""
+        compiled = {}
+        for aop in aops:
+            try:
+                compiled[aop["aop_name"]] = CompiledAOP(aop)
+                if compiled[aop["aop_name"]].missing_actions:
+                    logger.warning(
+                        f"⚠️ AOP '{aop['aop_name']}' has actions without handlers, which will fail and escalate: "
+                        f"{', '.join(compiled[aop['aop_name']].missing_actions)}"
+                    )
+            except Exception as e:
+                print(f"❌ Error compiling AOP {aop.get('aop_name')}: {e}")
+        self._compiled = compiled
+        print(f"⚙️  Compiled {len(compiled)} AOPs")
+
+    def has_aop(self, aop_name: str) -> bool:
+        return aop_name in self._compiled
+
+    def _ask_llm(self, prompt: str) -> Optional[Dict]:
+        if self.llm_invoke is None:
+            return None
+        with self._lock:
+            self._metrics["llm_calls"] += 1
+        try:
+            text = self.llm_invoke(prompt)
+            match = re.search(r"\{.*\}", text, re.S)
+            return json.loads(match.group(0)) if match else None
+        except Exception as e:
+            logger.warning(f"⚠️ AOP LLM call failed: {e}")
+            return None
+
+    def _extract(self, step: Dict, text: str) -> Optional[str]:
+        """The value a step asked the customer for, or None if the reply does not contain it."""
+        expected = step.get("expected_input", "")
+        handled, value = _extract_pattern(expected, text)
+        if handled:
+            return value
+        answer = self._ask_llm(
+            "Extract what a customer support procedure asked for from the customer's reply.\n"
+            f"Asked for: {expected}\nReply: {text}\n"
+            'Answer with JSON only: {"valid": true, "value": "..."} or {"valid": false}.'
+        )
+        if answer and answer.get("valid") and answer.get("value"):
+            return str(answer["value"])
+        return None
+
+    def _choose_branch(self, aop: CompiledAOP, step: Dict, variables: Dict, text: Optional[str]) -> Optional[str]:
+        """Next step id of a decision, or None if no branch applies."""
+        branches = aop.conditions.get(step["id"], [])
+        # Conditions over known procedure variables
+        for _, tree, next_step in branches:
+            if tree is None:
+                continue
+            try:
+                if _evaluate(tree, variables):
+                    return next_step
+            except _Undetermined:
+                continue
+            except Exception:
+                continue
+        if text is None:
+            return None
+        # Customer's answer: yes picks the accepting branch, no the declining one
+        answer = _yes_no(text)
+        if answer is not None:
+            wanted = ("accept", "confirm", "agree", "yes") if answer else ("decline", "cancel", "reject", "no")
+            for condition, _, next_step in branches:
+                if any(word in condition.lower() for word in wanted):
+                    return next_step
+        options = "\n".join(f"{i}. {condition}" for i, (condition, _, _) in enumerate(branches))
+        choice = self._ask_llm(
+            f"A customer support procedure asked: {step.get('user_prompt', '')}\nCustomer replied: {text}\n"
+            f"Which of these describes the reply?\n{options}\n"
+            'Answer with JSON only: {"option": <number>} or {"option": null} if none fits.'
+        )
+        option = choice.get("option") if choice else None
+        if isinstance(option, int) and 0 <= option < len(branches):
+            return branches[option][2]
+        return None
+
+    def run(self, aop_name: str, user_message: str, chat_id: str, storage: AOPStateStore) -> Dict:
+        """
+        Advance a chat's procedure with the customer's message. Returns the
+        response text and whether the procedure has finished.
+        """
+        aop = self._compiled.get(aop_name)
+        if aop is None:
+            return {"response": f"AOP '{aop_name}' not found", "completed": True}
+
+        state = storage.get_state(chat_id)
+        new_run = state.get("aop_name") != aop_name or not state.get("current_step") or state["current_step"] not in aop.steps
+        if new_run:
+            # New run (or the procedure changed under an old run): start over
+            state = {"aop_name": aop_name, "current_step": aop.start, "variables": {}, "attempts": 0, "started_at": datetime.now()}
+            print(f"🚀 Starting AOP '{aop_name}' for chat {chat_id}")
+        variables = state["variables"]
+        pending_input: Optional[str] = user_message
+        messages: List[str] = []
+        step_id = state["current_step"]
+        transitions = 0
+
+        while step_id is not None:
+            if transitions >= MAX_TRANSITIONS:
+                logger.error(f"❌ AOP '{aop_name}' did not settle after {MAX_TRANSITIONS} transitions, ending it")
+                step_id = None
+                break
+            step = aop.steps.get(step_id)
+            if step is None:
+                logger.error(f"❌ AOP '{aop_name}' has no step '{step_id}'")
+                step_id = aop.escalation if step_id != aop.escalation else None
+                continue
+
+            awaits_input = bool(step.get("requires_response"))
+            # The message that started the run is only used if it already answers the first question
+            opening = new_run and transitions == 0
+            if awaits_input and pending_input is None:
+                # Wait here for the customer's reply
+                messages.append(step.get("user_prompt", ""))
+                break
+
+            next_step: Optional[str]
+            if step.get("type") == "decision":
+                text = pending_input if awaits_input else None
+                next_step = self._choose_branch(aop, step, variables, text)
+                if awaits_input:
+                    pending_input = None
+                else:
+                    messages.append(step.get("user_prompt", ""))
+                if next_step is None and awaits_input:
+                    # No branch fits the customer's answer: ask again, then hand over
+                    if opening:
+                        messages.append(step.get("user_prompt", ""))
+                        break
+                    state["attempts"] = state.get("attempts", 0) + 1
+                    if state["attempts"] < MAX_INPUT_ATTEMPTS:
+                        messages.append(f"Sorry, I didn't catch that. {step.get('user_prompt', '')}")
+                        break
+                if next_step is None:
+                    next_step = aop.escalation
+            else:
+                success = True
+                if awaits_input:
+                    value = self._extract(step, pending_input)
+                    pending_input = None
+                    if value is None:
+                        if opening:
+                            messages.append(step.get("user_prompt", ""))
+                            break
+                        state["attempts"] = state.get("attempts", 0) + 1
+                        if state["attempts"] < MAX_INPUT_ATTEMPTS:
+                            messages.append(
+                                f"Sorry, I need {step.get('expected_input', 'a bit more information')}. {step.get('user_prompt', '')}"
+                            )
+                            break
+                        success = False
+                    else:
+                        params = step.get("params") or [step["id"]]
+                        variables[params[0]] = value
+                if success and step.get("action"):
+                    handler = _action_handlers.get(step["action"])
+                    if handler is None:
+                        logger.warning(f"⚠️ AOP action {step['action']} has no handler; taking the failure branch")
+                        success = False
+                    else:
+                        try:
+                            success, updates = handler(variables, step, storage.db, chat_id)
+                            variables.update(updates)
+                        except Exception as e:
+                            logger.error(f"❌ AOP action {step.get('action')} failed: {e}")
+                            success = False
+                if success and not awaits_input:
+                    # Only say what the step did once it has actually done it
+                    messages.append(step.get("user_prompt", ""))
+                if success:
+                    next_step = step.get("success_next")
+                elif step.get("failure_next"):
+                    next_step = step["failure_next"]
+                elif step_id != aop.escalation and not variables.get("escalated"):
+                    variables.setdefault("escalated_from", step_id)
+                    next_step = aop.escalation
+                else:
+                    # Escalation itself (or a step after it) failed: end instead of looping
+                    if not variables.get("escalated"):
+                        messages.append(UNAVAILABLE_MESSAGE)
+                    next_step = None
+
+            state["attempts"] = 0
+            step_id = next_step
+            transitions += 1
+
+        state["current_step"] = step_id
+        state["variables"] = variables
+        if step_id is None:
+            state["completed_at"] = datetime.now()
+        with self._lock:
+            self._metrics["turns"] += 1
+            self._metrics["transitions"] += transitions
+            self._metrics["completed"] += int(step_id is None)
+        # One write per turn, however many transitions it made
+        storage.set_chat_state(chat_id, state)
+
+        response = "\n\n".join(message for message in messages if message)
+        return {"response": response, "completed": step_id is None}
+
+    def get_metrics(self) -> Dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["aops"] = len(self._compiled)
+        return metrics
@@ -0,0 +1,118 @@
+"""
+Short-lived cache of per-chat flags read on every AI turn.
+
+/api/chat only needs a chat's ai_agent_enabled flag and dashboard_user_id, but
+used to load the whole chat document (every message) to get them. Flags are
+now fetched with a projection on a miss and kept for CHAT_FLAGS_TTL_SECONDS.
+toggle_ai_agent updates this worker's entry directly and announces the change
+so the other workers drop theirs; the TTL bounds staleness if a message is lost.
+Every change to a chat's entry bumps its generation, and a miss only stores the
+flags it read if no change happened while it was reading, so a slow read can
+never put back a value that a toggle or invalidation has replaced.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from pymongo.database import Database
+
+
+class ChatFlagsCache:
+    """TTL + LRU cache of {ai_agent_enabled, dashboard_user_id} by chat_id."""
+
+    def __init__(self):
+        self.ttl_seconds = float(os.getenv("CHAT_FLAGS_TTL_SECONDS", "30"))
+        self.max_entries = int(os.getenv("CHAT_FLAGS_MAX_ENTRIES", "10000"))
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # chat_id -> (expires_at, flags)
+        # chat_id -> number of changes (toggles, invalidations); only chats changed recently are kept
+        self._generations: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get_flags(self, db: Database, chat_id: str) -> Optional[Dict]:
+        """The chat's flags, or None if the chat does not exist (misses are not cached)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(chat_id)
+                self._metrics["hits"] += 1
+                return entry[1]
+            self._metrics["misses"] += 1
+            generation = self._generations.get(chat_id, 0)
+
+        doc = db["customer-chats"].find_one(
+            {"chat_id": chat_id}, {"_id": 0, "ai_agent_enabled": 1, "dashboard_user_id": 1}
+        )
+        if doc is None:
+            return None
+        flags = {
+            # Default to True for backward compatibility
+            "ai_agent_enabled": doc.get("ai_agent_enabled", True),
+            "dashboard_user_id": doc.get("dashboard_user_id"),
+        }
+        self._store(chat_id, flags, generation)
+        return flags
+
+    def _bump(self, chat_id: str) -> None:
+        """Record a change to a chat's flags. Caller holds the lock."""
+        self._generations[chat_id] = self._generations.get(chat_id, 0) + 1
+        self._generations.move_to_end(chat_id)
+        while len(self._generations) > self.max_entries:
+            self._generations.popitem(last=False)
+
+    def _store(self, chat_id: str, flags: Dict, generation: int) -> None:
+        """Cache flags read at generation, unless the chat has changed since."""
+        with self._lock:
+            if self._generations.get(chat_id, 0) != generation:
+                return  # Read before a toggle or invalidation; the next miss reads again
+            self._put(chat_id, flags)
+
+    def _put(self, chat_id: str, flags: Dict) -> None:
+        """Caller holds the lock."""
+        self._entries[chat_id] = (time.monotonic() + self.ttl_seconds, flags)
+        self._entries.move_to_end(chat_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def set_ai_agent_enabled(self, chat_id: str, enabled: bool) -> None:
+        """Apply a toggle made by this worker without another read."""
+        with self._lock:
+            self._bump(chat_id)
+            entry = self._entries.get(chat_id)
+            if entry is not None:
+                self._put(chat_id, {**entry[1], "ai_agent_enabled": enabled})
+
+    def invalidate(self, chat_id: str) -> None:
+        with self._lock:
+            self._bump(chat_id)
+            if self._entries.pop(chat_id, None) is not None:
+                self._metrics["invalidations"] += 1
+
+    def get_metrics(self) -> Dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["size"] = len(self._entries)
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_rate"] = metrics["hits"] / lookups if lookups else 0.0
+        return metrics
+
+
+# Global cache instance
+_chat_flags_cache: Optional[ChatFlagsCache] = None
+
+
+def init_chat_flags_cache() -> ChatFlagsCache:
+    """Initialize the chat flags cache."""
+    global _chat_flags_cache
+    _chat_flags_cache = ChatFlagsCache()
+    return _chat_flags_cache
+
+
+def get_chat_flags_cache() -> ChatFlagsCache:
+    """Get the chat flags cache instance."""
+    if _chat_flags_cache is None:
+        raise Exception("Chat flags cache not initialized. Call init_chat_flags_cache() first.")
+    return _chat_flags_cache
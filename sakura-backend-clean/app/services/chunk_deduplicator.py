@@ -0,0 +1,156 @@
+"""
+Ingest-time deduplication for crawled website chunks.
+
+Crawled pages repeat headers, footers, cookie banners and navigation on every
+page. Without deduplication those blocks end up as near-identical vectors that
+waste index memory and crowd the top-k. One IngestDeduplicator is used per
+crawl and provides:
+
+- boilerplate removal (opt-in): longer text blocks seen on many pages of the
+  site are dropped
+- exact deduplication: chunks whose normalized text hashes the same are dropped
+- near-duplicate detection: 64-bit SimHash over word shingles, with LSH banding
+  so each chunk is only compared against chunks sharing a band
+"""
+import os
+import re
+import hashlib
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+_SIMHASH_BITS = 64
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase and strip punctuation/whitespace differences."""
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """64-bit SimHash of a text over word shingles."""
+    tokens = _WORD.findall(text.lower())
+    if len(tokens) <= shingle_size:
+        shingles = [" ".join(tokens)]
+    else:
+        shingles = [" ".join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)]
+
+    weights = [0] * _SIMHASH_BITS
+    for shingle in shingles:
+        h = _hash64(shingle)
+        for bit in range(_SIMHASH_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class IngestDeduplicator:
+    """Per-crawl boilerplate and duplicate-chunk filter."""
+
+    def __init__(
+        self,
+        max_hamming_distance: Optional[int] = None,
+        boilerplate_min_pages: Optional[int] = None,
+        boilerplate_min_chars: Optional[int] = None
+    ):
+        self.max_hamming_distance = (
+            max_hamming_distance if max_hamming_distance is not None
+            else int(os.getenv("WEBSITE_DEDUP_HAMMING", "6"))
+        )
+        # A block seen on this many pages is treated as boilerplate (0, the default, disables)
+        self.boilerplate_min_pages = (
+            boilerplate_min_pages if boilerplate_min_pages is not None
+            else int(os.getenv("WEBSITE_BOILERPLATE_MIN_PAGES", "0"))
+        )
+        # Shorter blocks (prices, labels, "Yes"/"No") repeat legitimately and are always kept
+        self.boilerplate_min_chars = (
+            boilerplate_min_chars if boilerplate_min_chars is not None
+            else int(os.getenv("WEBSITE_BOILERPLATE_MIN_CHARS", "40"))
+        )
+
+        # Pigeonhole: if two fingerprints differ in at most k bits, at least one
+        # of k + 1 bands is identical, so band matches find every candidate
+        self._num_bands = self.max_hamming_distance + 1
+        self._band_bits = _SIMHASH_BITS // self._num_bands
+        self._band_mask = (1 << self._band_bits) - 1
+        self._bands: List[Dict[int, List[int]]] = [defaultdict(list) for _ in range(self._num_bands)]
+
+        self._exact_hashes: Set[bytes] = set()
+        self._block_page_counts: Dict[bytes, int] = defaultdict(int)
+
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        self.boilerplate_blocks = 0
+
+    # ---------- Boilerplate ----------
+
+    def filter_boilerplate(self, blocks: List[str]) -> List[str]:
+        """
+        Drop blocks of at least boilerplate_min_chars characters that have
+        appeared on boilerplate_min_pages pages so far. Pages are streamed, so
+        the first few pages keep their copy of a repeated block; every later
+        page loses it.
+        """
+        if self.boilerplate_min_pages <= 0:
+            return blocks
+
+        kept = []
+        seen_on_page: Set[bytes] = set()
+        for block in blocks:
+            normalized = normalize_text(block)
+            if len(normalized) < self.boilerplate_min_chars:
+                kept.append(block)
+                continue
+            key = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+            if key not in seen_on_page:
+                seen_on_page.add(key)
+                self._block_page_counts[key] += 1
+            if self._block_page_counts[key] >= self.boilerplate_min_pages:
+                self.boilerplate_blocks += 1
+                continue
+            kept.append(block)
+        return kept
+
+    # ---------- Chunks ----------
+
+    def _band_keys(self, fingerprint: int) -> List[int]:
+        return [(fingerprint >> (i * self._band_bits)) & self._band_mask for i in range(self._num_bands)]
+
+    def is_duplicate(self, text: str) -> bool:
+        """Return True if text duplicates an earlier chunk; otherwise remember it."""
+        normalized = normalize_text(text)
+        exact_key = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+        if exact_key in self._exact_hashes:
+            self.exact_duplicates += 1
+            return True
+
+        fingerprint = simhash(normalized)
+        band_keys = self._band_keys(fingerprint)
+        for band, key in zip(self._bands, band_keys):
+            for candidate in band.get(key, ()):
+                if (candidate ^ fingerprint).bit_count() <= self.max_hamming_distance:
+                    self.near_duplicates += 1
+                    return True
+
+        self._exact_hashes.add(exact_key)
+        for band, key in zip(self._bands, band_keys):
+            band[key].append(fingerprint)
+        return False
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates,
+            "boilerplate_blocks": self.boilerplate_blocks,
+        }
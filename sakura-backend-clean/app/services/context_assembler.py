@@ -0,0 +1,190 @@
+"""
+Token-budgeted assembly of retrieved passages into LLM context.
+
+Retrieval hands over FAQs and page chunks in relevance order. Before they reach
+the prompt:
+- duplicates are dropped (the same chunk twice, or identical text on two pages);
+- chunks that were neighbours on the same page (consecutive chunk_index) are
+  merged into one passage, with the overlap the chunker repeats between them
+  trimmed;
+- passages fill CONTEXT_TOKEN_BUDGET greedily, FAQs first and then by rank; a
+  passage that does not fit whole is cut to the remaining budget if enough of it
+  would remain to be useful, and skipped otherwise.
+
+Tokens are counted with the embedding tokenizer (one batched call), a close
+proxy for the chat model's own tokenizer.
+"""
+import os
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from app.core.settings import Settings
+from app.services.faq_index import parse_faq_document
+from app.services.text_chunker import get_text_chunker
+
+logger = logging.getLogger(__name__)
+
+# The chunker repeats at most a few sentences between neighbours
+_MAX_OVERLAP_WORDS = 120
+
+
+def _page_key(doc: Document) -> Tuple:
+    metadata = doc.metadata
+    return (metadata.get("type"), metadata.get("website_id") or metadata.get("file_id"), metadata.get("source"))
+
+
+def _merge_overlapping(left: str, right: str) -> str:
+    """Join two neighbouring chunks, dropping the words the right one repeats from the left."""
+    left_words, right_words = left.split(), right.split()
+    for size in range(min(len(left_words), len(right_words), _MAX_OVERLAP_WORDS), 0, -1):
+        if left_words[-size:] == right_words[:size]:
+            return " ".join(left_words + right_words[size:])
+    return f"{left.rstrip()} {right.lstrip()}"
+
+
+class ContextAssembler:
+    """Builds the knowledge base context block for one question under a token budget."""
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+        # A merged run of neighbouring chunks is cut to this size
+        self.max_passage_tokens = int(os.getenv("CONTEXT_MAX_PASSAGE_TOKENS", "500"))
+        # Smallest cut-down passage worth including
+        self.min_passage_tokens = int(os.getenv("CONTEXT_MIN_PASSAGE_TOKENS", "48"))
+        self.merge_neighbours = os.getenv("CONTEXT_MERGE_NEIGHBOURS", "true").lower() == "true"
+        self._lock = threading.Lock()
+        self._metrics = {"assembled": 0, "tokens_total": 0, "chunks_in": 0, "duplicates_dropped": 0, "chunks_merged": 0, "passages_cut": 0}
+
+    def _passages(self, docs: List[Document]) -> Tuple[List[Dict], int, int]:
+        """
+        Deduplicate page chunks and merge neighbours; passages keep the rank of
+        their best chunk. Returns (passages, duplicates dropped, chunks merged).
+        """
+        dropped = merged = 0
+        seen_text = set()
+        seen_chunks = set()
+        by_page: Dict[Tuple, List[Tuple[int, int, Document]]] = {}
+        for rank, doc in enumerate(docs):
+            content = (doc.page_content or "").strip()
+            # Skip the default welcome message
+            if not content or (len(content) < 100 and "welcome to sakura ai assistant" in content.lower()):
+                continue
+            normalized = " ".join(content.lower().split())
+            chunk = (_page_key(doc), doc.metadata.get("chunk_index"))
+            if normalized in seen_text or (chunk[1] is not None and chunk in seen_chunks):
+                dropped += 1
+                continue
+            seen_text.add(normalized)
+            seen_chunks.add(chunk)
+            by_page.setdefault(chunk[0], []).append((rank, doc.metadata.get("chunk_index"), doc))
+
+        passages = []
+        for chunks in by_page.values():
+            if not self.merge_neighbours or any(index is None for _, index, _ in chunks):
+                passages.extend({"rank": rank, "doc": doc, "text": doc.page_content.strip()} for rank, _, doc in chunks)
+                continue
+            chunks.sort(key=lambda chunk: chunk[1])
+            run = None
+            for rank, index, doc in chunks:
+                if run is not None and index == run["last_index"] + 1:
+                    run["text"] = _merge_overlapping(run["text"], doc.page_content.strip())
+                    run["rank"] = min(run["rank"], rank)
+                    run["last_index"] = index
+                    merged += 1
+                    continue
+                run = {"rank": rank, "doc": doc, "text": doc.page_content.strip(), "last_index": index}
+                passages.append(run)
+        passages.sort(key=lambda passage: passage["rank"])
+        return passages, dropped, merged
+
+    def _cut(self, text: str, tokens: int, budget: int) -> str:
+        """Shorten text to roughly budget tokens, on a word boundary."""
+        words = text.split()
+        keep = max(1, int(len(words) * budget / tokens))
+        return " ".join(words[:keep]) + " …"
+
+    def assemble(self, faqs: List[Document], others: List[Document]) -> Optional[str]:
+        """
+        Format FAQs and other passages (each in relevance order) as the context
+        block, within the token budget. None if nothing usable remains.
+        """
+        faq_entries = [parse_faq_document(doc) for doc in faqs]
+        passages, dropped, merged = self._passages(others)
+        texts = [f"Q: {faq['question']}\nA: {faq['answer']}" for faq in faq_entries] + [passage["text"] for passage in passages]
+        token_counts = get_text_chunker().count_tokens(texts)
+
+        remaining = self.token_budget
+        chosen_faqs: List[str] = []
+        chosen_other: List[str] = []
+        cut = 0
+        for position, (text, tokens) in enumerate(zip(texts, token_counts)):
+            is_faq = position < len(faq_entries)
+            limit = min(remaining, tokens if is_faq else self.max_passage_tokens)
+            if tokens > limit:
+                # FAQ answers are kept whole; a passage is cut if enough of it fits
+                if is_faq or limit < self.min_passage_tokens:
+                    continue
+                text, tokens = self._cut(text, tokens, limit), limit
+                cut += 1
+            remaining -= tokens
+            if is_faq:
+                chosen_faqs.append(text)
+            else:
+                source = passages[position - len(faq_entries)]["doc"].metadata.get("source", "knowledge base")
+                chosen_other.append(f"[{source}] {text}")
+            if remaining < self.min_passage_tokens:
+                break
+
+        with self._lock:
+            self._metrics["assembled"] += 1
+            self._metrics["chunks_in"] += len(others)
+            self._metrics["duplicates_dropped"] += dropped
+            self._metrics["chunks_merged"] += merged
+            self._metrics["passages_cut"] += cut
+            self._metrics["tokens_total"] += self.token_budget - remaining
+        if not chosen_faqs and not chosen_other:
+            return None
+
+        formatted_results = []
+        if chosen_faqs:
+            formatted_results.append("=== FREQUENTLY ASKED QUESTIONS (FAQs) ===")
+            for i, faq in enumerate(chosen_faqs, 1):
+                formatted_results.append(f"\nFAQ #{i}:\n{faq}")
+            formatted_results.append("\n")
+        if chosen_other:
+            formatted_results.append("=== ADDITIONAL INFORMATION ===")
+            for i, passage in enumerate(chosen_other, 1):
+                formatted_results.append(f"\n{i}. {passage}")
+        logger.info(f"🧩 Assembled context: {len(chosen_faqs)} FAQs, {len(chosen_other)} passages, "
+                    f"{self.token_budget - remaining}/{self.token_budget} tokens")
+        return "\n".join(formatted_results)
+
+    def get_metrics(self) -> Dict:
+        """Assembly counters plus mean context size in tokens."""
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["token_budget"] = self.token_budget
+        metrics["tokens_avg"] = metrics.pop("tokens_total") / (metrics["assembled"] or 1)
+        return metrics
+
+
+# Global assembler instance
+_context_assembler: Optional[ContextAssembler] = None
+
+
+def init_context_assembler(settings: Settings) -> ContextAssembler:
+    """Initialize the context assembler."""
+    global _context_assembler
+    _context_assembler = ContextAssembler(settings)
+    return _context_assembler
+
+
+def get_context_assembler() -> ContextAssembler:
+    """Get the context assembler instance."""
+    if _context_assembler is None:
+        raise Exception("Context assembler not initialized. Call init_context_assembler() first.")
+    return _context_assembler
@@ -0,0 +1,213 @@
+"""
+Conversation memory for chat turns.
+
+History comes from the chat's messages in customer-chats. Each turn gets the
+most recent messages that fit a token budget, plus a rolling summary of
+everything older. Summaries are written by a background worker (never on the
+response path) and stored in the chat-memory collection, so every worker
+shares them and prompt size stays capped however long a chat runs.
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from pymongo.database import Database
+
+from app.core.settings import Settings
+from app.services.text_chunker import get_text_chunker
+
+logger = logging.getLogger(__name__)
+
+_SUMMARY_PROMPT = (
+    "You maintain a running summary of a customer support conversation.\n"
+    "Update the summary with the new messages below. Keep names, products, order numbers, "
+    "questions still open and anything the customer asked to remember. Write at most {max_words} words, "
+    "in plain sentences, and output only the summary.\n\n"
+    "CURRENT SUMMARY:\n{summary}\n\nNEW MESSAGES:\n{transcript}"
+)
+
+
+def _message_text(message: Dict) -> str:
+    return str(message.get("content") or message.get("text") or "").strip()
+
+
+def _is_user(message: Dict) -> bool:
+    return message.get("role", "user") in ("user", "customer", "human")
+
+
+class ConversationMemory:
+    """Token-budgeted window of recent turns plus a rolling summary, keyed by chat_id."""
+
+    def __init__(self, settings: Settings, db: Optional[Database] = None, llm=None):
+        self.settings = settings
+        self.db = db
+        self.llm = llm
+        self.enabled = os.getenv("MEMORY_ENABLED", "true").lower() == "true"
+        self.window_tokens = int(os.getenv("MEMORY_WINDOW_TOKENS", "1200"))
+        # Never look further back than this many messages when filling the window
+        self.max_window_messages = int(os.getenv("MEMORY_MAX_WINDOW_MESSAGES", "20"))
+        self.summary_words = int(os.getenv("MEMORY_SUMMARY_WORDS", "150"))
+        # Summarize once at least this many messages have fallen out of the window
+        self.summarize_batch = int(os.getenv("MEMORY_SUMMARIZE_BATCH", "6"))
+        # Cap per summary call, so long chats from before memory existed catch up over several turns
+        self.summarize_max_messages = int(os.getenv("MEMORY_SUMMARIZE_MAX_MESSAGES", "40"))
+        self._executor = ThreadPoolExecutor(max_workers=int(os.getenv("MEMORY_SUMMARY_WORKERS", "2")))
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._metrics = {"turns": 0, "summaries_written": 0, "summary_errors": 0, "context_ms_total": 0.0}
+
+        if self.db is not None:
+            try:
+                self.db["chat-memory"].create_index("chat_id", unique=True)
+            except Exception as e:
+                logger.warning(f"⚠️  Could not create chat-memory index: {e}")
+
+    def _load(self, chat_id: str) -> Tuple[int, List[Dict], Dict]:
+        """(total message count, most recent messages, stored summary) for a chat."""
+        rows = list(self.db["customer-chats"].aggregate([
+            {"$match": {"chat_id": chat_id}},
+            {"$limit": 1},
+            {"$project": {
+                "_id": 0,
+                "count": {"$size": {"$ifNull": ["$messages", []]}},
+                "recent": {"$slice": [{"$ifNull": ["$messages", []]}, -self.max_window_messages]},
+            }},
+        ]))
+        if not rows:
+            return 0, [], {}
+        memory = self.db["chat-memory"].find_one({"chat_id": chat_id}, {"summary": 1, "summarized_through": 1}) or {}
+        return rows[0]["count"], rows[0]["recent"], memory
+
+    def get_context(self, chat_id: str, query: str) -> Tuple[Optional[str], List[BaseMessage]]:
+        """
+        Summary of older turns (or None) and the recent turns that fit the
+        token window, oldest first. The current query is not included.
+        """
+        if not self.enabled or self.db is None or not chat_id:
+            return None, []
+        started = time.perf_counter()
+        count, recent, memory = self._load(chat_id)
+
+        # The current message may already be stored on the chat
+        if recent and _is_user(recent[-1]) and _message_text(recent[-1]) == query.strip():
+            recent = recent[:-1]
+            count -= 1
+        recent = [message for message in recent if _message_text(message)]
+
+        # Newest first until the token budget is spent
+        token_counts = get_text_chunker().count_tokens([_message_text(message) for message in recent])
+        window: List[Dict] = []
+        used = 0
+        for message, tokens in zip(reversed(recent), reversed(token_counts)):
+            if window and used + tokens > self.window_tokens:
+                break
+            window.append(message)
+            used += tokens
+        window.reverse()
+        # The chat history sent to the model has to open with a user turn
+        while window and not _is_user(window[0]):
+            window.pop(0)
+
+        # Messages before the window that the summary does not cover yet
+        window_start = count - len(window)
+        summarized_through = memory.get("summarized_through", 0)
+        if window_start - summarized_through >= self.summarize_batch:
+            end = min(window_start, summarized_through + self.summarize_max_messages)
+            self._schedule_summary(chat_id, summarized_through, end)
+
+        with self._lock:
+            self._metrics["turns"] += 1
+            self._metrics["context_ms_total"] += (time.perf_counter() - started) * 1000
+
+        messages = [
+            HumanMessage(content=_message_text(message)) if _is_user(message) else AIMessage(content=_message_text(message))
+            for message in window
+        ]
+        return memory.get("summary") or None, messages
+
+    def _schedule_summary(self, chat_id: str, start: int, end: int) -> None:
+        if self.llm is None:
+            return
+        with self._lock:
+            if chat_id in self._in_flight:
+                return
+            self._in_flight.add(chat_id)
+        self._executor.submit(self._summarize, chat_id, start, end)
+
+    def _summarize(self, chat_id: str, start: int, end: int) -> None:
+        """Fold messages [start, end) into the chat's summary (runs in the background)."""
+        try:
+            rows = list(self.db["customer-chats"].aggregate([
+                {"$match": {"chat_id": chat_id}},
+                {"$limit": 1},
+                {"$project": {"_id": 0, "messages": {"$slice": [{"$ifNull": ["$messages", []]}, start, end - start]}}},
+            ]))
+            messages = rows[0]["messages"] if rows else []
+            transcript = "\n".join(
+                f"{'Customer' if _is_user(message) else 'Agent'}: {_message_text(message)}"
+                for message in messages if _message_text(message)
+            )
+            if not transcript:
+                return
+            memory = self.db["chat-memory"].find_one({"chat_id": chat_id}, {"summary": 1, "summarized_through": 1}) or {}
+            if memory.get("summarized_through", 0) >= end:
+                return  # Another worker got there first
+
+            response = self.llm.invoke(_SUMMARY_PROMPT.format(
+                max_words=self.summary_words,
+                summary=memory.get("summary") or "(none)",
+                transcript=transcript,
+            ))
+            summary = str(getattr(response, "content", response)).strip()
+            # Only move forward: a slower concurrent summary must not overwrite a newer one
+            self.db["chat-memory"].update_one(
+                {"chat_id": chat_id, "summarized_through": {"$not": {"$gte": end}}},
+                {"$set": {"summary": summary, "summarized_through": end, "updated_at": datetime.now()}},
+                upsert=True,
+            )
+            with self._lock:
+                self._metrics["summaries_written"] += 1
+            print(f"🧠 Updated conversation summary for chat {chat_id} (messages {start}-{end})")
+        except Exception as e:
+            # A duplicate-key error here means a newer summary already exists
+            with self._lock:
+                self._metrics["summary_errors"] += 1
+            logger.warning(f"⚠️  Could not update conversation summary for {chat_id}: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(chat_id)
+
+    def get_metrics(self) -> Dict:
+        """Turn and summary counters plus mean context-loading latency."""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["summaries_in_flight"] = len(self._in_flight)
+        turns = metrics["turns"] or 1
+        metrics["context_ms_avg"] = metrics.pop("context_ms_total") / turns
+        return metrics
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+# Global memory instance
+_conversation_memory: Optional[ConversationMemory] = None
+
+
+def init_conversation_memory(settings: Settings, db: Optional[Database] = None, llm=None) -> ConversationMemory:
+    """Initialize conversation memory."""
+    global _conversation_memory
+    _conversation_memory = ConversationMemory(settings, db=db, llm=llm)
+    return _conversation_memory
+
+
+def get_conversation_memory() -> ConversationMemory:
+    """Get the conversation memory instance."""
+    if _conversation_memory is None:
+        raise Exception("Conversation memory not initialized. Call init_conversation_memory() first.")
+    return _conversation_memory
@@ -0,0 +1,310 @@
+"""
+Process-pool document extraction engine.
+
+PDF/DOCX/XLSX/CSV parsing is pure-Python and CPU-bound, so running it inside the
+API process blocks the GIL for every other request. This engine runs extraction
+in a pool of worker processes, splits large PDFs into page ranges that are
+extracted in parallel, and enforces a per-task timeout and a per-worker memory cap.
+
+Workers are started with the "spawn" method (FILE_EXTRACTION_START_METHOD):
+forking would copy the threaded API process with torch, the embedding model and
+FAISS loaded, leaving the child far above the memory cap before it does any work.
+This module imports only the standard library (and app.services resolves its
+exports lazily), so a spawned worker starts small and the cap is absolute.
+"""
+import os
+import math
+import time
+import signal
+import logging
+import multiprocessing
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionTimeoutError(Exception):
+    """Raised when a file takes longer than the configured timeout to extract."""
+
+
+# ==================== Worker-side functions ====================
+# These run inside the pool processes, so they must be module-level (picklable)
+# and must not touch any service state from the API process.
+
+def _init_worker(max_memory_mb: int, pid_queue) -> None:
+    """Report this worker's PID to the engine and apply the address-space cap."""
+    pid_queue.put(os.getpid())
+    # Native thread pools (OpenBLAS in numpy/pandas) reserve address space per
+    # thread; extraction is one task per process, so one thread is enough
+    for variable in ("OPENBLAS_NUM_THREADS", "OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(variable, "1")
+    if max_memory_mb <= 0:
+        return
+    try:
+        import resource
+        limit = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:
+        # resource is POSIX-only; on other platforms we run without a cap
+        logging.getLogger(__name__).warning(f"⚠️  Could not apply worker memory cap: {e}")
+
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end) from a PDF."""
+    import PyPDF2
+
+    texts = []
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page_num in range(start, min(end, len(pdf_reader.pages))):
+            try:
+                text = pdf_reader.pages[page_num].extract_text() or ""
+                if text.strip():
+                    texts.append(text)
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Error extracting text from page {page_num + 1}: {e}")
+    return texts
+
+
+def _extract_docx(file_path: str) -> List[str]:
+    """Extract paragraph and table-cell text from a DOCX file."""
+    from docx import Document
+
+    doc = Document(file_path)
+    text_parts = [p.text for p in doc.paragraphs if p.text.strip()]
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                if cell.text.strip():
+                    text_parts.append(cell.text)
+    return text_parts
+
+
+def rows_to_text(df, include_headers: bool = True) -> List[str]:
+    """Render a DataFrame as 'col: val | col: val' lines."""
+    columns = [str(col) for col in df.columns]
+    lines = ["Headers: " + ", ".join(columns)] if include_headers else []
+    for values in df.itertuples(index=False, name=None):
+        lines.append(" | ".join(f"{col}: {val}" for col, val in zip(columns, values)))
+    return lines
+
+
+def _extract_xlsx_sheet(file_path: str, sheet_name: str) -> List[str]:
+    """Extract a single worksheet as text lines."""
+    import pandas as pd
+
+    df = pd.read_excel(file_path, sheet_name=sheet_name)
+    return [f"\n=== Sheet: {sheet_name} ===\n"] + rows_to_text(df)
+
+
+def _extract_csv(file_path: str) -> Tuple[List[str], int]:
+    """Extract a CSV file as text lines. Returns (lines, row_count)."""
+    import pandas as pd
+
+    df = pd.read_csv(file_path)
+    return rows_to_text(df), len(df)
+
+
+# ==================== Engine ====================
+
+class DocumentExtractionEngine:
+    """Runs document text extraction in a pool of worker processes."""
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        timeout_seconds: Optional[float] = None,
+        max_memory_mb: Optional[int] = None,
+        pages_per_task: Optional[int] = None,
+    ):
+        self.max_workers = max_workers or int(os.getenv("FILE_EXTRACTION_WORKERS", "0")) or (os.cpu_count() or 1)
+        self.timeout_seconds = timeout_seconds or float(os.getenv("FILE_EXTRACTION_TIMEOUT", "300"))
+        self.max_memory_mb = max_memory_mb if max_memory_mb is not None else int(os.getenv("FILE_EXTRACTION_MAX_MEMORY_MB", "1024"))
+        # Small PDFs are not worth splitting: each task re-opens and re-parses the file
+        self.pages_per_task = pages_per_task or int(os.getenv("FILE_EXTRACTION_PAGES_PER_TASK", "20"))
+        # Tasks submitted ahead of the consumer; enough to keep every worker busy
+        self.max_in_flight = self.max_workers * 2
+        self._context = multiprocessing.get_context(os.getenv("FILE_EXTRACTION_START_METHOD", "spawn"))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # Workers put their PID here on start-up so a stuck pool can be killed
+        self._pid_queue = None
+        self._worker_pids: set = set()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Get or lazily start the worker pool."""
+        if self._pool is None:
+            logger.info(f"🧵 Starting document extraction pool with {self.max_workers} workers")
+            self._pid_queue = self._context.SimpleQueue()
+            self._worker_pids = set()
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=self._context,
+                initializer=_init_worker,
+                initargs=(self.max_memory_mb, self._pid_queue),
+            )
+        return self._pool
+
+    def _collect_worker_pids(self) -> set:
+        """PIDs of every worker the current pool has started so far."""
+        if self._pid_queue is not None:
+            while not self._pid_queue.empty():
+                try:
+                    self._worker_pids.add(self._pid_queue.get())
+                except (EOFError, OSError):
+                    break
+        return self._worker_pids
+
+    def _reset_pool(self) -> None:
+        """Kill the pool so a stuck or crashed worker cannot poison later jobs."""
+        pool = self._pool
+        if pool is None:
+            return
+        worker_pids = set(self._collect_worker_pids())
+        self._pool = None
+        self._pid_queue = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        # shutdown() does not stop a task that is already running
+        for pid in worker_pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def shutdown(self) -> None:
+        """Stop the worker pool."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def _page_ranges(self, page_count: int) -> List[Tuple[int, int]]:
+        """Split page_count pages into contiguous ranges, roughly one per worker."""
+        if page_count <= 0:
+            return []
+        size = max(self.pages_per_task, math.ceil(page_count / self.max_workers))
+        return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+    def _run(self, tasks: List[tuple], file_path: Path) -> Iterator:
+        """
+        Run (fn, *args) tasks in the pool and yield their results in order.
+
+        At most ``max_in_flight`` tasks are submitted ahead of the consumer, so a
+        slow consumer (e.g. one inserting chunks as they arrive) keeps only a
+        bounded number of extracted ranges in memory. Each task must finish
+        within ``timeout_seconds`` of being submitted; time the consumer spends
+        between results does not count against it.
+        """
+        pool = self._get_pool()
+        task_iter = iter(tasks)
+        pending: deque = deque()  # (future, deadline)
+
+        def submit(fn, *args) -> None:
+            pending.append((pool.submit(fn, *args), time.monotonic() + self.timeout_seconds))
+
+        try:
+            for fn, *args in islice(task_iter, self.max_in_flight):
+                submit(fn, *args)
+            while pending:
+                future, deadline = pending.popleft()
+                result = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                next_task = next(task_iter, None)
+                if next_task is not None:
+                    submit(*next_task)
+                yield result
+        except FutureTimeoutError:
+            self._reset_pool()
+            raise ExtractionTimeoutError(
+                f"Extraction of {file_path.name} exceeded {self.timeout_seconds:.0f}s"
+            )
+        except BrokenProcessPool:
+            # Usually the worker was killed for exceeding the memory cap
+            self._reset_pool()
+            raise Exception(f"Extraction worker crashed while processing {file_path.name} (memory limit exceeded?)")
+        except MemoryError:
+            raise Exception(f"Extraction of {file_path.name} exceeded the {self.max_memory_mb} MB memory cap")
+        finally:
+            for future, _ in pending:
+                future.cancel()
+
+    def get_pdf_page_count(self, file_path: Path) -> int:
+        """Return the number of pages in a PDF (parses only the page tree)."""
+        import PyPDF2
+
+        with open(file_path, 'rb') as file:
+            return len(PyPDF2.PdfReader(file).pages)
+
+    def iter_pdf_pages(self, file_path: Path, page_count: Optional[int] = None) -> Iterator[List[str]]:
+        """Extract a PDF range by range, in page order. Yields each range's page texts."""
+        if page_count is None:
+            page_count = self.get_pdf_page_count(file_path)
+        ranges = self._page_ranges(page_count)
+        logger.info(f"📄 Extracting {page_count} PDF pages from {file_path.name} in {len(ranges)} ranges")
+        tasks = [(_extract_pdf_page_range, str(file_path), start, end) for start, end in ranges]
+        yield from self._run(tasks, file_path)
+
+    def extract_pdf(self, file_path: Path) -> Tuple[str, int]:
+        """Extract text from a PDF. Returns (text, page_count)."""
+        page_count = self.get_pdf_page_count(file_path)
+        text_parts = []
+        for page_texts in self.iter_pdf_pages(file_path, page_count):
+            text_parts.extend(page_texts)
+        return "\n\n".join(text_parts), page_count
+
+    def extract_docx(self, file_path: Path) -> Tuple[str, int]:
+        """Extract text from a DOCX file. Returns (text, estimated_page_count)."""
+        text_parts = next(self._run([(_extract_docx, str(file_path))], file_path))
+        full_text = "\n\n".join(text_parts)
+        # DOCX doesn't have page count, estimate based on content length
+        return full_text, max(1, len(full_text) // 2000)
+
+    def iter_xlsx_sheets(self, file_path: Path) -> Iterator[List[str]]:
+        """Extract a workbook sheet by sheet, in parallel. Yields each sheet's text lines."""
+        import pandas as pd
+
+        with pd.ExcelFile(file_path) as excel_file:
+            sheet_names = list(excel_file.sheet_names)
+        tasks = [(_extract_xlsx_sheet, str(file_path), name) for name in sheet_names]
+        yield from self._run(tasks, file_path)
+
+    def extract_xlsx(self, file_path: Path) -> Tuple[str, int]:
+        """Extract text from an XLSX workbook. Returns (text, sheet_count)."""
+        text_parts = []
+        sheet_count = 0
+        for sheet_lines in self.iter_xlsx_sheets(file_path):
+            sheet_count += 1
+            text_parts.extend(sheet_lines)
+        return "\n".join(text_parts), sheet_count
+
+    def extract_csv(self, file_path: Path) -> Tuple[str, int]:
+        """Extract text from a CSV file. Returns (text, row_count)."""
+        lines, row_count = next(self._run([(_extract_csv, str(file_path))], file_path))
+        return "\n".join(lines), row_count
+
+
+# Global engine instance
+_extraction_engine: Optional[DocumentExtractionEngine] = None
+
+
+def init_extraction_engine() -> DocumentExtractionEngine:
+    """Initialize the document extraction engine (the pool starts on first use)."""
+    global _extraction_engine
+    _extraction_engine = DocumentExtractionEngine()
+    return _extraction_engine
+
+
+def get_extraction_engine() -> DocumentExtractionEngine:
+    """Get the document extraction engine, creating it on first use."""
+    global _extraction_engine
+    if _extraction_engine is None:
+        _extraction_engine = DocumentExtractionEngine()
+    return _extraction_engine
+
+
+def shutdown_extraction_engine() -> None:
+    """Stop the extraction worker pool."""
+    if _extraction_engine is not None:
+        _extraction_engine.shutdown()
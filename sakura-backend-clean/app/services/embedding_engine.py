@@ -0,0 +1,187 @@
+"""
+Batched sentence-transformers embedding engine.
+
+HuggingFaceEmbeddings encodes with library defaults (batch size 32, torch on
+CPU). This engine exposes the knobs that matter for ingest throughput: batch
+size, global length sorting so each batch pads to similar lengths, an optional
+multi-process pool for bulk jobs, and an ONNX Runtime backend (optionally the
+int8-quantized model) for faster CPU inference. Query embeddings are kept in an
+LRU cache so repeated questions are not encoded again.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from sentence_transformers import SentenceTransformer
+
+BACKEND_TORCH = "torch"
+BACKEND_ONNX = "onnx"
+BACKEND_ONNX_INT8 = "onnx-int8"
+
+
+class EmbeddingEngineConfig:
+    """Embedding backend and batching settings, read from the environment."""
+
+    def __init__(self):
+        self.backend = os.getenv("EMBEDDING_BACKEND", BACKEND_TORCH).lower()
+        # Quantized export shipped with the sentence-transformers MiniLM repos; pick the
+        # variant matching the CPU (avx2, avx512, avx512_vnni, arm64)
+        self.onnx_int8_file = os.getenv("EMBEDDING_ONNX_INT8_FILE", "onnx/model_qint8_avx2.onnx")
+        self.batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+        # Texts are sorted by length globally, then encoded this many at a time
+        self.chunk_size = int(os.getenv("EMBEDDING_CHUNK_SIZE", "4096"))
+        self.max_seq_length = int(os.getenv("EMBEDDING_MAX_SEQ_LENGTH", "0"))  # 0 = model default
+        # Multi-process encoding for bulk jobs (0 or 1 = single process)
+        self.processes = int(os.getenv("EMBEDDING_PROCESSES", "0"))
+        self.multiprocess_min = int(os.getenv("EMBEDDING_MULTIPROCESS_MIN", "5000"))
+        self.query_cache_size = int(os.getenv("EMBEDDING_QUERY_CACHE_SIZE", "2048"))  # 0 = disabled
+        # MiniLM's tokenizer lowercases, so case variants share one cache entry
+        self.query_cache_casefold = os.getenv("EMBEDDING_QUERY_CACHE_CASEFOLD", "true").lower() == "true"
+
+
+class EmbeddingEngine(Embeddings):
+    """LangChain embeddings backed by a tuned SentenceTransformer."""
+
+    def __init__(self, model_name: str, config: Optional[EmbeddingEngineConfig] = None):
+        self.model_name = model_name
+        self.config = config or EmbeddingEngineConfig()
+        self.backend = self.config.backend
+        self.model = self._load_model()
+        if self.config.max_seq_length:
+            self.model.max_seq_length = self.config.max_seq_length
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self._stats_lock = threading.Lock()
+        self._stats = {"texts": 0, "calls": 0, "seconds": 0.0, "multiprocess_jobs": 0}
+        self._query_cache: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self._query_cache_stats = {"hits": 0, "misses": 0}
+
+    def _load_model(self) -> SentenceTransformer:
+        if self.backend in (BACKEND_ONNX, BACKEND_ONNX_INT8):
+            model_kwargs = {"file_name": self.config.onnx_int8_file} if self.backend == BACKEND_ONNX_INT8 else None
+            try:
+                model = SentenceTransformer(self.model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+                print(f"⚡ Loaded {self.model_name} with ONNX Runtime ({self.backend})")
+                return model
+            except Exception as e:
+                # ONNX needs optimum[onnxruntime]; torch always works
+                print(f"⚠️  ONNX backend unavailable for {self.model_name}, falling back to torch: {e}")
+                self.backend = BACKEND_TORCH
+        elif self.backend != BACKEND_TORCH:
+            print(f"⚠️  Unknown EMBEDDING_BACKEND '{self.backend}', using torch")
+            self.backend = BACKEND_TORCH
+        return SentenceTransformer(self.model_name)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode texts into a float32 array (rows in input order). Texts are sorted
+        longest first so every batch pads to similar lengths; large jobs go to a
+        multi-process pool when one is configured.
+        """
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        started = time.perf_counter()
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        sorted_texts = [texts[i] for i in order]
+
+        multiprocess = self.config.processes > 1 and len(texts) >= self.config.multiprocess_min
+        sorted_vectors = self._encode_multi_process(sorted_texts) if multiprocess else None
+        if sorted_vectors is None:
+            multiprocess = False
+            sorted_vectors = np.concatenate([
+                self._encode_batch(sorted_texts[start:start + self.config.chunk_size])
+                for start in range(0, len(sorted_texts), self.config.chunk_size)
+            ])
+
+        vectors = np.empty_like(sorted_vectors)
+        vectors[order] = sorted_vectors
+
+        with self._stats_lock:
+            self._stats["texts"] += len(texts)
+            self._stats["calls"] += 1
+            self._stats["seconds"] += time.perf_counter() - started
+            self._stats["multiprocess_jobs"] += int(multiprocess)
+        return vectors
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(
+            self.model.encode(texts, batch_size=self.config.batch_size, convert_to_numpy=True, show_progress_bar=False),
+            dtype=np.float32,
+        )
+
+    def _encode_multi_process(self, texts: List[str]) -> Optional[np.ndarray]:
+        """Encode on a pool of CPU worker processes; None if the pool cannot be used."""
+        pool = None
+        try:
+            pool = self.model.start_multi_process_pool(["cpu"] * self.config.processes)
+            print(f"🧵 Encoding {len(texts)} texts on {self.config.processes} processes")
+            return np.asarray(
+                self.model.encode(texts, pool=pool, batch_size=self.config.batch_size, show_progress_bar=False),
+                dtype=np.float32,
+            )
+        except Exception as e:
+            print(f"⚠️  Multi-process encoding failed, encoding in-process: {e}")
+            return None
+        finally:
+            if pool is not None:
+                self.model.stop_multi_process_pool(pool)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(list(texts)).tolist()
+
+    def _query_key(self, text: str) -> tuple:
+        normalized = " ".join(text.split())
+        if self.config.query_cache_casefold:
+            normalized = normalized.casefold()
+        return (self.model_name, self.backend, normalized)
+
+    def embed_query_vector(self, text: str) -> np.ndarray:
+        """Embed a query as a read-only float32 vector, served from the LRU cache when possible."""
+        if self.config.query_cache_size <= 0:
+            return self.encode([text])[0]
+
+        key = self._query_key(text)
+        with self._query_cache_lock:
+            vector = self._query_cache.get(key)
+            if vector is not None:
+                self._query_cache.move_to_end(key)
+                self._query_cache_stats["hits"] += 1
+                return vector
+            self._query_cache_stats["misses"] += 1
+
+        vector = self.encode([text])[0]
+        vector.setflags(write=False)
+        with self._query_cache_lock:
+            self._query_cache[key] = vector
+            self._query_cache.move_to_end(key)
+            while len(self._query_cache) > self.config.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_query_vector(text).tolist()
+
+    def get_stats(self) -> Dict:
+        """Backend, batching settings and throughput counters."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["texts_per_second"] = round(stats["texts"] / stats["seconds"], 1) if stats["seconds"] else 0.0
+        stats["seconds"] = round(stats["seconds"], 2)
+        with self._query_cache_lock:
+            cache = {**self._query_cache_stats, "size": len(self._query_cache), "max_size": self.config.query_cache_size}
+        lookups = cache["hits"] + cache["misses"]
+        cache["hit_rate"] = round(cache["hits"] / lookups, 4) if lookups else 0.0
+        return {
+            "model": self.model_name,
+            "backend": self.backend,
+            "dimension": self.dimension,
+            "batch_size": self.config.batch_size,
+            "processes": self.config.processes,
+            **stats,
+            "query_cache": cache,
+        }
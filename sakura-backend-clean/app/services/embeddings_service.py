@@ -3,8 +3,8 @@ Real Embeddings service with HuggingFace models.
 """
 import os
 from typing import Optional
-from langchain_huggingface import HuggingFaceEmbeddings
 from app.core.settings import Settings
+from app.services.embedding_engine import EmbeddingEngine
 
 
 class EmbeddingsService:
@@ -12,9 +12,9 @@ class EmbeddingsService:
     
     def __init__(self, settings: Settings):
         self.settings = settings
-        self.embeddings: Optional[HuggingFaceEmbeddings] = None
+        self.embeddings: Optional[EmbeddingEngine] = None
         
-    def get_embeddings(self) -> HuggingFaceEmbeddings:
+    def get_embeddings(self) -> EmbeddingEngine:
         """Get or create embeddings instance."""
         if self.embeddings:
             return self.embeddings
@@ -25,14 +25,9 @@ class EmbeddingsService:
             print("⚡ Using Hugging Face Inference API embeddings")
             if api_token:
                 os.environ["HUGGINGFACEHUB_API_TOKEN"] = api_token
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name=f"sentence-transformers/{self.settings.embedding_model}"
-            )
         else:
             print("💻 Using local embeddings")
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name=f"sentence-transformers/{self.settings.embedding_model}"
-            )
+        self.embeddings = EmbeddingEngine(f"sentence-transformers/{self.settings.embedding_model}")
         
         return self.embeddings
 
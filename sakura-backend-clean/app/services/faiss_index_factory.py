@@ -0,0 +1,184 @@
+"""
+FAISS index selection for the knowledge base vector store.
+
+LangChain's FAISS wrapper always builds an exhaustive IndexFlatL2. That is the
+right choice for small corpora, but memory and query time grow linearly with
+the number of chunks. The factory picks an index type by corpus size, trains it
+on the vectors being indexed, applies the query-time knobs (nprobe / efSearch),
+and can measure recall against exact search for a sweep of those knobs.
+"""
+import os
+import math
+import time
+import logging
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPE_AUTO = "auto"
+INDEX_TYPE_FLAT = "flat"
+INDEX_TYPE_HNSW = "hnsw"
+INDEX_TYPE_IVF_SQ8 = "ivf_sq8"
+INDEX_TYPE_IVF_PQ = "ivf_pq"
+
+# FAISS warns below ~39 training points per centroid
+_MIN_POINTS_PER_CENTROID = 39
+
+
+class FaissIndexConfig:
+    """Index selection thresholds and search parameters, read from the environment."""
+
+    def __init__(self):
+        self.index_type = os.getenv("VECTOR_INDEX_TYPE", INDEX_TYPE_AUTO).lower()
+        # auto: flat below flat_max vectors, IVF-SQ8 below pq_min, IVF-PQ above
+        self.flat_max = int(os.getenv("VECTOR_INDEX_FLAT_MAX", "20000"))
+        self.pq_min = int(os.getenv("VECTOR_INDEX_PQ_MIN", "500000"))
+        self.hnsw_m = int(os.getenv("VECTOR_INDEX_HNSW_M", "32"))
+        self.hnsw_ef_construction = int(os.getenv("VECTOR_INDEX_HNSW_EF_CONSTRUCTION", "200"))
+        self.hnsw_ef_search = int(os.getenv("VECTOR_INDEX_HNSW_EF_SEARCH", "64"))
+        self.ivf_nlist = int(os.getenv("VECTOR_INDEX_IVF_NLIST", "0"))  # 0 = derived from corpus size
+        self.ivf_nprobe = int(os.getenv("VECTOR_INDEX_IVF_NPROBE", "16"))
+        self.pq_m = int(os.getenv("VECTOR_INDEX_PQ_M", "48"))
+        # Off by default: the sweep runs on every rebuild of an approximate index
+        self.report_enabled = os.getenv("VECTOR_INDEX_REPORT", "false").lower() == "true"
+        self.report_queries = int(os.getenv("VECTOR_INDEX_REPORT_QUERIES", "100"))
+        self.report_k = int(os.getenv("VECTOR_INDEX_REPORT_K", "10"))
+
+
+def select_index_type(num_vectors: int, config: FaissIndexConfig) -> str:
+    """Choose the index type for a corpus of num_vectors."""
+    if config.index_type != INDEX_TYPE_AUTO:
+        return config.index_type
+    if num_vectors < config.flat_max:
+        return INDEX_TYPE_FLAT
+    if num_vectors < config.pq_min:
+        return INDEX_TYPE_IVF_SQ8
+    return INDEX_TYPE_IVF_PQ
+
+
+def _nlist_for(num_vectors: int, config: FaissIndexConfig) -> int:
+    nlist = config.ivf_nlist or int(4 * math.sqrt(num_vectors))
+    return max(1, min(nlist, num_vectors // _MIN_POINTS_PER_CENTROID))
+
+
+def create_index(vectors: np.ndarray, index_type: str, config: FaissIndexConfig) -> faiss.Index:
+    """Create (and train, for IVF types) an empty index for vectors like these."""
+    num_vectors, dimension = vectors.shape
+    if index_type == INDEX_TYPE_FLAT:
+        return faiss.IndexFlatL2(dimension)
+
+    if index_type == INDEX_TYPE_HNSW:
+        index = faiss.IndexHNSWFlat(dimension, config.hnsw_m)
+        index.hnsw.efConstruction = config.hnsw_ef_construction
+        apply_search_params(index, config)
+        return index
+
+    if index_type in (INDEX_TYPE_IVF_SQ8, INDEX_TYPE_IVF_PQ):
+        nlist = _nlist_for(num_vectors, config)
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == INDEX_TYPE_IVF_PQ and dimension % config.pq_m == 0:
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, config.pq_m, 8)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, dimension, nlist, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2
+            )
+        started = time.perf_counter()
+        index.train(vectors)
+        logger.info(f"🏋️  Trained {index_type} index (nlist={nlist}) on {num_vectors} vectors in {time.perf_counter() - started:.1f}s")
+        apply_search_params(index, config)
+        return index
+
+    raise ValueError(f"Unknown vector index type: {index_type}")
+
+
+def apply_search_params(index: faiss.Index, config: FaissIndexConfig) -> None:
+    """Apply query-time parameters (nprobe / efSearch) to a built or loaded index."""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = config.hnsw_ef_search
+        return
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return  # Not an IVF index
+    ivf.nprobe = min(config.ivf_nprobe, ivf.nlist)
+
+
+def describe_index(index: faiss.Index) -> Dict:
+    """Type, size and an estimate of the vector memory of an index."""
+    dimension, ntotal = index.d, index.ntotal
+    info = {"class": type(index).__name__, "ntotal": ntotal, "dimension": dimension}
+    if isinstance(index, faiss.IndexHNSW):
+        info["index_type"] = INDEX_TYPE_HNSW
+        info["ef_search"] = index.hnsw.efSearch
+        # Flat storage plus about 2*M neighbour links per vector on level 0
+        info["approx_memory_bytes"] = ntotal * (dimension * 4 + index.hnsw.nb_neighbors(0) * 4)
+        return info
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        is_pq = isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ)
+        info["index_type"] = INDEX_TYPE_IVF_PQ if is_pq else INDEX_TYPE_IVF_SQ8
+        info["nlist"] = ivf.nlist
+        info["nprobe"] = ivf.nprobe
+        info["approx_memory_bytes"] = ntotal * (ivf.code_size + 8) + ivf.nlist * dimension * 4
+    except RuntimeError:
+        info["index_type"] = INDEX_TYPE_FLAT
+        info["approx_memory_bytes"] = ntotal * dimension * 4
+    return info
+
+
+def _sweep_values(index: faiss.Index, config: FaissIndexConfig) -> List[int]:
+    if isinstance(index, faiss.IndexHNSW):
+        return sorted({16, 32, 64, 128, 256, config.hnsw_ef_search})
+    try:
+        nlist = faiss.extract_index_ivf(index).nlist
+    except RuntimeError:
+        return []
+    return sorted({v for v in (1, 2, 4, 8, 16, 32, 64, 128, config.ivf_nprobe) if v <= nlist})
+
+
+def recall_latency_report(index: faiss.Index, vectors: np.ndarray, config: FaissIndexConfig) -> Dict:
+    """
+    Measure recall@k against exact search, and mean query latency, for a sweep
+    of nprobe / efSearch values. Queries are a random sample of the indexed vectors;
+    exact neighbours are found by brute force over the vectors already in
+    memory, so no second (flat) copy of the corpus is built.
+    """
+    k = min(config.report_k, len(vectors))
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(vectors), size=min(config.report_queries, len(vectors)), replace=False)
+    queries = vectors[sample]
+
+    _, truth = faiss.knn(np.ascontiguousarray(queries, dtype=np.float32), np.ascontiguousarray(vectors, dtype=np.float32), k)
+    truth_sets = [set(row) for row in truth]
+
+    report = {**describe_index(index), "k": k, "queries": len(queries), "flat_memory_bytes": vectors.nbytes, "sweep": []}
+    values = _sweep_values(index, config)
+    if not values:
+        return report
+
+    is_hnsw = isinstance(index, faiss.IndexHNSW)
+    target = index.hnsw if is_hnsw else faiss.extract_index_ivf(index)
+    param = "efSearch" if is_hnsw else "nprobe"
+    for value in values:
+        setattr(target, param, value)
+        started = time.perf_counter()
+        _, found = index.search(queries, k)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        recall = float(np.mean([len(truth_set.intersection(row)) / k for truth_set, row in zip(truth_sets, found)]))
+        report["sweep"].append({param: value, "recall_at_k": round(recall, 4), "ms_per_query": round(elapsed_ms / len(queries), 4)})
+    apply_search_params(index, config)
+    return report
+
+
+def build_index(vectors: np.ndarray, config: Optional[FaissIndexConfig] = None) -> faiss.Index:
+    """Create, train and fill an index for vectors, choosing its type by corpus size."""
+    config = config or FaissIndexConfig()
+    index_type = select_index_type(len(vectors), config)
+    if index_type != INDEX_TYPE_FLAT and len(vectors) < _MIN_POINTS_PER_CENTROID:
+        index_type = INDEX_TYPE_FLAT  # Too few vectors to train on
+    index = create_index(vectors, index_type, config)
+    index.add(vectors)
+    return index
@@ -1,261 +1,337 @@
 """
-FAQ Embedding Service for generating and managing FAQ embeddings in the vector store.
+FAQ Embedding Service for generating and managing FAQ embeddings.
+
+Two FAQ indexes are kept in memory:
+- the knowledge base FAQ index, derived from the live vector store (the FAQs
+  enabled for the AI agent); chat routing searches this one;
+- per-tenant FAQ indexes keyed by faq_id, loaded from MongoDB on first use and
+  kept current by upserting and deleting single FAQs as they are edited. A
+  tenant can have two: one over question + answer text for FAQ search, and one
+  over the question alone, which the intent router matches user messages against.
 """
-from typing import List, Optional
-from langchain_core.documents import Document
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from bson import ObjectId
 from app.services.vector_store_service import VectorStoreService
+from app.services.faq_index import FAQIndex
 from app.services.embeddings_service import EmbeddingsService
+from app.services.index_sync import notify_faq_update
 from app.core.settings import Settings
 
 
+def _unit_rows(vectors) -> np.ndarray:
+    """Scale vectors to unit length, so squared L2 distance is 2 - 2 * cosine."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
 class FAQEmbeddingService:
     """Service for managing FAQ embeddings."""
-    
+
     def __init__(
         self,
         vector_store_service: VectorStoreService,
         embeddings_service: EmbeddingsService,
-        settings: Settings
+        settings: Settings,
+        db=None
     ):
         self.vector_store_service = vector_store_service
         self.embeddings_service = embeddings_service
         self.settings = settings
+        self.db = db
+        # FAQ-only index derived from the live vector store, rebuilt when the store changes
+        self._faq_index: Optional[FAQIndex] = None
+        self._faq_index_source = None
+        self._faq_index_lock = threading.Lock()
+        # Per-tenant FAQ indexes keyed by (dashboard_user_id, questions_only), least recently used first
+        self.max_tenant_indexes = int(os.getenv("FAQ_INDEX_MAX_TENANTS", "256"))
+        self._tenant_indexes: "OrderedDict[Tuple[str, bool], FAQIndex]" = OrderedDict()
+        self._tenant_lock = threading.Lock()
         
+        if self.db is not None:
+            self._initialize_indexes()
+
+    def _initialize_indexes(self):
+        """Create indexes on the faqs collection for tenant loads and id lookups."""
+        try:
+            faqs_collection = self.db.faqs
+            faqs_collection.create_index("dashboard_user_id")
+            # Some FAQs carry an alternate "id" field that KB items may reference
+            faqs_collection.create_index([("dashboard_user_id", 1), ("id", 1)])
+            print("✅ Created indexes on faqs collection")
+        except Exception as e:
+            print(f"⚠️  Could not create FAQ indexes: {e}")
+
+    def get_faq_index(self) -> Optional[FAQIndex]:
+        """The FAQ index for the live vector store, built on first use after each swap."""
+        vector_store = self.vector_store_service.get_vector_store()
+        if vector_store is None:
+            return None
+        with self._faq_index_lock:
+            if self._faq_index_source is not vector_store:
+                started = time.perf_counter()
+                self._faq_index = FAQIndex.from_vector_store(vector_store, self.embeddings_service.get_embeddings())
+                self._faq_index_source = vector_store
+                print(f"💬 Built FAQ index over {len(self._faq_index)} FAQs in {time.perf_counter() - started:.2f}s")
+            return self._faq_index
+
+    def get_tenant_faq_index(self, dashboard_user_id: str, questions_only: bool = False) -> Optional[FAQIndex]:
+        """
+        A tenant's FAQ index, loaded from the database on first use. With
+        questions_only, FAQs are embedded by their question text alone.
+        """
+        key = (dashboard_user_id, questions_only)
+        with self._tenant_lock:
+            index = self._tenant_indexes.get(key)
+            if index is not None:
+                self._tenant_indexes.move_to_end(key)
+                return index
+        if self.db is None:
+            return None
+
+        started = time.perf_counter()
+        faqs = [
+            faq for faq in self.db.faqs.find({"dashboard_user_id": dashboard_user_id}, {"question": 1, "answer": 1})
+            if faq.get("question") and faq.get("answer")
+        ]
+        embeddings = self.embeddings_service.get_embeddings()
+        index = FAQIndex(embeddings.dimension, capacity=max(64, len(faqs)))
+        if faqs:
+            vectors = embeddings.encode([self._embedding_text(faq["question"], faq["answer"], questions_only) for faq in faqs])
+            if questions_only:
+                vectors = _unit_rows(vectors)
+            index.add([self._entry(str(faq["_id"]), faq["question"], faq["answer"]) for faq in faqs], vectors)
+        print(f"💬 Loaded FAQ index for {dashboard_user_id} ({len(index)} FAQs) in {time.perf_counter() - started:.2f}s")
+
+        with self._tenant_lock:
+            # Another request may have loaded it meanwhile; keep the first one
+            index = self._tenant_indexes.setdefault(key, index)
+            self._tenant_indexes.move_to_end(key)
+            while len(self._tenant_indexes) > self.max_tenant_indexes:
+                self._tenant_indexes.popitem(last=False)
+            return index
+
+    def _loaded_indexes(self) -> List[Tuple[FAQIndex, bool]]:
+        """(index, questions_only) for the FAQ indexes already in memory: every loaded tenant's plus the knowledge base's."""
+        with self._tenant_lock:
+            indexes = [(index, questions_only) for (_, questions_only), index in self._tenant_indexes.items()]
+        if self._faq_index is not None:
+            indexes.append((self._faq_index, False))
+        return indexes
+
     def generate_faq_text(self, question: str, answer: str) -> str:
-        """Generate combined text from FAQ question and answer for embedding."""
-        return f"{question}\n\n{answer}".strip()
-    
-    def add_faq_embedding(self, faq_id: str, question: str, answer: str, auto_add_to_vector_store: bool = False) -> bool:
+        """Generate combined text from FAQ question and answer for embedding (same format as the KB index)."""
+        return f"Q: {question}\n\nA: {answer}".strip()
+
+    def _embedding_text(self, question: str, answer: str, questions_only: bool) -> str:
+        return question.strip() if questions_only else self.generate_faq_text(question, answer)
+
+    def _entry(self, faq_id: str, question: str, answer: str) -> Dict:
+        return {"faq_id": faq_id, "question": question, "answer": answer}
+
+    def upsert_faq(
+        self,
+        faq_id: str,
+        question: str,
+        answer: str,
+        dashboard_user_id: Optional[str] = None,
+        notify: bool = True
+    ) -> bool:
         """
-        Generate embedding for FAQ.
-        
-        NOTE: FAQ is stored in MongoDB but NOT automatically added to vector store.
-        It will only be added when the FAQ is selected in AI Agent Settings.
-        
+        Insert or replace one FAQ in the FAQ indexes that are in memory: the
+        tenant's, and the knowledge base's if the FAQ is enabled there. Costs one
+        embedding; indexes not loaded yet pick the FAQ up when they load.
+        """
+        try:
+            targets = [(index, questions_only) for index, questions_only in self._loaded_indexes() if faq_id in index]
+            if dashboard_user_id:
+                with self._tenant_lock:
+                    tenant_indexes = [
+                        (self._tenant_indexes.get((dashboard_user_id, questions_only)), questions_only)
+                        for questions_only in (False, True)
+                    ]
+                for tenant_index, questions_only in tenant_indexes:
+                    if tenant_index is not None and all(index is not tenant_index for index, _ in targets):
+                        targets.append((tenant_index, questions_only))  # New to this tenant
+            if targets:
+                # One embedding per kind of text the target indexes hold
+                kinds = sorted({questions_only for _, questions_only in targets})
+                encoded = self.embeddings_service.get_embeddings().encode(
+                    [self._embedding_text(question, answer, questions_only) for questions_only in kinds]
+                )
+                vectors = {
+                    questions_only: _unit_rows(vector)[0] if questions_only else vector
+                    for questions_only, vector in zip(kinds, encoded)
+                }
+                entry = self._entry(faq_id, question, answer)
+                for index, questions_only in targets:
+                    index.upsert(entry, vectors[questions_only])
+            if notify:
+                notify_faq_update("upsert", [faq_id], dashboard_user_id)
+            return True
+        except Exception as e:
+            print(f"❌ Error indexing FAQ {faq_id}: {e}")
+            return False
+
+    def delete_faqs(self, faq_ids: List[str], notify: bool = True) -> bool:
+        """Remove FAQs from every FAQ index in memory."""
+        try:
+            removed = 0
+            for index, _ in self._loaded_indexes():
+                for faq_id in faq_ids:
+                    removed += index.delete(faq_id)
+            print(f"🗑️  Removed {len(faq_ids)} FAQs from FAQ indexes ({removed} entries)")
+            if notify:
+                notify_faq_update("delete", faq_ids)
+            return True
+        except Exception as e:
+            print(f"❌ Error deleting FAQ embeddings: {e}")
+            return False
+
+    def add_faq_embedding(self, faq_id: str, question: str, answer: str, dashboard_user_id: Optional[str] = None) -> bool:
+        """
+        Index a newly created FAQ for FAQ search.
+
+        NOTE: The FAQ is NOT added to the knowledge base vector store. It will
+        only be added there when the FAQ is selected in AI Agent Settings.
+
         Args:
             faq_id: Unique FAQ identifier
             question: FAQ question text
             answer: FAQ answer text
-            auto_add_to_vector_store: If True, add to vector store immediately (for backward compatibility)
-            
+            dashboard_user_id: Tenant that owns the FAQ
+
         Returns:
             bool: True if successful, False otherwise
         """
-        try:
-            # FAQ is already stored in MongoDB
-            # We don't automatically add it to vector store anymore
-            # It will be added when the user enables this FAQ in AI Agent Settings
-            print(f"✅ FAQ {faq_id} stored in MongoDB (will be indexed when enabled in AI Agent Settings)")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Error processing FAQ {faq_id}: {e}")
-            return False
-    
-    def update_faq_embedding(self, faq_id: str, question: str, answer: str) -> bool:
+        return self.upsert_faq(faq_id, question, answer, dashboard_user_id)
+
+    def update_faq_embedding(self, faq_id: str, question: str, answer: str, dashboard_user_id: Optional[str] = None) -> bool:
         """
-        Update FAQ embedding by removing old and adding new.
-        
+        Re-embed an edited FAQ in place.
+
         Args:
             faq_id: Unique FAQ identifier
             question: Updated FAQ question text
             answer: Updated FAQ answer text
-            
+            dashboard_user_id: Tenant that owns the FAQ
+
         Returns:
             bool: True if successful, False otherwise
         """
-        # First delete the old embedding, then add new one
-        deleted = self.delete_faq_embedding(faq_id)
-        if not deleted:
-            print(f"⚠️ Could not delete old embedding for FAQ {faq_id}, adding new anyway")
-        
-        return self.add_faq_embedding(faq_id, question, answer)
-    
-    def delete_faq_embedding(self, faq_id: str, db=None, rebuild_after_delete: bool = True) -> bool:
+        return self.upsert_faq(faq_id, question, answer, dashboard_user_id)
+
+    def delete_faq_embedding(self, faq_id: str) -> bool:
         """
-        Delete FAQ embedding from vector store by FAQ ID.
-        
-        Note: FAISS doesn't support direct deletion. This method will:
-        1. Mark the FAQ for exclusion (returns True immediately)
-        2. Optionally rebuild the index from active FAQs in the database
-        
+        Delete an FAQ's embedding from the FAQ indexes.
+
+        The knowledge base vector store keeps the FAQ chunk until its next
+        rebuild, which only includes FAQs that still exist.
+
         Args:
             faq_id: Unique FAQ identifier to delete
-            db: MongoDB database instance (optional, for rebuilding)
-            rebuild_after_delete: Whether to rebuild the index after deletion
-            
+
         Returns:
             bool: True if successful, False otherwise
         """
-        try:
-            if not self.vector_store_service.is_initialized():
-                print("❌ Vector store not initialized")
-                return False
-            
-            # FAISS doesn't support direct deletion, so we'll rebuild from the database
-            if rebuild_after_delete and db:
-                print(f"🔄 Rebuilding index after deleting FAQ {faq_id}...")
-                return self.rebuild_faq_index_from_db(db, exclude_faq_ids=[faq_id])
-            else:
-                print(f"⚠️ FAQ {faq_id} embedding will be excluded on next rebuild")
-                return True
-            
-        except Exception as e:
-            print(f"❌ Error deleting FAQ embedding: {e}")
-            return False
-    
-    def delete_multiple_faq_embeddings(self, faq_ids: List[str], db=None, rebuild_after_delete: bool = True) -> bool:
+        return self.delete_faqs([faq_id])
+
+    def delete_multiple_faq_embeddings(self, faq_ids: List[str]) -> bool:
         """Delete multiple FAQ embeddings."""
-        if rebuild_after_delete and db:
-            print(f"🔄 Rebuilding index after deleting {len(faq_ids)} FAQs...")
-            return self.rebuild_faq_index_from_db(db, exclude_faq_ids=faq_ids)
-        else:
-            success = True
-            for faq_id in faq_ids:
-                if not self.delete_faq_embedding(faq_id, db=None, rebuild_after_delete=False):
-                    success = False
-            return success
-    
+        return self.delete_faqs(faq_ids)
+
+    def apply_remote_update(self, event: Dict) -> None:
+        """Apply an FAQ change announced by another worker."""
+        faq_ids = event.get("faq_ids") or []
+        if event.get("op") == "delete":
+            self.delete_faqs(faq_ids, notify=False)
+            return
+        if self.db is None or not self._loaded_indexes():
+            return  # Nothing in memory to update
+        object_ids = [ObjectId(faq_id) for faq_id in faq_ids if ObjectId.is_valid(faq_id)]
+        # Re-read the FAQ rather than trusting the event; upsert_faq skips it if no loaded index wants it
+        for faq in self.db.faqs.find({"_id": {"$in": object_ids}}, {"question": 1, "answer": 1, "dashboard_user_id": 1}):
+            self.upsert_faq(str(faq["_id"]), faq.get("question", ""), faq.get("answer", ""), faq.get("dashboard_user_id"), notify=False)
+
     def search_similar_faqs(
         self,
         query: str,
         top_k: int = 5,
-        score_threshold: float = 0.0
+        score_threshold: float = 0.0,
+        embedding: Optional[List[float]] = None,
+        dashboard_user_id: Optional[str] = None,
+        questions_only: bool = False
     ) -> List[dict]:
         """
-        Search for similar FAQs using semantic similarity.
-        
+        Search for similar FAQs using semantic similarity, over an FAQ-only index.
+
         Args:
             query: User query text
             top_k: Number of results to return
             score_threshold: Minimum similarity score (0.0 to 1.0)
-            
+            embedding: Precomputed query embedding to reuse (embedded here if None)
+            dashboard_user_id: Search all of this tenant's FAQs; if None, search
+                the FAQs enabled in the knowledge base
+            questions_only: Match against the tenant's FAQ questions alone
+                rather than question + answer text (needs dashboard_user_id).
+                Vectors are unit length, so distance is 2 - 2 * cosine similarity
+
         Returns:
             List of dictionaries with FAQ data and similarity scores
         """
         try:
-            if not self.vector_store_service.is_initialized():
-                print("❌ Vector store not initialized")
+            if dashboard_user_id:
+                faq_index = self.get_tenant_faq_index(dashboard_user_id, questions_only)
+            else:
+                faq_index = self.get_faq_index()
+            if faq_index is None:
+                print("❌ FAQ index not available")
                 return []
-            
-            vector_store = self.vector_store_service.get_vector_store()
-            if not vector_store:
-                print("❌ Vector store instance not available")
+            if not len(faq_index):
                 return []
-            
-            # Perform similarity search with scores
-            results_with_score = vector_store.similarity_search_with_score(query, k=top_k * 2)  # Get more to filter
-            
-            # Filter by FAQ type and extract relevant information
+
+            if embedding is None:
+                embedding = self.vector_store_service.embed_query(query)
+            if questions_only and dashboard_user_id:
+                embedding = _unit_rows(embedding)[0]
+
             similar_faqs = []
-            for doc, score in results_with_score:
-                metadata = doc.metadata
-                
-                # Only include FAQ documents
-                if metadata.get("type") == "faq" and metadata.get("source") == "faq":
-                    # Invert score (FAISS returns distance, lower is better)
-                    # Convert to similarity score (higher is better)
-                    similarity_score = 1.0 / (1.0 + score) if score > 0 else 1.0
-                    
-                    if similarity_score >= score_threshold:
-                        similar_faqs.append({
-                            "faq_id": metadata.get("faq_id", ""),
-                            "question": metadata.get("question", ""),
-                            "answer": doc.page_content.split("\n\n", 1)[1] if "\n\n" in doc.page_content else doc.page_content,
-                            "score": similarity_score,
-                            "distance": float(score)
-                        })
-            
+            for faq, distance in faq_index.search(embedding, top_k):
+                # Convert distance (lower is better) to similarity (higher is better)
+                similarity_score = 1.0 / (1.0 + distance) if distance > 0 else 1.0
+                if similarity_score >= score_threshold:
+                    similar_faqs.append({**faq, "score": similarity_score, "distance": distance})
+
             return similar_faqs
-            
+
         except Exception as e:
             print(f"❌ Error searching similar FAQs: {e}")
             return []
-    
-    def rebuild_faq_index_from_db(
-        self,
-        db,
-        faq_collection_name: str = "faqs",
-        exclude_faq_ids: Optional[List[str]] = None
-    ) -> bool:
+
+    def rebuild_faq_index_from_db(self, dashboard_user_id: Optional[str] = None) -> bool:
         """
-        Rebuild FAQ index from database, optionally excluding specific FAQ IDs.
-        This is useful after bulk deletions or to ensure consistency.
-        
-        Note: This rebuilds ALL FAQs, which may cause duplication if other
-        documents exist in the vector store. For production, consider maintaining
-        separate indexes or using a vector store that supports deletion.
-        
-        Args:
-            db: MongoDB database instance
-            faq_collection_name: Name of the FAQs collection
-            exclude_faq_ids: List of FAQ IDs to exclude from rebuild
-            
+        Reload FAQ indexes from the database: one tenant's, or (if None) every
+        tenant's, lazily on their next search. Use after bulk imports or to
+        recover from a missed update.
+
         Returns:
             bool: True if successful, False otherwise
         """
         try:
-            if not db:
-                print("❌ Database not available")
-                return False
-            
-            exclude_set = set(exclude_faq_ids) if exclude_faq_ids else set()
-            collection = db[faq_collection_name]
-            faqs = list(collection.find({}))
-            
-            if not self.vector_store_service.is_initialized():
-                print("❌ Vector store not initialized")
-                return False
-            
-            vector_store = self.vector_store_service.get_vector_store()
-            if not vector_store:
-                print("❌ Vector store instance not available")
-                return False
-            
-            # Filter out excluded FAQs
-            filtered_faqs = [
-                faq for faq in faqs
-                if str(faq.get("_id", "")) not in exclude_set
-            ]
-            
-            # Build documents from active FAQs
-            documents = []
-            for faq in filtered_faqs:
-                faq_id = str(faq.get("_id", ""))
-                question = faq.get("question", "")
-                answer = faq.get("answer", "")
-                
-                if not question or not answer:
-                    continue
-                
-                faq_text = self.generate_faq_text(question, answer)
-                
-                metadata = {
-                    "source": "faq",
-                    "faq_id": faq_id,
-                    "type": "faq",
-                    "question": question[:200],
-                }
-                
-                doc = Document(page_content=faq_text, metadata=metadata)
-                documents.append(doc)
-            
-            # For a proper rebuild, we'd need to remove old FAQ documents first
-            # Since FAISS doesn't support deletion, we'll add new ones
-            # This may cause duplicates, but similarity search will still work
-            # A production solution would maintain a separate FAQ index or use
-            # a vector store that supports deletion
-            
-            if documents:
-                vector_store.add_documents(documents)
-                faiss_path = self.settings.faiss_index_path
-                vector_store.save_local(str(faiss_path))
-                print(f"✅ Rebuilt FAQ index with {len(documents)} FAQs")
-                if exclude_set:
-                    print(f"   Excluded {len(exclude_set)} deleted FAQs")
-            
+            with self._tenant_lock:
+                if dashboard_user_id is None:
+                    self._tenant_indexes.clear()
+                else:
+                    for questions_only in (False, True):
+                        self._tenant_indexes.pop((dashboard_user_id, questions_only), None)
+            if dashboard_user_id is not None:
+                return self.get_tenant_faq_index(dashboard_user_id) is not None
             return True
-            
         except Exception as e:
             print(f"❌ Error rebuilding FAQ index: {e}")
             return False
@@ -268,14 +344,16 @@ faq_embedding_service: Optional[FAQEmbeddingService] = None
 def init_faq_embedding_service(
     vector_store_service: VectorStoreService,
     embeddings_service: EmbeddingsService,
-    settings: Settings
+    settings: Settings,
+    db=None
 ) -> FAQEmbeddingService:
     """Initialize FAQ embedding service."""
     global faq_embedding_service
     faq_embedding_service = FAQEmbeddingService(
         vector_store_service,
         embeddings_service,
-        settings
+        settings,
+        db=db
     )
     return faq_embedding_service
 
@@ -285,4 +363,3 @@ def get_faq_embedding_service() -> FAQEmbeddingService:
     if not faq_embedding_service:
         raise Exception("FAQ embedding service not initialized.")
     return faq_embedding_service
-
@@ -0,0 +1,159 @@
+"""
+Dedicated vector index over FAQ entries.
+
+FAQs share the main index with website and file chunks, so an FAQ search there
+has to over-fetch and throw most hits away. This index holds only FAQs, with
+the question and answer alongside each vector, so a search returns hydrated
+results straight away. Entries are keyed by faq_id and can be upserted and
+deleted in place, which FAISS flat indexes cannot do cheaply.
+"""
+import re
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+# FAQ documents from the KB manager are stored as "Q: ...\n\nA: ..."
+_QUESTION_PREFIX = re.compile(r"^\s*Q:\s*")
+_ANSWER_PREFIX = re.compile(r"^\s*A:\s*")
+
+
+def is_faq_document(doc: Document) -> bool:
+    return doc.metadata.get("type") == "faq" and doc.metadata.get("source") == "faq"
+
+
+def parse_faq_document(doc: Document) -> Dict:
+    """faq_id, question and answer of an FAQ document, without the Q:/A: labels."""
+    content = doc.page_content or ""
+    question, answer = content.split("\n\n", 1) if "\n\n" in content else ("", content)
+    return {
+        "faq_id": doc.metadata.get("faq_id", ""),
+        "question": doc.metadata.get("question") or _QUESTION_PREFIX.sub("", question, count=1).strip(),
+        "answer": _ANSWER_PREFIX.sub("", answer, count=1).strip(),
+    }
+
+
+def iter_faq_rows(vector_store) -> Iterator[Tuple[Optional[int], Document]]:
+    """Stream (index position, document) for every FAQ in a FAISS vector store."""
+    docstore = vector_store.docstore
+    if hasattr(docstore, "iter_rows"):
+        for position, _, doc in docstore.iter_rows():
+            if is_faq_document(doc):
+                yield position, doc
+        return
+    positions = {doc_id: position for position, doc_id in vector_store.index_to_docstore_id.items()}
+    for doc_id, doc in getattr(docstore, "_dict", {}).items():
+        if isinstance(doc, Document) and is_faq_document(doc):
+            yield positions.get(doc_id), doc
+
+
+class FAQIndex:
+    """
+    Exact L2 index over FAQ vectors keyed by faq_id, returning the stored FAQ
+    with each hit. Vectors live in fixed slots of one matrix: an upsert
+    overwrites the FAQ's slot and a delete frees it for the next insert, so
+    writes are O(1) and the matrix never outgrows the largest FAQ count seen.
+    """
+
+    def __init__(self, dimension: int, capacity: int = 64):
+        self.dimension = dimension
+        self._vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self._norms = np.zeros(capacity, dtype=np.float32)
+        self._active = np.zeros(capacity, dtype=bool)
+        self._entries: List[Optional[Dict]] = [None] * capacity
+        self._slots: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._used = 0  # Slots ever handed out (high-water mark)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, faq_id: str) -> bool:
+        return faq_id in self._slots
+
+    def _grow(self) -> None:
+        extra = len(self._entries)
+        self._vectors = np.concatenate([self._vectors, np.zeros((extra, self.dimension), dtype=np.float32)])
+        self._norms = np.concatenate([self._norms, np.zeros(extra, dtype=np.float32)])
+        self._active = np.concatenate([self._active, np.zeros(extra, dtype=bool)])
+        self._entries.extend([None] * extra)
+
+    def _upsert(self, entry: Dict, vector: np.ndarray) -> None:
+        faq_id = entry["faq_id"]
+        slot = self._slots.get(faq_id)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                if self._used == len(self._entries):
+                    self._grow()
+                slot = self._used
+                self._used += 1
+            self._slots[faq_id] = slot
+        self._vectors[slot] = vector
+        self._norms[slot] = float(vector @ vector)
+        self._active[slot] = True
+        self._entries[slot] = entry
+
+    def upsert(self, entry: Dict, vector) -> None:
+        """Insert or replace one FAQ entry (faq_id, question, answer) and its vector."""
+        with self._lock:
+            self._upsert(entry, np.asarray(vector, dtype=np.float32).reshape(-1))
+
+    def add(self, entries: List[Dict], vectors: np.ndarray) -> None:
+        """Upsert several FAQ entries with their vectors."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            for entry, vector in zip(entries, vectors):
+                self._upsert(entry, vector)
+
+    def delete(self, faq_id: str) -> bool:
+        """Remove an FAQ; its slot is reused by the next insert."""
+        with self._lock:
+            slot = self._slots.pop(faq_id, None)
+            if slot is None:
+                return False
+            self._active[slot] = False
+            self._entries[slot] = None
+            self._free.append(slot)
+            return True
+
+    def search(self, vector, k: int) -> List[Tuple[Dict, float]]:
+        """Return the k nearest FAQs as (entry, squared L2 distance)."""
+        query = np.asarray(vector, dtype=np.float32).reshape(-1)
+        with self._lock:
+            k = min(k, len(self._slots))
+            if k <= 0:
+                return []
+            used = self._used
+            # |v - q|^2 = |v|^2 - 2 v.q + |q|^2, with free slots pushed to infinity
+            distances = self._norms[:used] - 2 * (self._vectors[:used] @ query) + float(query @ query)
+            distances[~self._active[:used]] = np.inf
+            nearest = np.argpartition(distances, k - 1)[:k] if k < used else np.arange(used)
+            nearest = nearest[np.argsort(distances[nearest], kind="stable")][:k]
+            return [(self._entries[slot], max(float(distances[slot]), 0.0)) for slot in nearest]
+
+    @classmethod
+    def from_vector_store(cls, vector_store, embeddings) -> "FAQIndex":
+        """
+        Build the index from the FAQ documents of a FAISS vector store. Vectors are
+        read back from the store's index where it supports reconstruction, and
+        re-embedded otherwise (IVF indexes without a direct map).
+        """
+        rows = list(iter_faq_rows(vector_store))
+        index = cls(vector_store.index.d, capacity=max(64, len(rows)))
+        if not rows:
+            return index
+        positions = [position for position, _ in rows]
+        vectors = None
+        if None not in positions:
+            try:
+                vectors = vector_store.index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+            except RuntimeError:
+                vectors = None
+        if vectors is None:
+            vectors = np.asarray(embeddings.embed_documents([doc.page_content for _, doc in rows]), dtype=np.float32)
+        index.add([parse_faq_document(doc) for _, doc in rows], vectors)
+        return index
@@ -3,14 +3,16 @@ File processing service for extracting and chunking content from various file ty
 Supports PDF, DOCX, TXT, CSV, XLSX files.
 """
 import os
-import re
+import uuid
 import logging
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from datetime import datetime
 from pymongo.database import Database
 
 from app.core.settings import Settings
+from app.services.document_extraction_engine import get_extraction_engine, rows_to_text
+from app.services.text_chunker import get_text_chunker
 
 logger = logging.getLogger(__name__)
 
@@ -22,9 +24,19 @@ class FileProcessingService:
         self.settings = settings
         self.db = db
         
-        # Configuration
-        self.chunk_size = int(os.getenv("FILE_CHUNK_SIZE", "200"))
-        self.overlap = int(os.getenv("FILE_CHUNK_OVERLAP", "50"))
+        # Configuration (chunk budgets are in embedding-model tokens)
+        self.chunker = get_text_chunker()
+        self.chunk_size = int(os.getenv("FILE_CHUNK_SIZE", str(self.chunker.max_tokens)))
+        self.overlap = int(os.getenv("FILE_CHUNK_OVERLAP", str(self.chunker.overlap_tokens)))
+        # Run PDF/DOCX/XLSX/CSV extraction in worker processes instead of the API process
+        self.use_process_pool = os.getenv("FILE_EXTRACTION_USE_POOL", "true").lower() == "true"
+        # Streaming limits: uploads are written to disk in blocks and text is chunked
+        # and inserted incrementally, so peak memory does not grow with file size
+        self.max_upload_bytes = int(os.getenv("FILE_UPLOAD_MAX_MB", "50")) * 1024 * 1024
+        self.upload_block_size = int(os.getenv("FILE_UPLOAD_BLOCK_KB", "1024")) * 1024
+        self.stream_segment_chars = int(os.getenv("FILE_STREAM_SEGMENT_CHARS", "65536"))
+        self.stream_rows = int(os.getenv("FILE_STREAM_ROWS", "1000"))
+        self.insert_batch_size = int(os.getenv("FILE_CHUNK_INSERT_BATCH", "500"))
         
         # Initialize database indexes if database is available
         if self.db is not None:
@@ -47,6 +59,7 @@ class FileProcessingService:
             chunks_collection.create_index("dashboard_user_id")
             chunks_collection.create_index([("dashboard_user_id", 1), ("file_id", 1)])
             chunks_collection.create_index([("file_id", 1), ("chunk_index", 1)])
+            chunks_collection.create_index([("file_id", 1), ("generation", 1), ("chunk_index", 1)])
             # Text index for full-text search on chunk text
             chunks_collection.create_index([("text", "text")])
             logger.info("✅ Created indexes on file-chunks collection")
@@ -54,26 +67,104 @@ class FileProcessingService:
             logger.warning(f"⚠️  Could not create indexes: {e}")
     
     def chunk_text(self, text: str, chunk_size: Optional[int] = None, overlap: Optional[int] = None) -> List[Dict]:
-        """Split text into overlapping word chunks."""
+        """Split text into token-budgeted, sentence-aligned chunks."""
         chunk_size = chunk_size or self.chunk_size
-        overlap = overlap or self.overlap
+        overlap = self.overlap if overlap is None else overlap
+        return self.chunker.chunk_text(text, chunk_size, overlap)
+    
+    def iter_chunks(
+        self,
+        segments: Iterable[str],
+        chunk_size: Optional[int] = None,
+        overlap: Optional[int] = None
+    ) -> Iterator[Dict]:
+        """Incremental version of chunk_text over a stream of text segments."""
+        chunk_size = chunk_size or self.chunk_size
+        overlap = self.overlap if overlap is None else overlap
+        return self.chunker.iter_chunks(segments, chunk_size, overlap)
+    
+    def iter_text_segments(self, file_path: Path, file_type: str, stats: Dict) -> Iterator[str]:
+        """
+        Extract text from a file piece by piece (PDF page range, sheet, row batch, text block).
+        
+        stats["page_count"] is filled in as extraction progresses, using the same
+        units as extract_text_from_file.
+        """
+        file_type_lower = file_type.lower()
+        stats["page_count"] = 0
+        
+        if file_type_lower == 'pdf':
+            if self.use_process_pool:
+                engine = get_extraction_engine()
+                page_count = engine.get_pdf_page_count(file_path)
+                stats["page_count"] = page_count
+                for page_texts in engine.iter_pdf_pages(file_path, page_count):
+                    if page_texts:
+                        yield "\n\n".join(page_texts)
+            else:
+                import PyPDF2
+                with open(file_path, 'rb') as file:
+                    pdf_reader = PyPDF2.PdfReader(file)
+                    stats["page_count"] = len(pdf_reader.pages)
+                    for page_num, page in enumerate(pdf_reader.pages):
+                        try:
+                            text = page.extract_text() or ""
+                        except Exception as e:
+                            logger.warning(f"Error extracting text from page {page_num + 1}: {e}")
+                            continue
+                        if text.strip():
+                            yield text
         
-        words = re.findall(r"\S+", text)
-        chunks = []
-        i = 0
-        while i < len(words):
-            start = i
-            end = min(i + chunk_size, len(words))
-            chunk_words = words[start:end]
-            chunk_text = " ".join(chunk_words)
-            chunks.append({
-                "id": f"chunk_{start}_{end}",
-                "start_word": start,
-                "end_word": end - 1,
-                "text": chunk_text
-            })
-            i = i + chunk_size - overlap
-        return chunks
+        elif file_type_lower in ['docx', 'doc']:
+            # python-docx parses the whole document tree up front, so there is nothing to stream
+            text, page_count = self.extract_text_from_file(file_path, file_type_lower)
+            stats["page_count"] = page_count
+            yield text
+        
+        elif file_type_lower == 'txt':
+            total_chars = 0
+            buffer: List[str] = []
+            buffered = 0
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
+                for line in file:
+                    buffer.append(line)
+                    buffered += len(line)
+                    if buffered >= self.stream_segment_chars:
+                        total_chars += buffered
+                        yield "".join(buffer)
+                        buffer, buffered = [], 0
+            if buffer:
+                total_chars += buffered
+                yield "".join(buffer)
+            stats["page_count"] = max(1, total_chars // 2000)
+        
+        elif file_type_lower == 'csv':
+            import pandas as pd
+            row_count = 0
+            for i, df in enumerate(pd.read_csv(file_path, chunksize=self.stream_rows)):
+                row_count += len(df)
+                stats["page_count"] = row_count
+                yield "\n".join(rows_to_text(df, include_headers=(i == 0)))
+        
+        elif file_type_lower in ['xlsx', 'xls']:
+            if self.use_process_pool:
+                sheets = get_extraction_engine().iter_xlsx_sheets(file_path)
+            else:
+                sheets = self._iter_xlsx_sheets_in_process(file_path)
+            for sheet_lines in sheets:
+                stats["page_count"] += 1
+                yield "\n".join(sheet_lines)
+        
+        else:
+            raise ValueError(f"Unsupported file type: {file_type}")
+    
+    def _iter_xlsx_sheets_in_process(self, file_path: Path) -> Iterator[List[str]]:
+        """Yield each worksheet's text lines without the process pool."""
+        import pandas as pd
+        with pd.ExcelFile(file_path) as excel_file:
+            for sheet_name in excel_file.sheet_names:
+                df = pd.read_excel(excel_file, sheet_name=sheet_name)
+                yield [f"\n=== Sheet: {sheet_name} ===\n"] + rows_to_text(df)
     
     def extract_text_from_pdf(self, file_path: Path) -> Tuple[str, int]:
         """Extract text from PDF file. Returns (text, page_count)."""
@@ -202,6 +293,9 @@ class FileProcessingService:
         """Extract text from file based on type. Returns (text, page_count)."""
         file_type_lower = file_type.lower()
         
+        if self.use_process_pool and file_type_lower != 'txt':
+            return self._extract_text_in_pool(file_path, file_type_lower)
+        
         if file_type_lower == 'pdf':
             return self.extract_text_from_pdf(file_path)
         elif file_type_lower in ['docx', 'doc']:
@@ -215,6 +309,27 @@ class FileProcessingService:
         else:
             raise ValueError(f"Unsupported file type: {file_type}")
     
+    def _extract_text_in_pool(self, file_path: Path, file_type_lower: str) -> Tuple[str, int]:
+        """Extract text using the process-pool extraction engine. Returns (text, page_count)."""
+        engine = get_extraction_engine()
+        try:
+            if file_type_lower == 'pdf':
+                return engine.extract_pdf(file_path)
+            elif file_type_lower in ['docx', 'doc']:
+                return engine.extract_docx(file_path)
+            elif file_type_lower == 'csv':
+                return engine.extract_csv(file_path)
+            elif file_type_lower in ['xlsx', 'xls']:
+                return engine.extract_xlsx(file_path)
+            else:
+                raise ValueError(f"Unsupported file type: {file_type_lower}")
+        except ImportError as e:
+            logger.error(f"Document parser not installed: {e}")
+            raise Exception(f"{file_type_lower.upper()} processing not available: {e}")
+        except Exception as e:
+            logger.error(f"Error extracting text from {file_type_lower.upper()}: {e}")
+            raise
+    
     def process_file(
         self, 
         file_path: Path, 
@@ -266,42 +381,48 @@ class FileProcessingService:
                 }
             )
         
+        # Chunks are written under a new generation; the file's active_generation
+        # is flipped only once processing succeeds, so readers never see a partial file
+        generation = uuid.uuid4().hex
+        
         try:
-            # Extract text from file
+            # Extract, chunk and store incrementally so memory stays bounded
             logger.info(f"Extracting text from {file_type} file: {original_filename}")
-            text, page_count = self.extract_text_from_file(file_path, file_type)
+            stats: Dict = {}
+            segments = self.iter_text_segments(file_path, file_type, stats)
             
-            if not text or not text.strip():
-                raise Exception("No text could be extracted from the file")
+            chunks_collection = self.db["file-chunks"] if self.db is not None else None
+            batch = []
+            total_chunks = 0
             
-            # Chunk the text
-            chunks = self.chunk_text(text, self.chunk_size, self.overlap)
-            total_chunks = len(chunks)
+            for chunk in self.iter_chunks(segments, self.chunk_size, self.overlap):
+                if chunks_collection is not None:
+                    batch.append({
+                        "file_id": file_id,
+                        "dashboard_user_id": dashboard_user_id,
+                        "generation": generation,
+                        "chunk_index": total_chunks,
+                        "chunk_id": chunk["id"],
+                        "start_word": chunk["start_word"],
+                        "end_word": chunk["end_word"],
+                        "text": chunk["text"],
+                        "source": original_filename,
+                        "created_at": now
+                    })
+                    if len(batch) >= self.insert_batch_size:
+                        chunks_collection.insert_many(batch, ordered=False)
+                        batch = []
+                total_chunks += 1
             
-            # Prepare chunks for database storage
-            all_chunks = []
-            for i, chunk in enumerate(chunks):
-                chunk_doc = {
-                    "file_id": file_id,
-                    "dashboard_user_id": dashboard_user_id,
-                    "chunk_index": i,
-                    "chunk_id": chunk["id"],
-                    "start_word": chunk["start_word"],
-                    "end_word": chunk["end_word"],
-                    "text": chunk["text"],
-                    "source": original_filename,
-                    "created_at": now
-                }
-                all_chunks.append(chunk_doc)
+            if total_chunks == 0:
+                raise Exception("No text could be extracted from the file")
+            
+            if chunks_collection is not None:
+                if batch:
+                    chunks_collection.insert_many(batch, ordered=False)
+                logger.info(f"✅ Stored {total_chunks} chunks in MongoDB for file {file_id}")
             
-            # Store chunks in MongoDB (bulk insert for efficiency)
-            if self.db is not None and all_chunks:
-                chunks_collection = self.db["file-chunks"]
-                # Delete existing chunks for this file first (in case of re-processing)
-                chunks_collection.delete_many({"file_id": file_id})
-                # Bulk insert all chunks
-                chunks_collection.insert_many(all_chunks)
-                logger.info(f"✅ Stored {len(all_chunks)} chunks in MongoDB for file {file_id}")
+            page_count = stats.get("page_count", 0)
             
             # Update metadata with success
             if self.db is not None:
@@ -312,10 +433,13 @@ class FileProcessingService:
                             "status": "completed",
                             "pages_extracted": page_count,
                             "total_chunks": total_chunks,
+                            "active_generation": generation,
                             "last_updated": datetime.now()
                         }
                     }
                 )
+                # Chunks from previous processing runs are no longer visible; drop them
+                self.db["file-chunks"].delete_many({"file_id": file_id, "generation": {"$ne": generation}})
                 # Return updated file document
                 updated = files_collection.find_one({"file_id": file_id})
                 return {
@@ -354,6 +478,8 @@ class FileProcessingService:
             
             # Update metadata with error
             if self.db is not None:
+                # Discard the partial generation; readers still see the previous one
+                self.db["file-chunks"].delete_many({"file_id": file_id, "generation": generation})
                 files_collection = self.db.files
                 files_collection.update_one(
                     {"file_id": file_id},
@@ -368,6 +494,15 @@ class FileProcessingService:
             
             raise
     
+    def _active_chunks_query(self, file_id: str) -> Dict:
+        """Query matching only the chunks of the file's active processing generation."""
+        file = self.db.files.find_one({"file_id": file_id}, {"active_generation": 1})
+        generation = file.get("active_generation") if file else None
+        if generation:
+            return {"file_id": file_id, "generation": generation}
+        # Chunks stored before generations existed
+        return {"file_id": file_id, "generation": {"$exists": False}}
+    
     def get_file(self, file_id: str) -> Optional[Dict]:
         """Get file metadata by ID from database."""
         if self.db is not None:
@@ -442,24 +577,50 @@ class FileProcessingService:
         """Get all chunks for a file from database."""
         if self.db is not None:
             chunks_collection = self.db["file-chunks"]
-            chunks = list(chunks_collection.find(
-                {"file_id": file_id}
-            ).sort("chunk_index", 1))
+            chunks = chunks_collection.find(
+                self._active_chunks_query(file_id)
+            ).sort("chunk_index", 1)
             
             # Convert MongoDB documents to dict format (compatible with existing code)
-            result = []
-            for chunk in chunks:
-                result.append({
-                    "id": chunk.get("chunk_id", ""),
-                    "start_word": chunk.get("start_word", 0),
-                    "end_word": chunk.get("end_word", 0),
-                    "text": chunk.get("text", ""),
-                    "source": chunk.get("source", ""),
-                    "chunk_index": chunk.get("chunk_index", 0),
-                    "file_id": chunk.get("file_id", ""),
-                })
-            return result
+            return [self._chunk_to_dict(chunk) for chunk in chunks]
         return []
+    
+    @staticmethod
+    def _chunk_to_dict(chunk: Dict) -> Dict:
+        """Convert a file-chunks document to the chunk dict format used by callers."""
+        return {
+            "id": chunk.get("chunk_id", ""),
+            "start_word": chunk.get("start_word", 0),
+            "end_word": chunk.get("end_word", 0),
+            "text": chunk.get("text", ""),
+            "source": chunk.get("source", ""),
+            "chunk_index": chunk.get("chunk_index", 0),
+            "file_id": chunk.get("file_id", ""),
+        }
+    
+    def iter_chunks_for_files(self, file_ids: List[str]) -> Iterator[Dict]:
+        """
+        Stream the active-generation chunks of several files: one query for
+        their generations and one cursor over all their chunks.
+        """
+        file_ids = list(file_ids)
+        if self.db is None or not file_ids:
+            return
+        
+        generations = {
+            file["file_id"]: file.get("active_generation")
+            for file in self.db.files.find({"file_id": {"$in": file_ids}}, {"file_id": 1, "active_generation": 1})
+        }
+        clauses = [
+            {"file_id": file_id, "generation": generations[file_id]}
+            if generations.get(file_id)
+            # Chunks stored before generations existed
+            else {"file_id": file_id, "generation": {"$exists": False}}
+            for file_id in file_ids
+        ]
+        cursor = self.db["file-chunks"].find({"$or": clauses}).sort([("file_id", 1), ("chunk_index", 1)])
+        for chunk in cursor:
+            yield self._chunk_to_dict(chunk)
 
 
 # Global service instance
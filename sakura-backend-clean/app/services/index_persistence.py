@@ -0,0 +1,511 @@
+"""
+Pickle-free, memory-mapped persistence for the FAISS vector store.
+
+LangChain's save_local/load_local pickle the whole docstore and read every
+vector into RAM, so each uvicorn worker holds its own full copy. This format
+stores:
+
+- vectors.faiss: the raw FAISS index, opened memory-mapped so workers on one
+  host share its pages through the OS cache
+- docstore.sqlite: one row per chunk (position in the index, docstore id,
+  text, JSON metadata), read on demand with a small LRU cache
+- bm25.sqlite: the keyword postings over the same chunks (see sparse_index)
+
+Loading only maps the index file and opens the database, so startup does not
+depend on corpus size.
+
+Each save is published as a new immutable version directory under
+``versions/``; the ``CURRENT`` file names the live version and is replaced
+atomically, so a crash mid-save never exposes a partial index and readers
+always open a complete snapshot. Publishes from every worker process are
+serialized by an exclusive lock on ``.publish.lock`` in the index root.
+"""
+import os
+import json
+import fcntl
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from collections.abc import Mapping, MutableMapping
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from app.services.sparse_index import BM25_FILE, BM25Writer, write_bm25_index
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".publish.lock"
+VERSIONS_DIR = "versions"
+_PARTIAL_SUFFIX = ".partial"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc_id TEXT PRIMARY KEY,
+    position INTEGER UNIQUE,
+    page_content TEXT NOT NULL,
+    metadata TEXT NOT NULL
+)
+"""
+
+
+def _row_to_document(doc_id: str, page_content: str, metadata: str) -> Document:
+    return Document(page_content=page_content, metadata=json.loads(metadata), id=doc_id)
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """LangChain docstore backed by SQLite, reading documents on demand."""
+
+    def __init__(self, path: Path, cache_size: Optional[int] = None):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(_SCHEMA)
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, Document]" = OrderedDict()
+        self._cache_size = cache_size if cache_size is not None else int(os.getenv("DOCSTORE_CACHE_SIZE", "5000"))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def search(self, search: str) -> Union[str, Document]:
+        """Get a document by docstore id (the InMemoryDocstore contract: a string if missing)."""
+        with self._lock:
+            doc = self._cache.get(search)
+            if doc is not None:
+                self._cache.move_to_end(search)
+                return doc
+            row = self._conn.execute(
+                "SELECT doc_id, page_content, metadata FROM docs WHERE doc_id = ?", (search,)
+            ).fetchone()
+            if row is None:
+                return f"ID {search} not found."
+            doc = _row_to_document(*row)
+            self._cache[search] = doc
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+            return doc
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        """Insert documents; their index positions are set by SQLitePositionMap.update."""
+        rows = [
+            (doc_id, doc.page_content, json.dumps(doc.metadata, default=str))
+            for doc_id, doc in texts.items()
+        ]
+        with self._lock:
+            existing = self._conn.execute(
+                f"SELECT doc_id FROM docs WHERE doc_id IN ({','.join('?' * len(rows))})",
+                [row[0] for row in rows],
+            ).fetchall() if rows else []
+            if existing:
+                raise ValueError(f"Tried to add ids that already exist: {[row[0] for row in existing]}")
+            self._conn.executemany(
+                "INSERT INTO docs (doc_id, page_content, metadata) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def delete(self, ids: List) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM docs WHERE doc_id = ?", [(doc_id,) for doc_id in ids])
+            self._conn.commit()
+            for doc_id in ids:
+                self._cache.pop(doc_id, None)
+
+    def iter_documents(self) -> Iterator[Tuple[str, Document]]:
+        """Stream every (docstore id, document) in index order."""
+        for _, doc_id, doc in self.iter_rows():
+            yield doc_id, doc
+
+    def iter_rows(self) -> Iterator[Tuple[Optional[int], str, Document]]:
+        """Stream every (index position, docstore id, document) in index order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT position, doc_id, page_content, metadata FROM docs ORDER BY position"
+            ).fetchall()
+        for position, doc_id, page_content, metadata in rows:
+            yield position, doc_id, _row_to_document(doc_id, page_content, metadata)
+
+    @property
+    def _dict(self) -> "_DocstoreView":
+        """Read-only mapping view, for code written against InMemoryDocstore._dict."""
+        return _DocstoreView(self)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class _DocstoreView(Mapping):
+    """Mapping of docstore id -> Document over a SQLiteDocstore."""
+
+    def __init__(self, docstore: SQLiteDocstore):
+        self._docstore = docstore
+
+    def __getitem__(self, key: str) -> Document:
+        doc = self._docstore.search(key)
+        if not isinstance(doc, Document):
+            raise KeyError(key)
+        return doc
+
+    def __iter__(self):
+        return (doc_id for doc_id, _ in self._docstore.iter_documents())
+
+    def __len__(self) -> int:
+        return len(self._docstore)
+
+    def items(self):
+        return self._docstore.iter_documents()
+
+    def values(self):
+        return (doc for _, doc in self._docstore.iter_documents())
+
+
+class SQLitePositionMap(MutableMapping):
+    """FAISS position -> docstore id mapping stored in the docstore's table."""
+
+    def __init__(self, docstore: SQLiteDocstore):
+        self._docstore = docstore
+
+    def __getitem__(self, position: int) -> str:
+        with self._docstore._lock:
+            row = self._docstore._conn.execute(
+                "SELECT doc_id FROM docs WHERE position = ?", (int(position),)
+            ).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __setitem__(self, position: int, doc_id: str) -> None:
+        self.update({position: doc_id})
+
+    def __delitem__(self, position: int) -> None:
+        with self._docstore._lock:
+            self._docstore._conn.execute("UPDATE docs SET position = NULL WHERE position = ?", (int(position),))
+            self._docstore._conn.commit()
+
+    def __iter__(self):
+        with self._docstore._lock:
+            rows = self._docstore._conn.execute(
+                "SELECT position FROM docs WHERE position IS NOT NULL ORDER BY position"
+            ).fetchall()
+        return (row[0] for row in rows)
+
+    def __len__(self) -> int:
+        with self._docstore._lock:
+            return self._docstore._conn.execute(
+                "SELECT COUNT(*) FROM docs WHERE position IS NOT NULL"
+            ).fetchone()[0]
+
+    def update(self, mapping=(), **kwargs) -> None:
+        with self._docstore._lock:
+            self._docstore._conn.executemany(
+                "UPDATE docs SET position = ? WHERE doc_id = ?",
+                [(int(position), doc_id) for position, doc_id in dict(mapping).items()],
+            )
+            self._docstore._conn.commit()
+
+
+def has_persisted_index(directory: Path) -> bool:
+    """True if directory holds an index in this format."""
+    directory = Path(directory)
+    return (directory / VECTORS_FILE).exists() and (directory / DOCSTORE_FILE).exists()
+
+
+def save_vector_store(store: FAISS, directory: Path) -> None:
+    """Write a FAISS store's index and documents in this format."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    vectors_tmp = directory / f"{VECTORS_FILE}.tmp"
+    docstore_tmp = directory / f"{DOCSTORE_FILE}.tmp"
+    bm25_tmp = directory / f"{BM25_FILE}.tmp"
+    docstore_tmp.unlink(missing_ok=True)
+    bm25_tmp.unlink(missing_ok=True)
+
+    faiss.write_index(store.index, str(vectors_tmp))
+
+    conn = sqlite3.connect(str(docstore_tmp))
+    # Keyword postings are written in the same pass over the documents
+    bm25 = BM25Writer(bm25_tmp)
+    try:
+        conn.execute(_SCHEMA)
+        rows = []
+        if isinstance(store.docstore, SQLiteDocstore):
+            entries = ((position, doc_id, doc) for position, doc_id, doc in store.docstore.iter_rows() if position is not None)
+        else:
+            entries = (
+                (position, doc_id, store.docstore.search(doc_id))
+                for position, doc_id in store.index_to_docstore_id.items()
+            )
+        for position, doc_id, doc in entries:
+            if not isinstance(doc, Document):
+                continue
+            rows.append((doc_id, int(position), doc.page_content, json.dumps(doc.metadata, default=str)))
+            bm25.add(doc_id, doc)
+            if len(rows) >= 1000:
+                conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", rows)
+                rows = []
+        if rows:
+            conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+        bm25.close()
+
+    # Each file is swapped with an atomic rename; open readers keep the old inode
+    os.replace(vectors_tmp, directory / VECTORS_FILE)
+    os.replace(docstore_tmp, directory / DOCSTORE_FILE)
+    os.replace(bm25_tmp, directory / BM25_FILE)
+    logger.info(f"💾 Saved {store.index.ntotal} vectors to {directory}")
+
+
+def read_index_mmap(path: Path) -> faiss.Index:
+    """Open a FAISS index with its vector codes memory-mapped where supported."""
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    if flag is not None:
+        try:
+            return faiss.read_index(str(path), flag)
+        except RuntimeError as e:
+            logger.warning(f"⚠️  Could not memory-map {path.name}, reading it into memory: {e}")
+    return faiss.read_index(str(path))
+
+
+def load_vector_store(directory: Path, embeddings) -> FAISS:
+    """Open a store saved by save_vector_store without reading documents into memory."""
+    directory = Path(directory)
+    index = read_index_mmap(directory / VECTORS_FILE)
+    docstore = SQLiteDocstore(directory / DOCSTORE_FILE)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=SQLitePositionMap(docstore),
+    )
+
+
+def ensure_bm25_index(directory: Path) -> None:
+    """Backfill the keyword postings of a version saved before they were written with it."""
+    directory = Path(directory)
+    if (directory / BM25_FILE).exists():
+        return
+    started = time.perf_counter()
+    docstore = SQLiteDocstore(directory / DOCSTORE_FILE)
+    try:
+        rows = ((doc_id, doc) for position, doc_id, doc in docstore.iter_rows() if position is not None)
+        count = write_bm25_index(directory / BM25_FILE, rows)
+    finally:
+        docstore.close()
+    logger.info(f"🔤 Wrote BM25 postings for {count} documents in {directory.name} ({time.perf_counter() - started:.2f}s)")
+
+
+def copy_vector_store(store: FAISS) -> FAISS:
+    """
+    In-memory, writable copy of a store. Writes go to a copy that is then
+    published, so searches on the live snapshot never see a half-applied change
+    (and FAISS aborts the process when adding to a memory-mapped index).
+    """
+    index = faiss.deserialize_index(faiss.serialize_index(store.index))
+    if isinstance(store.docstore, SQLiteDocstore):
+        documents, index_to_docstore_id = {}, {}
+        for position, doc_id, doc in store.docstore.iter_rows():
+            documents[doc_id] = doc
+            if position is not None:
+                index_to_docstore_id[position] = doc_id
+    else:
+        documents = dict(store.docstore._dict.items())
+        index_to_docstore_id = dict(store.index_to_docstore_id.items())
+    return FAISS(
+        embedding_function=store.embedding_function,
+        index=index,
+        docstore=InMemoryDocstore(documents),
+        index_to_docstore_id=index_to_docstore_id,
+    )
+
+
+# ==================== Versions ====================
+
+def current_version(root: Path) -> Optional[str]:
+    """Name of the live version, or None if nothing has been published."""
+    try:
+        return (Path(root) / CURRENT_FILE).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_dir(root: Path, version: str) -> Path:
+    return Path(root) / VERSIONS_DIR / version
+
+
+def _fsync_dir(directory: Path) -> None:
+    try:
+        fd = os.open(str(directory), os.O_RDONLY)
+    except OSError:
+        return  # Not supported on this platform
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _new_version(root: Path) -> Tuple[str, Path]:
+    """A fresh version name and the partial directory it is written to."""
+    version = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+    return version, Path(root) / VERSIONS_DIR / f"{version}{_PARTIAL_SUFFIX}"
+
+
+@contextmanager
+def publish_lock(root: Path) -> Iterator[None]:
+    """
+    Exclusive lock on an index root across threads and worker processes, held
+    while a version is written, committed and old versions are pruned.
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    with open(root / LOCK_FILE, "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def publish_version(store: FAISS, root: Path) -> str:
+    """
+    Save a store as a new version and atomically make it the live one.
+    Returns the new version name.
+    """
+    root = Path(root)
+    with publish_lock(root):
+        version, partial = _new_version(root)
+        save_vector_store(store, partial)
+        _commit_version(root, version, partial)
+    return version
+
+
+def publish_appended_version(
+    root: Path,
+    documents: List[Tuple[str, Document]],
+    vectors: np.ndarray,
+) -> str:
+    """
+    Publish a new version holding the live version plus (docstore id, document)
+    pairs with their vectors. The live version is read under the publish lock,
+    so appends from other workers are never lost. Its docstore and BM25
+    postings are copied as files and appended to, never read into memory; only
+    the FAISS index is loaded, since it cannot be extended while memory-mapped.
+    Returns the new version name.
+    """
+    root = Path(root)
+    with publish_lock(root):
+        base_version = current_version(root)
+        if base_version is None:
+            raise FileNotFoundError(f"No published index version in {root} to append to")
+        version, partial = _append_version(root, base_version, documents, vectors)
+        _commit_version(root, version, partial)
+    return version
+
+
+def _append_version(
+    root: Path,
+    base_version: str,
+    documents: List[Tuple[str, Document]],
+    vectors: np.ndarray,
+) -> Tuple[str, Path]:
+    """Write base_version plus documents to a new partial directory."""
+    base = version_dir(root, base_version)
+    version, partial = _new_version(root)
+    partial.mkdir(parents=True)
+    shutil.copyfile(base / DOCSTORE_FILE, partial / DOCSTORE_FILE)
+    has_bm25 = (base / BM25_FILE).exists()
+    if has_bm25:
+        shutil.copyfile(base / BM25_FILE, partial / BM25_FILE)
+
+    index = faiss.read_index(str(base / VECTORS_FILE))
+    start = index.ntotal
+    index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    faiss.write_index(index, str(partial / VECTORS_FILE))
+
+    conn = sqlite3.connect(str(partial / DOCSTORE_FILE))
+    try:
+        conn.executemany(
+            "INSERT INTO docs VALUES (?, ?, ?, ?)",
+            [
+                (doc_id, start + offset, doc.page_content, json.dumps(doc.metadata, default=str))
+                for offset, (doc_id, doc) in enumerate(documents)
+            ],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    if has_bm25:
+        # A base without postings gets them written in full when the new version is opened
+        bm25 = BM25Writer(partial / BM25_FILE)
+        try:
+            for doc_id, doc in documents:
+                bm25.add(doc_id, doc)
+        finally:
+            bm25.close()
+
+    logger.info(f"💾 Appended {len(documents)} vectors to version {base_version} ({index.ntotal} total)")
+    return version, partial
+
+
+def _commit_version(root: Path, version: str, partial: Path) -> None:
+    """
+    Make a fully written partial directory a version and point CURRENT at it.
+    Callers hold publish_lock.
+    """
+    _fsync_dir(partial)
+    os.rename(partial, version_dir(root, version))
+
+    pointer_tmp = root / f"{CURRENT_FILE}.tmp"
+    with open(pointer_tmp, "w") as pointer:
+        pointer.write(version)
+        pointer.flush()
+        os.fsync(pointer.fileno())
+    os.replace(pointer_tmp, root / CURRENT_FILE)
+    _fsync_dir(root)
+    logger.info(f"📌 Published vector index version {version}")
+
+    prune_versions(root)
+
+
+def load_version(root: Path, version: str, embeddings) -> FAISS:
+    """Open a published version."""
+    return load_vector_store(version_dir(root, version), embeddings)
+
+
+def prune_versions(root: Path, keep: Optional[int] = None) -> None:
+    """
+    Delete all but the newest ``keep`` versions (never the live one) and stale
+    partial directories. Workers still reading a deleted version keep working:
+    their open files and mappings outlive the unlink. Call under publish_lock,
+    so no version is deleted while a publish is copying it.
+    """
+    keep = keep if keep is not None else int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+    versions_root = Path(root) / VERSIONS_DIR
+    if not versions_root.exists():
+        return
+    live = current_version(root)
+    complete = sorted(p for p in versions_root.iterdir() if p.is_dir() and not p.name.endswith(_PARTIAL_SUFFIX))
+    stale = [p for p in complete[:-keep] if p.name != live] if keep > 0 else []
+    # Partial directories older than an hour are left over from crashed saves
+    stale += [
+        p for p in versions_root.iterdir()
+        if p.name.endswith(_PARTIAL_SUFFIX) and time.time() - p.stat().st_mtime > 3600
+    ]
+    for path in stale:
+        shutil.rmtree(path, ignore_errors=True)
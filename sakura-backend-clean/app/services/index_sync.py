@@ -0,0 +1,170 @@
+"""
+Cross-worker vector index reload.
+
+A worker that publishes a new index version announces it on a Redis channel;
+every worker runs a listener that reopens the live version when it changes.
+The listener also re-checks the CURRENT pointer on a timer, so workers catch up
+even if Redis is down or a message is missed. FAQ upserts and deletes are
+announced on a second channel so every worker's in-memory FAQ indexes follow,
+system prompt / AOP changes on a third so every worker reloads its agent
+configuration, and per-chat AI agent toggles on a fourth so cached chat flags
+are dropped.
+"""
+import os
+import json
+import uuid
+import asyncio
+import logging
+from typing import List, Optional
+
+import redis
+
+from app.core.settings import get_settings
+from app.services.redis_publisher import get_redis_publisher
+
+logger = logging.getLogger(__name__)
+
+INDEX_UPDATES_CHANNEL = "kb:index_updates"
+FAQ_UPDATES_CHANNEL = "kb:faq_updates"
+CONFIG_UPDATES_CHANNEL = "ai:config_updates"
+CHAT_FLAGS_CHANNEL = "chat:flag_updates"
+
+# Tags this process's announcements so it can skip its own; PIDs repeat across
+# containers (every pod's worker may be PID 1 or 7)
+_PROCESS_ID = uuid.uuid4().hex
+
+_sync_client: Optional[redis.Redis] = None
+_listener_task: Optional[asyncio.Task] = None
+
+
+def _announce(channel: str, payload: dict) -> None:
+    """Publish from sync code with a short-timeout client (best effort)."""
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = redis.Redis.from_url(
+            get_settings().redis_url,
+            socket_connect_timeout=1,
+            socket_timeout=1,
+        )
+    _sync_client.publish(channel, json.dumps({**payload, "sender": _PROCESS_ID}))
+
+
+def _from_this_process(event: dict) -> bool:
+    return event.get("sender") == _PROCESS_ID
+
+
+def notify_index_update(version: str) -> None:
+    """Announce a newly published index version (best effort, callable from sync code)."""
+    try:
+        _announce(INDEX_UPDATES_CHANNEL, {"version": version})
+    except Exception as e:
+        logger.warning(f"⚠️  Could not announce index version {version}: {e}")
+
+
+def notify_faq_update(op: str, faq_ids: List[str], dashboard_user_id: Optional[str] = None) -> None:
+    """Announce an FAQ upsert or delete to the other workers (best effort)."""
+    try:
+        _announce(FAQ_UPDATES_CHANNEL, {"op": op, "faq_ids": faq_ids, "dashboard_user_id": dashboard_user_id})
+    except Exception as e:
+        logger.warning(f"⚠️  Could not announce FAQ {op} for {faq_ids}: {e}")
+
+
+def notify_config_update(kind: str, version) -> None:
+    """Announce a system prompt or AOP change to the other workers (best effort)."""
+    try:
+        _announce(CONFIG_UPDATES_CHANNEL, {"kind": kind, "version": version})
+    except Exception as e:
+        logger.warning(f"⚠️  Could not announce {kind} v{version}: {e}")
+
+
+def notify_chat_flags_update(chat_id: str) -> None:
+    """Announce that a chat's flags changed so other workers drop their cached copy (best effort)."""
+    try:
+        _announce(CHAT_FLAGS_CHANNEL, {"chat_id": chat_id})
+    except Exception as e:
+        logger.warning(f"⚠️  Could not announce flag change for chat {chat_id}: {e}")
+
+
+async def _apply_faq_update(faq_embedding_service, data: str) -> None:
+    try:
+        event = json.loads(data)
+        if not _from_this_process(event):
+            await asyncio.to_thread(faq_embedding_service.apply_remote_update, event)
+    except Exception as e:
+        logger.error(f"❌ Error applying FAQ update: {e}")
+
+
+async def _reload_config(config_service) -> None:
+    try:
+        await asyncio.to_thread(config_service.reload)
+    except Exception as e:
+        logger.error(f"❌ Error reloading agent config: {e}")
+
+
+def _apply_chat_flags_update(chat_flags_cache, data: str) -> None:
+    try:
+        event = json.loads(data)
+        if not _from_this_process(event):
+            chat_flags_cache.invalidate(event["chat_id"])
+    except Exception as e:
+        logger.error(f"❌ Error applying chat flag update: {e}")
+
+
+async def _listen(vector_store_service, faq_embedding_service, config_service, chat_flags_cache, poll_seconds: float) -> None:
+    pubsub = None
+    while True:
+        try:
+            if pubsub is None:
+                pubsub = get_redis_publisher().pubsub()
+                await pubsub.subscribe(INDEX_UPDATES_CHANNEL, FAQ_UPDATES_CHANNEL, CONFIG_UPDATES_CHANNEL, CHAT_FLAGS_CHANNEL)
+            # Wakes on an announcement or after poll_seconds, whichever comes first
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=poll_seconds)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"Index update subscription unavailable, polling instead: {e}")
+            pubsub = None
+            message = None
+            await asyncio.sleep(poll_seconds)
+
+        if message and message.get("channel") == FAQ_UPDATES_CHANNEL:
+            if faq_embedding_service is not None:
+                await _apply_faq_update(faq_embedding_service, message["data"])
+            continue
+        if message and message.get("channel") == CHAT_FLAGS_CHANNEL:
+            if chat_flags_cache is not None:
+                _apply_chat_flags_update(chat_flags_cache, message["data"])
+            continue
+        if message and message.get("channel") == CONFIG_UPDATES_CHANNEL:
+            if config_service is not None:
+                await _reload_config(config_service)
+            continue
+        if message is None and config_service is not None:
+            # Periodic check, in case an announcement was missed
+            await _reload_config(config_service)
+
+        try:
+            await asyncio.to_thread(vector_store_service.reload_if_changed)
+        except Exception as e:
+            logger.error(f"❌ Error reloading vector index: {e}")
+
+
+def start_index_sync(vector_store_service, faq_embedding_service=None, config_service=None, chat_flags_cache=None) -> None:
+    """Start the background listener that keeps this worker on the live index version, FAQs, agent config and chat flags."""
+    global _listener_task
+    if _listener_task is not None:
+        return
+    poll_seconds = float(os.getenv("INDEX_POLL_SECONDS", "30"))
+    _listener_task = asyncio.create_task(_listen(vector_store_service, faq_embedding_service, config_service, chat_flags_cache, poll_seconds))
+
+
+async def stop_index_sync() -> None:
+    """Stop the listener."""
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
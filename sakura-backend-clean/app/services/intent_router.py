@@ -0,0 +1,209 @@
+"""
+Local intent router that runs before the LangGraph workflow.
+
+Greetings, explicit thanks and goodbyes are answered from stored templates, and
+messages that closely paraphrase one of the tenant's FAQ questions are answered
+straight from the FAQ's stored answer, so neither costs an LLM call. Everything else passes through to the graph.
+"""
+import os
+import re
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from app.core.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+# FAQ documents built by the KB manager are stored as "Q: ...\n\nA: ..."
+_ANSWER_PREFIX = re.compile(r"^\s*A:\s*")
+
+# Whole-message patterns only: "hi, what is your refund policy?" must reach the graph
+_INTENT_PATTERNS = {
+    "greeting": re.compile(
+        r"^\s*(hi|hello|hey|hiya|yo|howdy|greetings|good (morning|afternoon|evening)|how are you( doing)?)"
+        r"\b[\s!.?,]*(there|again|everyone|team)?[\s!.?]*$",
+        re.IGNORECASE,
+    ),
+    "thanks": re.compile(
+        r"^\s*((ok(ay)?|great|cool|nice|perfect)\b[\s!.,]*)?"
+        r"(thanks|thank you|thx|ty|cheers|much appreciated|appreciate it)"
+        r"\b[\s!.?,]*(so much|a lot|very much|again)?[\s!.?]*$",
+        re.IGNORECASE,
+    ),
+    "goodbye": re.compile(
+        r"^\s*(bye|goodbye|see you|see ya|later|have a (good|nice) (day|one))\b[\s!.?,]*$",
+        re.IGNORECASE,
+    ),
+    # A bare "ok" or "great" often answers a question the agent just asked, so it
+    # is never answered from a template: the graph sees it with the conversation
+    "acknowledgement": re.compile(
+        r"^\s*(ok(ay)?|great|cool|nice|perfect|sure|alright|got it)\b[\s!.?,]*$",
+        re.IGNORECASE,
+    ),
+}
+
+DEFAULT_TEMPLATES = {
+    "greeting": "Hello! How can I help you today?",
+    "thanks": "You're welcome! Is there anything else I can help you with?",
+    "goodbye": "Thanks for chatting with us. Have a great day!",
+}
+
+
+def detect_intent(query: str) -> str:
+    """Classify a message as 'greeting', 'thanks', 'goodbye', 'acknowledgement' or 'question' with local rules."""
+    for intent, pattern in _INTENT_PATTERNS.items():
+        if pattern.match(query or ""):
+            return intent
+    return "question"
+
+
+def _token_overlap(a: str, b: str) -> float:
+    """Jaccard overlap of the word sets of two strings."""
+    ta = set(_WORD.findall(a.lower()))
+    tb = set(_WORD.findall(b.lower()))
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
+
+
+class IntentRouter:
+    """Answers small talk and high-confidence FAQ matches without the LLM."""
+
+    def __init__(self, settings: Settings, faq_embedding_service=None):
+        self.settings = settings
+        self.faq_embedding_service = faq_embedding_service
+        self.enabled = os.getenv("ROUTER_ENABLED", "true").lower() == "true"
+        # Both must hold for an FAQ answer to be returned directly: cosine similarity
+        # between the message and the FAQ question, and word overlap with the question
+        self.faq_score_threshold = float(os.getenv("ROUTER_FAQ_THRESHOLD", "0.85"))
+        self.faq_min_overlap = float(os.getenv("ROUTER_FAQ_MIN_OVERLAP", "0.4"))
+        self.templates: Dict[str, str] = dict(DEFAULT_TEMPLATES)
+
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, float] = {
+            "total": 0,
+            "greeting": 0,
+            "thanks": 0,
+            "goodbye": 0,
+            "faq_hit": 0,
+            "faq_below_threshold": 0,
+            "passthrough": 0,
+            "router_ms_total": 0.0,
+        }
+
+    def load_templates(self, db) -> None:
+        """Override default templates with the 'router_templates' document in ai-settings."""
+        if db is None:
+            return
+        try:
+            doc = db["ai-settings"].find_one({"type": "router_templates"})
+            if doc and isinstance(doc.get("templates"), dict):
+                self.templates.update({k: v for k, v in doc["templates"].items() if v})
+                logger.info(f"✅ Loaded {len(doc['templates'])} router templates from database")
+        except Exception as e:
+            logger.warning(f"⚠️  Could not load router templates: {e}")
+
+    def _record(self, key: str, started: float) -> None:
+        with self._lock:
+            self._metrics["total"] += 1
+            self._metrics[key] += 1
+            self._metrics["router_ms_total"] += (time.perf_counter() - started) * 1000
+
+    def _match_faq(
+        self,
+        query: str,
+        embedding: Optional[List[float]] = None,
+        dashboard_user_id: Optional[str] = None
+    ) -> Optional[Dict]:
+        """Return the tenant's best FAQ if its question closely matches the query."""
+        if self.faq_embedding_service is None or not dashboard_user_id:
+            return None
+        # Only FAQs enabled for the AI agent (those in the knowledge base) may answer
+        enabled = self.faq_embedding_service.get_faq_index()
+        if enabled is None:
+            return None
+        results = self.faq_embedding_service.search_similar_faqs(
+            query, top_k=3, embedding=embedding, dashboard_user_id=dashboard_user_id, questions_only=True
+        )
+        results = [faq for faq in results if faq.get("faq_id") in enabled]
+        if not results:
+            return None
+        best = min(results, key=lambda faq: faq.get("distance", float("inf")))
+        # Question-only FAQ vectors are unit length, so squared L2 distance is 2 - 2 * cosine
+        similarity = 1.0 - best.get("distance", 2.0) / 2.0
+        overlap = _token_overlap(query, best.get("question", ""))
+        if similarity >= self.faq_score_threshold and overlap >= self.faq_min_overlap:
+            return {**best, "score": similarity, "overlap": overlap}
+        with self._lock:
+            self._metrics["faq_below_threshold"] += 1
+        return None
+
+    def route(
+        self,
+        query: str,
+        embedding: Optional[List[float]] = None,
+        dashboard_user_id: Optional[str] = None
+    ) -> Optional[Dict]:
+        """
+        Try to answer a message locally. embedding is the query's precomputed
+        embedding, if the caller already has it; FAQ answers come only from
+        dashboard_user_id's FAQs, so without a tenant only small talk is answered.
+        Returns {"route", "response", "confidence"} or None to pass through to the graph.
+        """
+        if not self.enabled or not query or not query.strip():
+            return None
+        started = time.perf_counter()
+
+        intent = detect_intent(query)
+        if intent == "acknowledgement":
+            self._record("passthrough", started)
+            return None
+        if intent != "question":
+            self._record(intent, started)
+            return {"route": intent, "response": self.templates[intent], "confidence": 1.0}
+
+        try:
+            faq = self._match_faq(query, embedding, dashboard_user_id)
+        except Exception as e:
+            logger.warning(f"⚠️  FAQ routing check failed: {e}")
+            faq = None
+        answer = _ANSWER_PREFIX.sub("", faq.get("answer") or "", count=1).strip() if faq else ""
+        if answer:
+            self._record("faq_hit", started)
+            logger.info(f"⚡ Answered from FAQ {faq.get('faq_id')} (score={faq['score']:.3f}, overlap={faq['overlap']:.2f})")
+            return {"route": "faq", "response": answer, "confidence": faq["score"], "faq_id": faq.get("faq_id")}
+
+        self._record("passthrough", started)
+        return None
+
+    def get_metrics(self) -> Dict:
+        """Routing counters plus hit rate and mean routing latency."""
+        with self._lock:
+            metrics = dict(self._metrics)
+        total = metrics["total"] or 1
+        answered = metrics["greeting"] + metrics["thanks"] + metrics["goodbye"] + metrics["faq_hit"]
+        metrics["answered_locally_rate"] = answered / total
+        metrics["router_ms_avg"] = metrics.pop("router_ms_total") / total
+        return metrics
+
+
+# Global router instance
+_intent_router: Optional[IntentRouter] = None
+
+
+def init_intent_router(settings: Settings, faq_embedding_service=None, db=None) -> IntentRouter:
+    """Initialize the intent router."""
+    global _intent_router
+    _intent_router = IntentRouter(settings, faq_embedding_service)
+    _intent_router.load_templates(db)
+    return _intent_router
+
+
+def get_intent_router() -> IntentRouter:
+    """Get intent router instance."""
+    if not _intent_router:
+        raise Exception("Intent router not initialized. Call init_intent_router() first.")
+    return _intent_router
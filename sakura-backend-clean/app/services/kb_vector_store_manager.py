@@ -2,7 +2,8 @@
 Service for managing vector store with enabled KB items only.
 """
 import logging
-from typing import List, Optional
+from typing import Iterable, List, Optional
+from bson import ObjectId
 from langchain_core.documents import Document
 from langchain_community.vectorstores import FAISS
 from pymongo.database import Database
@@ -11,11 +12,38 @@ from app.services.vector_store_service import VectorStoreService
 from app.services.website_crawler_service import WebsiteCrawlerService
 from app.services.faq_embedding_service import FAQEmbeddingService
 from app.services.file_processing_service import FileProcessingService
-from app.core.settings import get_settings
 
 logger = logging.getLogger(__name__)
 
 
+def normalize_faq_id(faq_id: str) -> str:
+    """Strip the "faq-" / "faq_" prefixes KB item ids may carry."""
+    faq_id = str(faq_id)
+    for prefix in ("faq-", "faq_"):
+        if faq_id.startswith(prefix):
+            return faq_id[len(prefix):]
+    return faq_id
+
+
+def load_faqs_by_ids(db: Database, dashboard_user_id: str, faq_ids: Iterable[str]) -> List[dict]:
+    """
+    Fetch enabled FAQs in one query. Ids are normalized up front and matched
+    against _id (ObjectId or string) or, within the tenant, the alternate id field.
+    """
+    raw_ids = {str(faq_id) for faq_id in faq_ids}
+    ids = raw_ids | {normalize_faq_id(faq_id) for faq_id in raw_ids}
+    object_ids = [ObjectId(faq_id) for faq_id in ids if ObjectId.is_valid(faq_id)]
+    
+    query = {"$or": [
+        {"_id": {"$in": object_ids + list(ids)}},
+        {"dashboard_user_id": dashboard_user_id, "id": {"$in": list(ids)}},
+    ]}
+    faqs = {}
+    for faq in db.faqs.find(query, {"question": 1, "answer": 1}):
+        faqs.setdefault(str(faq["_id"]), faq)
+    return list(faqs.values())
+
+
 def rebuild_vector_store_with_enabled_items(
     dashboard_user_id: str,
     enabled_items: List[dict],
@@ -52,161 +80,96 @@ def rebuild_vector_store_with_enabled_items(
         # Collect all documents from enabled items
         all_documents = []
         
-        # 1. Get website chunks
+        # 1. Get website chunks (one cursor over every enabled website)
         if enabled_websites:
-            for website_id in enabled_websites:
-                try:
-                    chunks = crawler_service.get_website_chunks(website_id)
-                    if chunks:
-                        for chunk in chunks:
-                            metadata = {
-                                "source": chunk.get("source", ""),
-                                "website_id": chunk.get("website_id", website_id),
-                                "domain": chunk.get("domain", ""),
-                                "title": chunk.get("title", ""),
-                                "chunk_index": chunk.get("chunk_index", 0),
-                                "chunk_id": chunk.get("id", ""),
-                                "type": "website",
-                            }
-                            if chunk.get("headings"):
-                                metadata["headings"] = ", ".join(chunk.get("headings", []))
-                            
-                            doc = Document(
-                                page_content=chunk.get("text", ""),
-                                metadata=metadata
-                            )
-                            all_documents.append(doc)
-                        logger.info(f"✅ Added {len(chunks)} chunks from website {website_id}")
-                except Exception as e:
-                    logger.error(f"❌ Error loading chunks for website {website_id}: {e}")
+            try:
+                website_counts = {}
+                for chunk in crawler_service.iter_chunks_for_websites(sorted(enabled_websites)):
+                    website_id = chunk.get("website_id") or ""
+                    metadata = {
+                        "source": chunk.get("source", ""),
+                        "website_id": website_id,
+                        "domain": chunk.get("domain", ""),
+                        "title": chunk.get("title", ""),
+                        "chunk_index": chunk.get("chunk_index", 0),
+                        "chunk_id": chunk.get("id", ""),
+                        "type": "website",
+                    }
+                    if chunk.get("headings"):
+                        metadata["headings"] = ", ".join(chunk.get("headings", []))
+                    
+                    doc = Document(
+                        page_content=chunk.get("text", ""),
+                        metadata=metadata
+                    )
+                    all_documents.append(doc)
+                    website_counts[website_id] = website_counts.get(website_id, 0) + 1
+                logger.info(f"✅ Added {sum(website_counts.values())} chunks from {len(website_counts)} websites")
+            except Exception as e:
+                logger.error(f"❌ Error loading website chunks: {e}")
         
-        # 2. Get FAQ chunks (from FAQ database)
+        # 2. Get FAQ chunks (from FAQ database, one query for every enabled FAQ)
         if enabled_faqs and db is not None:
             try:
-                # Get FAQs from database
-                faqs_collection = db.faqs
-                from bson import ObjectId
-                
-                logger.info(f"🔍 Looking for {len(enabled_faqs)} enabled FAQs: {enabled_faqs}")
+                faqs = load_faqs_by_ids(db, dashboard_user_id, enabled_faqs)
+                for faq_doc in faqs:
+                    question = faq_doc.get("question", "")
+                    answer = faq_doc.get("answer", "")
+                    content = f"Q: {question}\n\nA: {answer}"
+                    
+                    metadata = {
+                        "source": "faq",
+                        "faq_id": str(faq_doc["_id"]),
+                        "type": "faq",
+                        "question": question,
+                    }
+                    
+                    doc = Document(
+                        page_content=content,
+                        metadata=metadata
+                    )
+                    all_documents.append(doc)
                 
-                for faq_id in enabled_faqs:
-                    try:
-                        faq_doc = None
-                        
-                        # Extract ObjectId from various formats
-                        # Handle formats like: "faq-{ObjectId}", "{ObjectId}", or just the ObjectId string
-                        actual_id = faq_id
-                        if faq_id.startswith("faq-"):
-                            actual_id = faq_id.replace("faq-", "")
-                        elif faq_id.startswith("faq_"):
-                            actual_id = faq_id.replace("faq_", "")
-                        
-                        # Strategy 1: Try direct ObjectId lookup with extracted ID
-                        if ObjectId.is_valid(actual_id):
-                            try:
-                                faq_doc = faqs_collection.find_one({"_id": ObjectId(actual_id)})
-                                if faq_doc:
-                                    logger.info(f"✅ Found FAQ {faq_id} (using {actual_id}) via ObjectId lookup")
-                            except Exception as e:
-                                logger.warning(f"⚠️ ObjectId lookup failed for {faq_id} (extracted {actual_id}): {e}")
-                        
-                        # Strategy 2: Try string match on _id converted to string
-                        if not faq_doc:
-                            all_faqs = faqs_collection.find({"dashboard_user_id": dashboard_user_id})
-                            for faq in all_faqs:
-                                faq_str_id = str(faq["_id"])
-                                # Match exact string ID or ObjectId string representation
-                                # Also check if the stored ID matches the extracted ID
-                                if (faq_str_id == faq_id or 
-                                    faq_str_id == str(faq_id) or 
-                                    faq_str_id == actual_id or
-                                    faq_str_id == str(actual_id)):
-                                    faq_doc = faq
-                                    logger.info(f"✅ Found FAQ {faq_id} via string match (found as {faq_str_id})")
-                                    break
-                        
-                        # Strategy 3: Try finding by dashboard_user_id and matching any ID field
-                        if not faq_doc:
-                            all_faqs = faqs_collection.find({"dashboard_user_id": dashboard_user_id})
-                            for faq in all_faqs:
-                                # Check if faq has an 'id' field that matches
-                                if (faq.get("id") == faq_id or 
-                                    str(faq.get("id")) == str(faq_id) or
-                                    faq.get("id") == actual_id or
-                                    str(faq.get("id")) == str(actual_id)):
-                                    faq_doc = faq
-                                    logger.info(f"✅ Found FAQ {faq_id} via id field match")
-                                    break
-                        
-                        if faq_doc:
-                            question = faq_doc.get("question", "")
-                            answer = faq_doc.get("answer", "")
-                            content = f"Q: {question}\n\nA: {answer}"
-                            
-                            metadata = {
-                                "source": "faq",
-                                "faq_id": str(faq_doc["_id"]),
-                                "type": "faq",
-                                "question": question,
-                            }
-                            
-                            doc = Document(
-                                page_content=content,
-                                metadata=metadata
-                            )
-                            all_documents.append(doc)
-                            logger.info(f"✅ Added FAQ document: {question[:50]}...")
-                        else:
-                            logger.warning(f"⚠️ FAQ {faq_id} not found in database for user {dashboard_user_id}")
-                    except Exception as e:
-                        logger.error(f"❌ Error loading FAQ {faq_id}: {e}")
-                        import traceback
-                        traceback.print_exc()
-                        
-                logger.info(f"📊 Total FAQ documents added: {len([d for d in all_documents if d.metadata.get('type') == 'faq'])}")
+                logger.info(f"📊 Total FAQ documents added: {len(faqs)} of {len(enabled_faqs)} enabled")
+                if len(faqs) < len(enabled_faqs):
+                    logger.warning(f"⚠️ {len(enabled_faqs) - len(faqs)} enabled FAQs not found in database for user {dashboard_user_id}")
             except Exception as e:
                 logger.error(f"❌ Error loading FAQs: {e}")
                 import traceback
                 traceback.print_exc()
         
-        # 3. Get file chunks
+        # 3. Get file chunks (one cursor over every enabled file)
         if enabled_files:
-            for file_id in enabled_files:
-                try:
-                    chunks = file_processing_service.get_file_chunks(file_id)
-                    if chunks:
-                        for chunk in chunks:
-                            metadata = {
-                                "source": chunk.get("source", ""),
-                                "file_id": chunk.get("file_id", file_id),
-                                "chunk_index": chunk.get("chunk_index", 0),
-                                "chunk_id": chunk.get("id", ""),
-                                "type": "file",
-                            }
-                            
-                            doc = Document(
-                                page_content=chunk.get("text", ""),
-                                metadata=metadata
-                            )
-                            all_documents.append(doc)
-                        logger.info(f"✅ Added {len(chunks)} chunks from file {file_id}")
-                except Exception as e:
-                    logger.error(f"❌ Error loading chunks for file {file_id}: {e}")
+            try:
+                file_counts = {}
+                for chunk in file_processing_service.iter_chunks_for_files(sorted(enabled_files)):
+                    file_id = chunk.get("file_id") or ""
+                    metadata = {
+                        "source": chunk.get("source", ""),
+                        "file_id": file_id,
+                        "chunk_index": chunk.get("chunk_index", 0),
+                        "chunk_id": chunk.get("id", ""),
+                        "type": "file",
+                    }
+                    
+                    doc = Document(
+                        page_content=chunk.get("text", ""),
+                        metadata=metadata
+                    )
+                    all_documents.append(doc)
+                    file_counts[file_id] = file_counts.get(file_id, 0) + 1
+                logger.info(f"✅ Added {sum(file_counts.values())} chunks from {len(file_counts)} files")
+            except Exception as e:
+                logger.error(f"❌ Error loading file chunks: {e}")
         
         # Rebuild vector store with collected documents
         if all_documents:
             logger.info(f"📚 Rebuilding vector store with {len(all_documents)} documents")
-            embeddings = vector_store_service.embeddings_service.get_embeddings()
-            
             # Create new vector store from documents
-            new_vector_store = FAISS.from_documents(all_documents, embeddings)
-            
-            # Save the updated index
-            settings = get_settings()
-            new_vector_store.save_local(str(settings.faiss_index_path))
+            new_vector_store = vector_store_service.build_vector_store(all_documents)
             
-            # Update the vector store service instance
-            vector_store_service.vector_store = new_vector_store
+            # Publish as a new index version and hot-swap every worker onto it
+            vector_store_service.publish(new_vector_store)
             
             logger.info(f"✅ Successfully rebuilt vector store with {len(all_documents)} documents")
         else:
@@ -217,9 +180,8 @@ def rebuild_vector_store_with_enabled_items(
                 ["Welcome to Sakura AI Assistant!"],
                 embeddings
             )
-            settings = get_settings()
-            new_vector_store.save_local(str(settings.faiss_index_path))
-            vector_store_service.vector_store = new_vector_store
+            # Publish as a new index version and hot-swap every worker onto it
+            vector_store_service.publish(new_vector_store)
             logger.info("✅ Created minimal vector store")
             
     except Exception as e:
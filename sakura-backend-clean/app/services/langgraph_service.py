@@ -1,13 +1,13 @@
 """
 Real LangGraph service with AI models and workflows.
 """
-import json
 import logging
+import os
 import re
 import time
-from pathlib import Path
 from typing import Dict, List, Optional, Any
 from typing_extensions import TypedDict
+import numpy as np
 from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
 from langchain_core.tools import tool, StructuredTool
 from langchain_google_genai import ChatGoogleGenerativeAI
@@ -21,13 +21,181 @@ except ImportError:
     traceable = lambda func: func  # No-op decorator if not installed
 
 from app.core.settings import Settings
-from app.services.vector_store_service import VectorStoreService
+from app.services.vector_store_service import VectorStoreService, search_terms
+from app.services.intent_router import IntentRouter, detect_intent
+from app.services.reranker_service import get_reranker_service
+from app.services.agent_config_service import AgentConfigService, get_agent_config_service
+from app.services.aop_runtime import AOPRuntime, AOPStateStore
+from app.services.context_assembler import get_context_assembler
+from app.services.resilient_llm import LLMDeadlineExceeded, ResilientChatModel
+from app.services.conversation_memory import ConversationMemory
+from app.services.llm_scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    LLMOverloadedError,
+    LLMScheduler,
+    ScheduledLLM,
+    invoke_scheduled,
+)
+from app.services.retrieval_config_service import (
+    RETRIEVAL_MODE_HYBRID,
+    current_query_embedding,
+    current_tenant,
+    get_retrieval_config_service,
+)
 
 
 # Define the state for LangGraph
 class State(TypedDict):
     messages: List[Any]
     last_user_query: Optional[str]
+    # Retrieve-first mode: filled in parallel by the retrieve and intent nodes
+    context: Optional[str]
+    intent: Optional[str]
+    # Conversation memory: summary of older turns and the recent turns themselves
+    summary: Optional[str]
+    history: List[Any]
+
+
+# Graph modes: "retrieve_first" retrieves up front and makes one grounded LLM call;
+# "tool_calling" lets the LLM decide to call retrieve_from_kb (two LLM calls for KB questions)
+GRAPH_MODE_RETRIEVE_FIRST = "retrieve_first"
+GRAPH_MODE_TOOL_CALLING = "tool_calling"
+
+
+NO_KB_RESULTS = "No relevant information found in knowledge base for your query. Please try rephrasing your question or check if the information exists in the knowledge base."
+
+
+def search_knowledge_base(vector_store_service: VectorStoreService, query: str, top_k: int = 5) -> Optional[str]:
+    """
+    Retrieve and format knowledge base context for a query, FAQs first.
+    Returns None when nothing relevant was found.
+    """
+    try:
+        retrieval_config = get_retrieval_config_service().get_config(current_tenant.get())
+    except Exception:
+        retrieval_config = None
+    hybrid = retrieval_config is not None and retrieval_config["mode"] == RETRIEVAL_MODE_HYBRID
+    candidate_multiplier = retrieval_config["candidate_multiplier"] if retrieval_config else 5
+    # Reuse the turn's query embedding when the tool searches the user's own question
+    shared = current_query_embedding.get()
+    embedding = shared[1] if shared and shared[0] == query else None
+    
+    # Get more results to ensure we have enough after filtering
+    # Use similarity search with scores to filter out low-relevance results
+    # Retrieve more candidates to ensure we have good options
+    print(f"🔍 {'Hybrid' if hybrid else 'FAISS'} query: {query}")
+    if hybrid:
+        # Dense + BM25 fused by reciprocal rank; keyword-only hits have no distance
+        results_with_scores = vector_store_service.hybrid_search_with_score(
+            query,
+            top_k,
+            candidate_multiplier=candidate_multiplier,
+            rrf_k=retrieval_config["rrf_k"],
+            dense_weight=retrieval_config["dense_weight"],
+            sparse_weight=retrieval_config["sparse_weight"],
+            embedding=embedding,
+        )
+    else:
+        results_with_scores = vector_store_service.similarity_search_with_score(
+            query, top_k * candidate_multiplier, embedding=embedding
+        )
+    preview = [
+        {
+            "score": None if score is None else round(float(score), 3),
+            "source": doc.metadata.get("source"),
+            "title": doc.metadata.get("title"),
+        }
+        for doc, score in results_with_scores[:max(1, min(5, len(results_with_scores)))]
+    ]
+    print(f"📚 Retrieval candidates ({len(results_with_scores)} total): {preview}")
+
+
+    if not results_with_scores:
+        return None
+    
+    # Filter by similarity threshold - exclude results that are too dissimilar
+    # Lower score = more similar. Typical good scores are < 1.0
+    # Use a stricter threshold to reduce noise - focus on highly relevant results
+    SIMILARITY_THRESHOLD = 2.0  # Stricter threshold to filter out noise
+    scores = np.fromiter(
+        (np.nan if score is None else score for _, score in results_with_scores),
+        dtype=np.float32,
+        count=len(results_with_scores),
+    )
+    if hybrid:
+        # Already in fused rank order; keyword-only hits (NaN distance) pass the threshold
+        order = np.arange(len(results_with_scores))
+        passing = order[~(scores >= SIMILARITY_THRESHOLD)]
+    else:
+        # One stable sort (lower is better); everything under the threshold, best first
+        order = np.argsort(scores, kind="stable")
+        passing = order[scores[order] < SIMILARITY_THRESHOLD]
+    
+    if passing.size == 0:
+        return None
+    
+    # Optional cross-encoder stage: reorder the candidates and keep only the best few passages
+    try:
+        reranker = get_reranker_service()
+    except Exception:
+        reranker = None
+    reranked = reranker.rerank(query, [results_with_scores[i][0] for i in passing]) if reranker else None
+    if reranked:
+        position = {id(results_with_scores[i][0]): i for i in passing}
+        passing = np.array([position[id(doc)] for doc, _ in reranked], dtype=np.int64)
+        print(f"🎯 Reranked {len(reranked)} candidates: {[None if s is None else round(s, 2) for _, s in reranked[:5]]}")
+        passage_limit = reranker.top_n
+    else:
+        passing = passing[:top_k * 2]
+        passage_limit = None
+    
+    # Basic relevance filter against the search_terms precomputed at index time
+    q_tokens = [f" {t} " for t in {t.lower() for t in re.findall(r"\w+", query) if len(t) > 2}]
+    
+    def looks_relevant(doc):
+        # If query has no significant tokens, accept all documents
+        if not q_tokens:
+            return True
+        terms = doc.metadata.get("search_terms")
+        if terms is None:
+            # Index built before search_terms existed
+            terms = search_terms(f"{doc.page_content or ''} {doc.metadata.get('source', '')} {doc.metadata.get('title', '')}")
+        return any(tok in terms for tok in q_tokens)
+    
+    def is_faq(doc):
+        return doc.metadata.get("type") == "faq" and doc.metadata.get("source") == "faq"
+    
+    # Split FAQs from other content and apply the relevance filter in one pass
+    filtered_faqs = []
+    relevant_other = []
+    for i in passing:
+        doc = results_with_scores[i][0]
+        if not looks_relevant(doc):
+            continue
+        if is_faq(doc):
+            if len(filtered_faqs) < top_k:
+                filtered_faqs.append(doc)
+        else:
+            relevant_other.append(doc)
+    # Limit other docs to reduce noise - prioritize most relevant ones
+    other_limit = max(3, top_k - len(filtered_faqs)) if filtered_faqs else top_k
+    if passage_limit is not None:
+        # Reranked: the whole context is cut to the best passage_limit passages, FAQs first
+        filtered_faqs = filtered_faqs[:passage_limit]
+        other_limit = passage_limit - len(filtered_faqs)
+    filtered_other = relevant_other[:other_limit]
+    
+    # If keyword filter is too strict and we got nothing, relax it and use similarity scores
+    if not filtered_faqs and not filtered_other:
+        # Fall back to top similarity-scored results, but limit to reduce noise
+        fallback = passing[:passage_limit] if passage_limit is not None else order[:top_k * 2]
+        for i in fallback:
+            doc = results_with_scores[i][0]
+            (filtered_faqs if is_faq(doc) else filtered_other).append(doc)
+
+    # Dedupe, merge neighbouring chunks and fit the context to its token budget
+    return get_context_assembler().assemble(filtered_faqs, filtered_other)
 
 
 @tool
@@ -49,133 +217,7 @@ def retrieve_from_kb(query: str, top_k: int = 5) -> str:
         vector_store_service = getattr(retrieve_from_kb, '_vector_store_service', None)
         if not vector_store_service:
             return "Knowledge base not available"
-        
-        # Get more results to ensure we have enough after filtering
-        # Use similarity search with scores to filter out low-relevance results
-        # Retrieve more candidates to ensure we have good options
-        print(f"🔍 FAISS query: {query}")
-        results_with_scores = vector_store_service.similarity_search_with_score(query, top_k * 5)
-        preview = [
-            {
-                "score": round(float(score), 3),
-                "source": doc.metadata.get("source"),
-                "title": doc.metadata.get("title"),
-            }
-            for doc, score in results_with_scores[:max(1, min(5, len(results_with_scores)))]
-        ]
-        print(f"📚 FAISS candidates ({len(results_with_scores)} total): {preview}")
-
-
-        if not results_with_scores:
-            return "No relevant information found in knowledge base for your query. Please try rephrasing your question or check if the information exists in the knowledge base."
-        
-        # Filter by similarity threshold - exclude results that are too dissimilar
-        # Lower score = more similar. Typical good scores are < 1.0
-        # Use a stricter threshold to reduce noise - focus on highly relevant results
-        SIMILARITY_THRESHOLD = 2.0  # Stricter threshold to filter out noise
-        filtered_results_with_scores = [(doc, score) for doc, score in results_with_scores if score < SIMILARITY_THRESHOLD]
-        
-        # Sort by similarity score (lower is better) and take top results
-        filtered_results_with_scores.sort(key=lambda x: x[1])
-        # Take top N results after filtering, but don't exceed original top_k * 2
-        max_results = min(top_k * 2, len(filtered_results_with_scores))
-        results = [doc for doc, score in filtered_results_with_scores[:max_results]]
-        
-        if not results:
-            return "No relevant information found in knowledge base for your query. The search did not find sufficiently similar content. Please try rephrasing your question or check if the information exists in the knowledge base."
-        
-        # Separate FAQs from other content
-        faqs = []
-        other_docs = []
-        
-        for doc in results:
-            metadata = doc.metadata
-            if metadata.get("type") == "faq" and metadata.get("source") == "faq":
-                faqs.append(doc)
-            else:
-                other_docs.append(doc)
-        
-        # Basic relevance filter
-        q_tokens = [t.lower() for t in re.findall(r"\w+", query) if len(t) > 2]
-        
-        def looks_relevant(doc):
-            text = (doc.page_content or "").lower()
-            source = str(doc.metadata.get("source", "")).lower()
-            title = str(doc.metadata.get("title", "")).lower()
-            
-            # If query has no significant tokens, accept all documents
-            if not q_tokens:
-                return True
-            
-            # Check if query tokens appear in content, source, or title
-            searchable_text = f"{text} {source} {title}"
-            return any(tok in searchable_text for tok in q_tokens)
-
-        # Filter and prioritize FAQs, but be more lenient
-        filtered_faqs = [d for d in faqs if looks_relevant(d)][:top_k]
-        # Limit other docs to reduce noise - prioritize most relevant ones
-        other_limit = max(3, top_k - len(filtered_faqs)) if filtered_faqs else top_k
-        filtered_other = [d for d in other_docs if looks_relevant(d)][:other_limit]
-        
-        # If keyword filter is too strict and we got nothing, relax it and use similarity scores
-        if not filtered_faqs and not filtered_other and results:
-            # Fall back to top similarity-scored results, but limit to reduce noise
-            sorted_results = sorted(results_with_scores, key=lambda x: x[1])[:top_k * 2]
-            for doc, score in sorted_results:
-                if doc.metadata.get("type") == "faq" and doc.metadata.get("source") == "faq":
-                    if doc not in filtered_faqs:
-                        filtered_faqs.append(doc)
-                else:
-                    if doc not in filtered_other:
-                        filtered_other.append(doc)
-                if len(filtered_faqs) + len(filtered_other) >= top_k * 2:
-                    break
-
-        # Format results with clear FAQ section
-        formatted_results = []
-        
-        # Add FAQs section
-        if filtered_faqs:
-            formatted_results.append("=== FREQUENTLY ASKED QUESTIONS (FAQs) ===")
-            for i, doc in enumerate(filtered_faqs, 1):
-                content = doc.page_content
-                metadata = doc.metadata
-                
-                # Extract question and answer from FAQ
-                if "\n\n" in content:
-                    question, answer = content.split("\n\n", 1)
-                    formatted_results.append(f"\nFAQ #{i}:")
-                    formatted_results.append(f"Q: {question.strip()}")
-                    formatted_results.append(f"A: {answer.strip()[:500]}")  # Truncate answer if too long
-                else:
-                    formatted_results.append(f"\nFAQ #{i}:")
-                    formatted_results.append(f"Q&A: {content.strip()[:600]}")
-            
-            formatted_results.append("\n")
-        
-        # Add other documents section
-        if filtered_other:
-            formatted_results.append("=== ADDITIONAL INFORMATION ===")
-            doc_count = 0
-            for doc in filtered_other:
-                content = doc.page_content
-                metadata = doc.metadata
-                source = metadata.get("source", "knowledge base")
-                
-                # Skip the default welcome message
-                content_lower = content.lower().strip()
-                if "welcome to sakura ai assistant" in content_lower and len(content_lower) < 100:
-                    continue
-                
-                doc_count += 1
-                # Truncate to keep responses focused, but use longer limit to capture important info
-                snippet = content[:1500].rstrip()
-                formatted_results.append(f"\n{doc_count}. [{source}] {snippet}")
-        
-        if not formatted_results:
-            return "No relevant information found in knowledge base for your query. Please try rephrasing your question or check if the information exists in the knowledge base."
-        
-        return "\n".join(formatted_results)
+        return search_knowledge_base(vector_store_service, query, top_k) or NO_KB_RESULTS
     except Exception as e:
         logging.error(f"Error retrieving from knowledge base: {e}")
         return f"Error retrieving information from knowledge base: {str(e)}"
@@ -188,8 +230,23 @@ class LangGraphService:
         self.settings = settings
         self.vector_store_service = vector_store_service
         self.aops: List[Dict] = []
+        # Compiled AOP state machines; the LLM only reads input no pattern covers
+        self.aop_runtime = AOPRuntime(llm_invoke=self._invoke_aop_llm)
         self.llm = None
         self.graph = None
+        self.tool_graph = None
+        self.retrieve_first_graph = None
+        self.graph_mode = os.getenv("AI_GRAPH_MODE", GRAPH_MODE_RETRIEVE_FIRST)
+        # Optional router that answers small talk and exact FAQ hits before the graph
+        self.intent_router: Optional[IntentRouter] = None
+        # Optional history window and rolling summary for follow-up questions
+        self.memory: Optional[ConversationMemory] = None
+        # Caps concurrent Gemini calls, queues by priority and sheds load past the SLO
+        self.scheduler = LLMScheduler()
+        self.overloaded_message = os.getenv(
+            "LLM_OVERLOADED_MESSAGE",
+            "We're receiving a lot of messages right now. Please try again in a moment, or a member of our team will get back to you shortly."
+        )
         self._initialized = False
         self.system_prompt: str = ""
         
@@ -198,8 +255,8 @@ class LangGraphService:
         print("🧠 Initializing real AI service with LangGraph...")
         
         try:
-            # Load AOPs
-            self._load_aops()
+            # Load the system prompt and AOPs
+            self._load_config()
             
             # Initialize LLM
             self._init_llm()
@@ -214,110 +271,139 @@ class LangGraphService:
             print(f"❌ Error initializing AI service: {e}")
             raise
     
-    def _load_aops(self) -> None:
-        """Load Agent Operating Procedures from JSON file."""
-        try:
-            aop_path = Path(self.settings.aops_file_path)
-            if aop_path.exists():
-                with open(aop_path, "r", encoding="utf-8") as f:
-                    self.aops = json.load(f)
-                print(f"📂 Loaded {len(self.aops)} AOPs")
-            else:
-                # Create default AOPs
-                self.aops = [
-                    {
-                        "aop_name": "Customer Support",
-                        "description": "Handle general customer inquiries",
-                        "steps": [
-                            {
-                                "id": "greet_customer",
-                                "type": "action",
-                                "action": "greet_customer",
-                                "user_prompt": "Hello! How can I help you today?",
-                                "success_next": "handle_inquiry"
-                            }
-                        ]
-                    }
-                ]
-                print("📂 Created default AOPs")
-        except Exception as e:
-            print(f"❌ Error loading AOPs: {e}")
-            self.aops = []
+    def _load_config(self) -> None:
+        """Take the system prompt and AOPs from the agent config, and follow its reloads."""
+        config = get_agent_config_service()
+        self._apply_config(config)
+        config.add_listener(self._apply_config)
+    
+    def _apply_config(self, config: AgentConfigService) -> None:
+        """Switch to the config's current system prompt and AOPs (next turn onwards)."""
+        self.system_prompt = config.system_prompt
+        self.aops = config.aops
+        self.aop_runtime.load(config.aops)
+        print(f"📝 Using system prompt v{config.prompt_version} and {len(self.aops)} AOPs")
     
     def _init_llm(self) -> None:
         """Initialize the language model."""
         try:
             print("🤖 Initializing Google Gemini model...")
             
-            # Try to load system prompt from database
-            try:
-                from app.core.database import get_database
-                db = get_database()
-                if db is not None:
-                    collection = db["ai-settings"]
-                    settings_doc = collection.find_one({"type": "system_prompt"})
-                    if settings_doc and settings_doc.get("system_prompt"):
-                        self.system_prompt = settings_doc.get("system_prompt")
-                        print("✅ Loaded system prompt from database")
-                    else:
-                        # Default system prompt if not found
-                        self.system_prompt = (
-                            "You are an AI customer concierge for this company.\n"
-                            "Your job is to answer user questions clearly and professionally using the company's verified knowledge base and FAQs.\n"
-                            "Always provide the actual answer — do not restate your instructions.\n"
-                            "Try to summarize the answer in a few sentences. And always make sure the customer understands the answer.\n"
-                            "If no relevant information is available, say so politely and offer to escalate.\n"
-                        )
-                        print("📝 Using default system prompt")
-                else:
-                    # Default system prompt if database not available
-                    self.system_prompt = (
-                        "You are an AI customer concierge for this company.\n"
-                        "Your job is to answer user questions clearly and professionally using the company's verified knowledge base and FAQs.\n"
-                        "Always provide the actual answer — do not restate your instructions.\n"
-                        "Try to summarize the answer in a few sentences. And always make sure the customer understands the answer.\n"
-                        "If no relevant information is available, say so politely and offer to escalate.\n"
-                    )
-                    print("📝 Using default system prompt (database not available)")
-            except Exception as e:
-                # Fallback to default if loading from database fails
-                print(f"⚠️ Error loading system prompt from database: {e}")
-                self.system_prompt = (
-                    "You are an AI customer concierge for this company.\n"
-                    "Your job is to answer user questions clearly and professionally using the company's verified knowledge base and FAQs.\n"
-                    "Always provide the actual answer — do not restate your instructions.\n"
-                    "Try to summarize the answer in a few sentences. And always make sure the customer understands the answer.\n"
-                    "If no relevant information is available, say so politely and offer to escalate.\n"
-                )
-                print("📝 Using default system prompt (fallback)")
-
- 
-            # Use lower temperature for more deterministic, factual responses
-            # Try gemini-2.0-flash-exp first, fallback to gemini-2.0-flash
-            try:
-                self.llm = ChatGoogleGenerativeAI(
-                    model="gemini-2.0-flash-exp",
-                    temperature=0.1,  # Lower temperature for more factual, less creative responses
-                    google_api_key=self.settings.google_api_key
-                )
-                print("✅ Using gemini-2.0-flash-exp model")
-            except Exception:
-                # Fallback to standard flash model
-                self.llm = ChatGoogleGenerativeAI(
-                    model="gemini-2.0-flash",
+            # Primary and fallback models behind per-call deadlines, retries and optional hedging.
+            # The client's own retries are off and its timeout matches one attempt, so a stuck
+            # request is abandoned and retried on the other model instead of holding the chat.
+            primary_model = os.getenv("LLM_PRIMARY_MODEL", "gemini-2.0-flash-exp")
+            fallback_model = os.getenv("LLM_FALLBACK_MODEL", "gemini-2.0-flash")
+            attempt_timeout = float(os.getenv("LLM_ATTEMPT_TIMEOUT_S", "15"))
+            
+            def build_model(model: str) -> ChatGoogleGenerativeAI:
+                return ChatGoogleGenerativeAI(
+                    model=model,
                     temperature=0.1,  # Lower temperature for more factual, less creative responses
-                    google_api_key=self.settings.google_api_key
+                    google_api_key=self.settings.google_api_key,
+                    timeout=attempt_timeout,
+                    max_retries=0
                 )
-                print("✅ Using gemini-2.0-flash model (fallback)")
+            
+            primary, fallback = None, None
+            try:
+                primary = build_model(primary_model)
+            except Exception as e:
+                print(f"⚠️ Could not create {primary_model}: {e}")
+            if fallback_model and fallback_model != primary_model:
+                fallback = build_model(fallback_model)
+            if primary is None:
+                # Fallback model only
+                primary, primary_model, fallback = fallback, fallback_model, None
+            if primary is None:
+                raise RuntimeError(f"Could not create LLM {primary_model}")
+            # Each request, including retries and hedges, takes its own scheduler slot
+            self.llm = ResilientChatModel(primary, fallback, primary_model, fallback_model, scheduler=self.scheduler)
+            print(f"✅ Using {primary_model} model" + (f" (fallback: {fallback_model})" if fallback is not None else ""))
             print("✅ Gemini model initialized successfully")
         except Exception as e:
             print(f"❌ Error initializing LLM: {e}")
             raise
     
     def _build_graph(self) -> None:
-        """Build the LangGraph workflow."""
+        """Build both LangGraph workflows and select the active one from AI_GRAPH_MODE."""
+        # Inject vector store service into the tool
+        retrieve_from_kb._vector_store_service = self.vector_store_service
+        
+        self._build_tool_calling_graph()
+        self._build_retrieve_first_graph()
+        
+        if self.graph_mode == GRAPH_MODE_TOOL_CALLING:
+            self.graph = self.tool_graph
+        else:
+            self.graph = self.retrieve_first_graph
+        print(f"✅ Active graph mode: {self.graph_mode}")
+    
+    def _build_retrieve_first_graph(self) -> None:
+        """
+        Build the retrieve-first workflow: knowledge base retrieval and a local intent
+        check run in parallel, then a single grounded LLM call produces the answer.
+        """
+        try:
+            print("🔗 Building retrieve-first LangGraph...")
+            
+            def retrieve(state: State):
+                """Run knowledge base retrieval up front."""
+                query = state.get("last_user_query") or ""
+                try:
+                    context = search_knowledge_base(self.vector_store_service, query, top_k=5)
+                except Exception as e:
+                    print(f"⚠️ Retrieval failed, answering without context: {e}")
+                    context = None
+                return {"context": context or ""}
+            
+            def intent(state: State):
+                """Cheap local intent check (no LLM call)."""
+                return {"intent": detect_intent(state.get("last_user_query") or "")}
+            
+            def respond(state: State):
+                """Make one grounded LLM call with the retrieved context."""
+                user_query = state.get("last_user_query") or ""
+                context = state.get("context") or ""
+                prepared_msgs = self._conversation_prefix(state)
+                
+                if state.get("intent") != "question" or not context:
+                    # Nothing to ground on: the agent's system prompt decides how to answer
+                    prepared_msgs.append(HumanMessage(content=user_query))
+                else:
+                    instruction = (
+                        f"USER QUESTION: {user_query}\n\n"
+                        f"RETRIEVED CONTEXT FROM KNOWLEDGE BASE:\n{context}\n\n"
+                        f"Please answer the user's question. Use the retrieved context above to inform your response. "
+                        f"If FAQs are provided, they are prioritized and should be used. "
+                        f"You may supplement with your general knowledge to provide a complete and helpful answer."
+                    )
+                    prepared_msgs.append(HumanMessage(content=instruction))
+                
+                response = self._invoke_llm(self.llm, prepared_msgs)
+                return {"messages": [response]}
+            
+            builder = StateGraph(State)
+            builder.add_node("retrieve", retrieve)
+            builder.add_node("intent", intent)
+            builder.add_node("respond", respond)
+            # Fan out to retrieve and intent in the same step, fan in to respond
+            builder.add_edge(START, "retrieve")
+            builder.add_edge(START, "intent")
+            builder.add_edge(["retrieve", "intent"], "respond")
+            builder.add_edge("respond", END)
+            
+            self.retrieve_first_graph = builder.compile()
+            print("✅ Retrieve-first LangGraph built successfully")
+            
+        except Exception as e:
+            print(f"❌ Error building retrieve-first graph: {e}")
+            raise
+    
+    def _build_tool_calling_graph(self) -> None:
+        """Build the tool-calling LangGraph workflow (the LLM decides when to retrieve)."""
         try:
-            print("🔗 Building LangGraph...")
+            print("🔗 Building tool-calling LangGraph...")
             
             # Collect all tools (knowledge base only)
             tools = [retrieve_from_kb]
@@ -325,9 +411,6 @@ class LangGraphService:
             # Bind tools to LLM
             llm_with_tools = self.llm.bind_tools(tools)
             
-            # Inject vector store service into the tool
-            retrieve_from_kb._vector_store_service = self.vector_store_service
-            
             def chatbot(state: State):
                 """Process messages through the chatbot."""
                 print("🤖 Processing message through chatbot...")
@@ -342,7 +425,7 @@ class LangGraphService:
                     has_user = any(type(m).__name__ == 'HumanMessage' for m in msgs)
                     has_tool_results = any(type(m).__name__ == 'ToolMessage' for m in msgs)
                     current_query: Optional[str] = state.get("last_user_query")
-                    prepared_msgs = [SystemMessage(content=self.system_prompt)]
+                    prepared_msgs = self._conversation_prefix(state)
                     
                     if has_user:
                         # Find the original user query and tool results
@@ -416,7 +499,7 @@ class LangGraphService:
                         content = getattr(msg, 'content', '')
                         snippet = content if content is None else str(content)[:500]
                         print(f"  [{i}] {role}: {snippet}")
-                    response = llm_with_tools.invoke(prepared_msgs)
+                    response = self._invoke_llm(llm_with_tools, prepared_msgs)
                     try:
                         preview = getattr(response, 'content', str(response))
                         print(f"🤖 LLM raw output: {str(preview)[:500]}")
@@ -460,14 +543,29 @@ class LangGraphService:
             builder.add_conditional_edges("chatbot", tools_condition)
             builder.add_edge("tools", "chatbot")
             
-            self.graph = builder.compile()
-            print(f"✅ LangGraph built successfully with {len(tools)} tools")
+            self.tool_graph = builder.compile()
+            print(f"✅ Tool-calling LangGraph built successfully with {len(tools)} tools")
             
         except Exception as e:
             print(f"❌ Error building graph: {e}")
             raise
     
-    def process_chat_message(self, query: str, session_id: str) -> str:
+    def _invoke_llm(self, llm, messages: List[Any], priority: int = PRIORITY_INTERACTIVE):
+        """Invoke a chat model through the scheduler; identical concurrent prompts share one call."""
+        return invoke_scheduled(self.scheduler, llm, messages, priority)
+    
+    def background_llm(self) -> ScheduledLLM:
+        """The chat model for work off the response path, queued behind live chats."""
+        return ScheduledLLM(self.scheduler, self.llm, priority=PRIORITY_BACKGROUND)
+    
+    def _conversation_prefix(self, state: State) -> List[Any]:
+        """System prompt (with the conversation summary, if any) followed by the recent turns."""
+        system_prompt = self.system_prompt
+        if state.get("summary"):
+            system_prompt = f"{system_prompt}\n\nSUMMARY OF THE CONVERSATION SO FAR:\n{state['summary']}"
+        return [SystemMessage(content=system_prompt)] + list(state.get("history") or [])
+    
+    def process_chat_message(self, query: str, session_id: str, dashboard_user_id: Optional[str] = None) -> str:
         """Process a chat message through the LangGraph pipeline."""
         if not self._initialized:
             return "AI service not initialized"
@@ -475,9 +573,24 @@ class LangGraphService:
         print(f"💬 Processing chat message for session: {session_id}")
         print(f"🧑‍💻 Human question: {query}")
         
+        # Retrieval reads the tenant's settings from this context variable
+        tenant_token = current_tenant.set(dashboard_user_id)
+        embedding_token = None
         try:
             if not query or not str(query).strip():
                 return "Please enter a question."
+            
+            # Embed a question once; the FAQ router and retrieval both search with it
+            embedding = None
+            if detect_intent(query) == "question" and self.vector_store_service.is_initialized():
+                embedding = self.vector_store_service.embed_query(query)
+                embedding_token = current_query_embedding.set((query, embedding))
+            
+            if self.intent_router is not None:
+                routed = self.intent_router.route(query, embedding=embedding, dashboard_user_id=dashboard_user_id)
+                if routed:
+                    print(f"⚡ Answered by intent router ({routed['route']}, confidence={routed['confidence']:.2f})")
+                    return routed["response"]
             # Create user message with system context
             from langchain_core.messages import AIMessage
             
@@ -488,8 +601,27 @@ class LangGraphService:
                 HumanMessage(content=query)
             ]
             
-            print("🚀 Invoking LangGraph workflow...")
-            state = self.graph.invoke({"messages": messages, "last_user_query": query})
+            # Earlier turns travel beside the messages so the graphs still see one user question
+            summary, history = None, []
+            if self.memory is not None:
+                try:
+                    summary, history = self.memory.get_context(session_id, query)
+                    print(f"🧠 Loaded {len(history)} earlier messages{' and a summary' if summary else ''}")
+                except Exception as e:
+                    print(f"⚠️ Could not load conversation memory: {e}")
+            graph_input = {"messages": messages, "last_user_query": query, "summary": summary, "history": history}
+            
+            print(f"🚀 Invoking LangGraph workflow ({self.graph_mode})...")
+            try:
+                state = self.graph.invoke(graph_input)
+            except (LLMOverloadedError, LLMDeadlineExceeded):
+                raise
+            except Exception as e:
+                if self.graph is self.tool_graph:
+                    raise
+                # Fall back to the tool-calling workflow
+                print(f"⚠️ Retrieve-first graph failed, falling back to tool calling: {e}")
+                state = self.tool_graph.invoke(graph_input)
             
             raw_response = state["messages"][-1].content
             print(f"📝 Model response preview: {raw_response[:500]}")
@@ -502,24 +634,39 @@ class LangGraphService:
             print("✅ Message processed successfully")
             return formatted
             
+        except (LLMOverloadedError, LLMDeadlineExceeded) as e:
+            print(f"🚦 Shedding chat message, LLM overloaded or too slow: {e}")
+            return self.overloaded_message
         except Exception as e:
             print(f"❌ Error processing chat message: {e}")
             return f"I apologize, but I encountered an error processing your request: {str(e)}"
+        finally:
+            if embedding_token is not None:
+                current_query_embedding.reset(embedding_token)
+            current_tenant.reset(tenant_token)
+    
+    def _invoke_aop_llm(self, prompt: str) -> str:
+        """Text completion for AOP input the runtime cannot read with patterns."""
+        response = self._invoke_llm(self.llm, [HumanMessage(content=prompt)])
+        return str(getattr(response, "content", response))
     
-    def run_aop(self, aop_name: str, user_message: str, chat_id: str, storage: Any) -> str:
-        """Run an Agent Operating Procedure (AOP) workflow."""
+    def run_aop(self, aop_name: str, user_message: str, chat_id: str, storage: Optional[AOPStateStore] = None) -> Dict:
+        """
+        Run one turn of an Agent Operating Procedure (AOP) for a chat.
+        Returns {"response": ..., "completed": ...}.
+        """
         if not self._initialized:
-            return "AI service not initialized"
+            return {"response": "AI service not initialized", "completed": True}
         
-        aop = next((a for a in self.aops if a["aop_name"] == aop_name), None)
-        if not aop:
-            return f"AOP '{aop_name}' not found"
+        if not self.aop_runtime.has_aop(aop_name):
+            return {"response": f"AOP '{aop_name}' not found", "completed": True}
         
         print(f"🚀 Running AOP: {aop_name}")
-        
-        # For now, return a simple response
-        # In a full implementation, this would handle complex AOP workflows
-        return f"Running AOP '{aop_name}' for message: {user_message}"
+        try:
+            return self.aop_runtime.run(aop_name, user_message, chat_id, storage or AOPStateStore(None))
+        except (LLMOverloadedError, LLMDeadlineExceeded) as e:
+            print(f"🚦 AOP step could not reach the LLM: {e}")
+            return {"response": self.overloaded_message, "completed": False}
 
 
 # Global LangGraph service instance
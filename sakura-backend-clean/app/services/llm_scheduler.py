@@ -0,0 +1,222 @@
+"""
+Admission control for LLM calls.
+
+Every Gemini call goes through one scheduler per worker:
+- at most LLM_MAX_CONCURRENCY requests run at once; the rest wait in a priority
+  queue, so live chats go ahead of background work such as summaries. A model
+  that makes several requests per call (retries, hedges) takes a slot for each
+  request itself and holds it until the request really finishes, even after
+  the call has given up on it;
+- identical prompts already in flight are coalesced: followers wait for the
+  leader's result instead of making a second call;
+- a call that cannot start within LLM_QUEUE_SLO_MS (or arrives to a full queue)
+  is shed with LLMOverloadedError, which callers turn into a polite fallback.
+  Followers are shed the same way if the leader has not answered within the
+  queue SLO plus LLM_DEADLINE_S.
+
+Calls are synchronous (the graphs run in worker threads), so waiting uses
+per-waiter events rather than asyncio.
+"""
+import os
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Hashable, Iterator, List, Optional
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class LLMOverloadedError(Exception):
+    """Raised when an LLM call is shed because the queue is over its SLO."""
+
+
+class _Waiter:
+    __slots__ = ("event", "cancelled")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.cancelled = False
+
+
+class LLMScheduler:
+    """Bounded, prioritized, coalescing executor for blocking LLM calls."""
+
+    def __init__(self):
+        self.max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.max_queue = int(os.getenv("LLM_MAX_QUEUE", "64"))
+        self.queue_slo_ms = float(os.getenv("LLM_QUEUE_SLO_MS", "5000"))
+        # Background work may wait longer before it is dropped
+        self.background_slo_ms = float(os.getenv("LLM_BACKGROUND_QUEUE_SLO_MS", "60000"))
+        self.coalesce = os.getenv("LLM_COALESCE", "true").lower() == "true"
+        # Longest a leader's call may run once started; bounds how long followers wait
+        self.call_deadline_s = float(os.getenv("LLM_DEADLINE_S", "30"))
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue: List[tuple] = []  # (priority, seq, waiter)
+        self._queued = 0
+        self._seq = itertools.count()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._waits_ms: Deque[float] = deque(maxlen=1000)
+        self._metrics = {"calls": 0, "queued": 0, "coalesced": 0, "shed": 0, "errors": 0, "wait_ms_total": 0.0}
+
+    def _slo_ms(self, priority: int) -> float:
+        return self.queue_slo_ms if priority <= PRIORITY_INTERACTIVE else self.background_slo_ms
+
+    def _acquire(self, priority: int) -> float:
+        """Take a concurrency slot, waiting in priority order. Returns the wait in ms."""
+        started = time.perf_counter()
+        slo_ms = self._slo_ms(priority)
+        with self._lock:
+            if self._active < self.max_concurrency and not self._queued:
+                self._active += 1
+                return 0.0
+            if self._queued >= self.max_queue:
+                self._metrics["shed"] += 1
+                raise LLMOverloadedError(f"LLM queue full ({self._queued} waiting)")
+            waiter = _Waiter()
+            heapq.heappush(self._queue, (priority, next(self._seq), waiter))
+            self._queued += 1
+            self._metrics["queued"] += 1
+
+        # _release hands the slot over directly by setting the event
+        if not waiter.event.wait(slo_ms / 1000):
+            with self._lock:
+                if not waiter.event.is_set():
+                    waiter.cancelled = True
+                    self._queued -= 1
+                    self._metrics["shed"] += 1
+                    raise LLMOverloadedError(f"LLM queue wait exceeded {slo_ms:.0f}ms")
+        return (time.perf_counter() - started) * 1000
+
+    def _release(self) -> None:
+        with self._lock:
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if not waiter.cancelled:
+                    self._queued -= 1
+                    waiter.event.set()  # The slot passes to this waiter
+                    return
+            self._active -= 1
+
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_INTERACTIVE) -> Iterator[None]:
+        """Hold one concurrency slot for a single request."""
+        wait_ms = self._acquire(priority)
+        with self._lock:
+            self._metrics["calls"] += 1
+            self._metrics["wait_ms_total"] += wait_ms
+            self._waits_ms.append(wait_ms)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def run(
+        self,
+        fn: Callable[[], Any],
+        priority: int = PRIORITY_INTERACTIVE,
+        key: Optional[Hashable] = None,
+        admit: bool = True
+    ) -> Any:
+        """
+        Run fn under the concurrency cap. Calls with the same key that overlap
+        share one execution and its result (or exception). With admit=False fn
+        takes its own slots (see slot()) and only coalescing applies here.
+        """
+        leader = True
+        if self.coalesce and key is not None:
+            with self._lock:
+                future = self._in_flight.get(key)
+                if future is None:
+                    future = self._in_flight[key] = Future()
+                else:
+                    leader = False
+                    self._metrics["coalesced"] += 1
+            if not leader:
+                return self._follow(future, priority)
+        else:
+            future = None
+
+        try:
+            if admit:
+                with self.slot(priority):
+                    result = fn()
+            else:
+                result = fn()
+        except BaseException as e:
+            if not isinstance(e, LLMOverloadedError):
+                with self._lock:
+                    self._metrics["errors"] += 1
+            if future is not None:
+                self._finish(key, future)
+                future.set_exception(e)
+            raise
+        if future is not None:
+            self._finish(key, future)
+            future.set_result(result)
+        return result
+
+    def _follow(self, future: Future, priority: int) -> Any:
+        """Wait for a leader's result, for as long as the leader itself could take."""
+        timeout_s = self._slo_ms(priority) / 1000 + self.call_deadline_s
+        try:
+            return future.result(timeout=timeout_s)
+        except FutureTimeoutError:
+            with self._lock:
+                self._metrics["shed"] += 1
+            raise LLMOverloadedError(f"Coalesced LLM call did not answer within {timeout_s:.0f}s")
+
+    def _finish(self, key: Hashable, future: Future) -> None:
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def get_metrics(self) -> Dict:
+        """Admission counters plus current load and queue-wait percentiles."""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["active"] = self._active
+            metrics["queue_depth"] = self._queued
+            waits = sorted(self._waits_ms)
+        calls = metrics["calls"] or 1
+        metrics["max_concurrency"] = self.max_concurrency
+        metrics["wait_ms_avg"] = metrics.pop("wait_ms_total") / calls
+        metrics["wait_ms_p50"] = waits[len(waits) // 2] if waits else 0.0
+        metrics["wait_ms_p95"] = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        return metrics
+
+
+class ScheduledLLM:
+    """A chat model whose invoke() goes through the scheduler at a fixed priority."""
+
+    def __init__(self, scheduler: LLMScheduler, llm, priority: int = PRIORITY_INTERACTIVE):
+        self.scheduler = scheduler
+        self.llm = llm
+        self.priority = priority
+
+    def invoke(self, input, **kwargs):
+        return invoke_scheduled(self.scheduler, self.llm, input, self.priority, **kwargs)
+
+
+def invoke_scheduled(scheduler: LLMScheduler, llm, input, priority: int = PRIORITY_INTERACTIVE, **kwargs):
+    """
+    Invoke a chat model through the scheduler. A model built with this scheduler
+    (ResilientChatModel) takes a slot per request itself and is given the priority.
+    """
+    key = prompt_key(llm, input)
+    if getattr(llm, "scheduler", None) is scheduler:
+        return scheduler.run(lambda: llm.invoke(input, priority=priority, **kwargs), priority=priority, key=key, admit=False)
+    return scheduler.run(lambda: llm.invoke(input, **kwargs), priority=priority, key=key)
+
+
+def prompt_key(llm, messages) -> Hashable:
+    """Coalescing key: the model plus the role and content of every message."""
+    if isinstance(messages, str):
+        return (id(llm), messages)
+    return (id(llm), tuple((type(message).__name__, repr(getattr(message, "content", message))) for message in messages))
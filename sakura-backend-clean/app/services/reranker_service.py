@@ -0,0 +1,165 @@
+"""
+Cross-encoder reranking for knowledge base retrieval.
+
+FAISS and BM25 rank candidates by distance and keyword overlap; a cross-encoder
+reads the query and passage together and scores relevance far more precisely,
+so the prompt can be cut to the few passages that actually answer the question.
+Scoring runs in batches on CPU under a hard latency budget: candidates that do
+not fit keep their first-stage order after the reranked ones. Scores are cached
+per (query, document).
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from app.core.settings import Settings
+from app.services.sparse_index import doc_key
+
+logger = logging.getLogger(__name__)
+
+
+class RerankerService:
+    """Scores (query, passage) pairs with a local cross-encoder."""
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.enabled = os.getenv("RERANKER_ENABLED", "false").lower() == "true"
+        self.model_name = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+        self.batch_size = int(os.getenv("RERANKER_BATCH_SIZE", "16"))
+        self.budget_ms = float(os.getenv("RERANKER_BUDGET_MS", "150"))
+        # How many first-stage candidates to rerank, and how many passages to keep
+        self.candidates = int(os.getenv("RERANKER_CANDIDATES", "20"))
+        self.top_n = int(os.getenv("RERANKER_TOP_N", "3"))
+        self.max_chars = int(os.getenv("RERANKER_MAX_CHARS", "1500"))
+        self.cache_size = int(os.getenv("RERANKER_CACHE_SIZE", "4096"))
+        self.model = None
+        self._cache: "OrderedDict[tuple, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Running estimate of one batch's latency, used to stop before the budget is blown
+        self._batch_ms_estimate = 0.0
+        self._metrics = {
+            "calls": 0,
+            "pairs_scored": 0,
+            "cache_hits": 0,
+            "budget_exhausted": 0,
+            "rerank_ms_total": 0.0,
+        }
+
+    def load_model(self) -> None:
+        """Load the cross-encoder; disables reranking if it cannot be loaded."""
+        if not self.enabled or self.model is not None:
+            return
+        try:
+            from sentence_transformers import CrossEncoder
+            started = time.perf_counter()
+            self.model = CrossEncoder(self.model_name, device="cpu", max_length=512)
+            print(f"✅ Loaded reranker {self.model_name} in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            print(f"⚠️  Reranker unavailable, retrieval will not rerank: {e}")
+            self.enabled = False
+
+    def _passage(self, doc: Document) -> str:
+        title = doc.metadata.get("title") or ""
+        text = (doc.page_content or "")[:self.max_chars]
+        return f"{title}\n{text}" if title else text
+
+    def rerank(self, query: str, documents: List[Document]) -> Optional[List[Tuple[Document, Optional[float]]]]:
+        """
+        Reorder documents by cross-encoder relevance (highest first).
+        Returns [(doc, score)], with score None for documents left unscored when
+        the latency budget ran out, or None if reranking is disabled.
+        """
+        if not self.enabled or self.model is None or not documents:
+            return None
+        started = time.perf_counter()
+        documents = documents[:self.candidates]
+        normalized = " ".join(query.split()).casefold()
+
+        scores: Dict[int, float] = {}
+        pending = []
+        with self._lock:
+            for position, doc in enumerate(documents):
+                key = (normalized, doc_key(doc))
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[position] = self._cache[key]
+                else:
+                    pending.append(position)
+            cache_hits = len(scores)
+            batch_ms_estimate = self._batch_ms_estimate
+
+        scored_pairs = 0
+        exhausted = False
+        for start in range(0, len(pending), self.batch_size):
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if elapsed_ms + batch_ms_estimate > self.budget_ms:
+                exhausted = True
+                break
+            batch = pending[start:start + self.batch_size]
+            batch_started = time.perf_counter()
+            batch_scores = self.model.predict(
+                [(query, self._passage(documents[position])) for position in batch],
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+            )
+            batch_ms = (time.perf_counter() - batch_started) * 1000
+            batch_ms_estimate = batch_ms if not batch_ms_estimate else 0.8 * batch_ms_estimate + 0.2 * batch_ms
+            for position, score in zip(batch, batch_scores):
+                scores[position] = float(score)
+            scored_pairs += len(batch)
+
+        with self._lock:
+            self._batch_ms_estimate = batch_ms_estimate
+            for position in pending[:scored_pairs]:
+                self._cache[(normalized, doc_key(documents[position]))] = scores[position]
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            self._metrics["calls"] += 1
+            self._metrics["pairs_scored"] += scored_pairs
+            self._metrics["cache_hits"] += cache_hits
+            self._metrics["budget_exhausted"] += int(exhausted)
+            self._metrics["rerank_ms_total"] += (time.perf_counter() - started) * 1000
+
+        # Pending is in first-stage order, so whatever the budget cut off is the lowest ranked
+        reranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        unscored = [position for position in range(len(documents)) if position not in scores]
+        return [(documents[position], score) for position, score in reranked] + [
+            (documents[position], None) for position in unscored
+        ]
+
+    def get_metrics(self) -> Dict:
+        """Reranking counters plus cache hit rate and mean latency."""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["cache_size"] = len(self._cache)
+        calls = metrics["calls"] or 1
+        lookups = metrics["pairs_scored"] + metrics["cache_hits"]
+        metrics["enabled"] = self.enabled
+        metrics["model"] = self.model_name
+        metrics["cache_hit_rate"] = metrics["cache_hits"] / lookups if lookups else 0.0
+        metrics["rerank_ms_avg"] = metrics.pop("rerank_ms_total") / calls
+        return metrics
+
+
+# Global reranker instance
+_reranker_service: Optional[RerankerService] = None
+
+
+def init_reranker_service(settings: Settings) -> RerankerService:
+    """Initialize the reranker and load its model when enabled."""
+    global _reranker_service
+    _reranker_service = RerankerService(settings)
+    _reranker_service.load_model()
+    return _reranker_service
+
+
+def get_reranker_service() -> RerankerService:
+    """Get the reranker instance."""
+    if _reranker_service is None:
+        raise Exception("Reranker service not initialized. Call init_reranker_service() first.")
+    return _reranker_service
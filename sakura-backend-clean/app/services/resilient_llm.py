@@ -0,0 +1,239 @@
+"""
+Deadlines, retries, hedging and model fallback for chat model calls.
+
+A single slow or stuck Gemini call used to hold a chat for the client's full
+timeout. ResilientChatModel wraps a primary and a fallback model:
+- every attempt has a timeout and the whole call has a deadline;
+- a failed or timed-out attempt moves on to the other model, after a short
+  jittered backoff;
+- optionally, an attempt still running after the primary's recent p95 latency
+  gets a hedged duplicate, and whichever answers first wins;
+- after repeated primary failures, calls start on the fallback for a cooldown.
+
+With a scheduler, every request (first try, retry or hedge) takes its own
+concurrency slot in the thread that makes it, and keeps it until the request
+returns, so requests abandoned after a timeout still count against the cap.
+"""
+import os
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, List, Optional
+
+from app.services.llm_scheduler import PRIORITY_INTERACTIVE, LLMOverloadedError, LLMScheduler
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """Raised when no attempt answered before the call's deadline."""
+
+
+class _ModelStats:
+    """Recent latencies and failure streak of one model."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies_ms: Deque[float] = deque(maxlen=200)
+        self.consecutive_failures = 0
+        self.counters = {"attempts": 0, "successes": 0, "failures": 0, "timeouts": 0}
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.latencies_ms) < 20:
+            return None  # Not enough samples to hedge on
+        latencies = sorted(self.latencies_ms)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+
+
+class ResilientChatModel:
+    """Chat model facade (invoke / bind_tools) over a primary and a fallback model."""
+
+    def __init__(self, primary, fallback=None, primary_name: str = "primary", fallback_name: str = "fallback",
+                 scheduler: Optional[LLMScheduler] = None, _shared: Optional[Dict] = None):
+        self.primary = primary
+        self.fallback = fallback
+        self.primary_name = primary_name
+        self.fallback_name = fallback_name
+        self.scheduler = scheduler
+        if _shared is None:
+            _shared = {
+                "stats": {primary_name: _ModelStats(primary_name), fallback_name: _ModelStats(fallback_name)},
+                "lock": threading.Lock(),
+                "executor": ThreadPoolExecutor(max_workers=int(os.getenv("LLM_CALL_THREADS", "32"))),
+                "counters": {"calls": 0, "retries": 0, "fallbacks": 0, "hedges": 0, "hedge_wins": 0, "deadline_exceeded": 0},
+                "primary_down_until": 0.0,
+            }
+        self._shared = _shared
+        self.attempt_timeout_s = float(os.getenv("LLM_ATTEMPT_TIMEOUT_S", "15"))
+        self.deadline_s = float(os.getenv("LLM_DEADLINE_S", "30"))
+        self.max_attempts = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+        self.retry_base_ms = float(os.getenv("LLM_RETRY_BASE_MS", "100"))
+        self.hedge_enabled = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+        self.hedge_percentile = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+        self.hedge_min_ms = float(os.getenv("LLM_HEDGE_MIN_MS", "500"))
+        # Start on the fallback for a while after this many primary failures in a row
+        self.failure_threshold = int(os.getenv("LLM_PRIMARY_FAILURE_THRESHOLD", "3"))
+        self.cooldown_s = float(os.getenv("LLM_PRIMARY_COOLDOWN_S", "30"))
+
+    @property
+    def model_name(self) -> str:
+        return self.primary_name
+
+    def bind_tools(self, tools, **kwargs) -> "ResilientChatModel":
+        """Bind tools to both models; the bound pair shares this model's latency stats."""
+        return ResilientChatModel(
+            self.primary.bind_tools(tools, **kwargs),
+            self.fallback.bind_tools(tools, **kwargs) if self.fallback is not None else None,
+            self.primary_name,
+            self.fallback_name,
+            scheduler=self.scheduler,
+            _shared=self._shared,
+        )
+
+    def _plan(self) -> List[tuple]:
+        """Models to try, in order, for one call."""
+        models = [(self.primary, self.primary_name)]
+        if self.fallback is not None:
+            models.append((self.fallback, self.fallback_name))
+            if time.monotonic() < self._shared["primary_down_until"]:
+                models.reverse()
+        return [models[attempt % len(models)] for attempt in range(self.max_attempts)]
+
+    def _timed_invoke(self, llm, name: str, input, kwargs, priority: int, settled: threading.Event):
+        if self.scheduler is None:
+            return self._request(llm, name, input, kwargs)
+        with self.scheduler.slot(priority):
+            if settled.is_set():
+                raise TimeoutError(f"{name} request no longer needed")  # Queued past its attempt
+            return self._request(llm, name, input, kwargs)
+
+    def _request(self, llm, name: str, input, kwargs):
+        started = time.perf_counter()
+        response = llm.invoke(input, **kwargs)
+        return response, (time.perf_counter() - started) * 1000, name
+
+    def _record(self, name: str, outcome: str, latency_ms: Optional[float] = None) -> None:
+        with self._shared["lock"]:
+            stats = self._shared["stats"][name]
+            stats.counters["attempts"] += 1
+            if outcome == "success":
+                stats.counters["successes"] += 1
+                stats.latencies_ms.append(latency_ms)
+                stats.consecutive_failures = 0
+                return
+            stats.counters["failures" if outcome == "failure" else "timeouts"] += 1
+            stats.consecutive_failures += 1
+            if name == self.primary_name and stats.consecutive_failures >= self.failure_threshold:
+                self._shared["primary_down_until"] = time.monotonic() + self.cooldown_s
+
+    def _attempt(self, llm, name: str, input, kwargs, timeout_s: float, priority: int = PRIORITY_INTERACTIVE):
+        """One attempt on one model, hedged if it runs past the model's recent p95."""
+        # Set once the attempt returns, so requests still queued for a slot never start
+        settled = threading.Event()
+        try:
+            return self._race(llm, name, input, kwargs, timeout_s, priority, settled)
+        finally:
+            settled.set()
+
+    def _race(self, llm, name: str, input, kwargs, timeout_s: float, priority: int, settled: threading.Event):
+        executor = self._shared["executor"]
+        started = time.monotonic()
+        pending = {executor.submit(self._timed_invoke, llm, name, input, kwargs, priority, settled)}
+        hedge_future = None
+        last_error: Optional[BaseException] = None
+
+        hedge_delay_s = None
+        if self.hedge_enabled:
+            with self._shared["lock"]:
+                p = self._shared["stats"][name].percentile(self.hedge_percentile)
+            if p is not None:
+                hedge_delay_s = max(p, self.hedge_min_ms) / 1000
+
+        while pending:
+            remaining = timeout_s - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            wait_s = remaining
+            if hedge_delay_s is not None and hedge_future is None:
+                wait_s = min(remaining, max(0.0, hedge_delay_s - (time.monotonic() - started)))
+            done, pending = wait(pending, timeout=wait_s, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response, latency_ms, _ = future.result()
+                except LLMOverloadedError:
+                    if future is hedge_future:
+                        continue  # No spare slot for the duplicate; the first request carries on
+                    raise  # Shed by the scheduler: not the model's fault, and retrying adds load
+                except Exception as e:
+                    last_error = e
+                    continue
+                self._record(name, "success", latency_ms)
+                if future is hedge_future:
+                    with self._shared["lock"]:
+                        self._shared["counters"]["hedge_wins"] += 1
+                return response
+            if not done and hedge_delay_s is not None and hedge_future is None:
+                # The first request is slower than usual: race a duplicate against it
+                hedge_future = executor.submit(self._timed_invoke, llm, name, input, kwargs, priority, settled)
+                pending.add(hedge_future)
+                with self._shared["lock"]:
+                    self._shared["counters"]["hedges"] += 1
+
+        if last_error is not None and not pending:
+            self._record(name, "failure")
+            raise last_error
+        # Requests still running are abandoned (keeping their slots); the client timeout ends them
+        self._record(name, "timeout")
+        raise TimeoutError(f"{name} did not answer within {timeout_s:.1f}s")
+
+    def invoke(self, input, priority: int = PRIORITY_INTERACTIVE, **kwargs):
+        """
+        Invoke with per-attempt timeouts, an overall deadline, retries and fallback.
+        priority is the scheduler priority of this call's requests.
+        """
+        with self._shared["lock"]:
+            self._shared["counters"]["calls"] += 1
+        deadline = time.monotonic() + self.deadline_s
+        last_error: Optional[BaseException] = None
+
+        for attempt, (llm, name) in enumerate(self._plan()):
+            if attempt:
+                # Full jitter so retries from concurrent chats do not land together
+                time.sleep(random.uniform(0, self.retry_base_ms * 2 ** (attempt - 1)) / 1000)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if attempt:
+                with self._shared["lock"]:
+                    self._shared["counters"]["retries"] += 1
+                    if name != self.primary_name:
+                        self._shared["counters"]["fallbacks"] += 1
+                print(f"🔁 Retrying LLM call on {name} (attempt {attempt + 1}) after: {last_error}")
+            try:
+                return self._attempt(llm, name, input, kwargs, min(self.attempt_timeout_s, remaining), priority)
+            except LLMOverloadedError:
+                raise
+            except Exception as e:
+                last_error = e
+
+        if last_error is None or isinstance(last_error, TimeoutError):
+            with self._shared["lock"]:
+                self._shared["counters"]["deadline_exceeded"] += 1
+            raise LLMDeadlineExceeded(f"No LLM answer within {self.deadline_s:.0f}s")
+        raise last_error
+
+    def get_metrics(self) -> Dict:
+        """Call counters plus per-model attempts and p50/p95 latency."""
+        with self._shared["lock"]:
+            metrics: Dict[str, Any] = dict(self._shared["counters"])
+            metrics["primary_in_cooldown"] = time.monotonic() < self._shared["primary_down_until"]
+            metrics["models"] = {
+                name: {
+                    **stats.counters,
+                    "p50_ms": stats.percentile(0.5),
+                    "p95_ms": stats.percentile(0.95),
+                }
+                for name, stats in self._shared["stats"].items()
+            }
+        metrics["hedge_enabled"] = self.hedge_enabled
+        return metrics
@@ -0,0 +1,122 @@
+"""
+Per-tenant retrieval configuration.
+
+Defaults come from the environment; a tenant (dashboard user) can override them
+with an ai-settings document {"type": "retrieval", "dashboard_user_id": ...}.
+"""
+import os
+import time
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from pymongo.database import Database
+
+from app.core.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_MODE_HYBRID = "hybrid"
+RETRIEVAL_MODE_DENSE = "dense"
+
+# Fields a tenant may override, with their types
+_CONFIG_FIELDS = {
+    "mode": str,
+    "candidate_multiplier": int,
+    "rrf_k": int,
+    "dense_weight": float,
+    "sparse_weight": float,
+}
+
+# Tenant of the chat being answered; set per request so the retrieval tool can read it
+current_tenant: ContextVar[Optional[str]] = ContextVar("current_tenant", default=None)
+# (query, embedding) computed once per chat turn, reused by retrieval when it searches the same query
+current_query_embedding: ContextVar[Optional[Tuple[str, List[float]]]] = ContextVar("current_query_embedding", default=None)
+
+
+class RetrievalConfigService:
+    """Resolves retrieval settings for a tenant, with a short in-process cache."""
+
+    def __init__(self, settings: Settings, db: Optional[Database] = None):
+        self.settings = settings
+        self.db = db
+        self.defaults: Dict = {
+            "mode": os.getenv("RETRIEVAL_MODE", RETRIEVAL_MODE_HYBRID),
+            # Candidates fetched from each retriever per requested result
+            "candidate_multiplier": int(os.getenv("RETRIEVAL_CANDIDATE_MULTIPLIER", "5")),
+            "rrf_k": int(os.getenv("RETRIEVAL_RRF_K", "60")),
+            "dense_weight": float(os.getenv("RETRIEVAL_DENSE_WEIGHT", "1.0")),
+            "sparse_weight": float(os.getenv("RETRIEVAL_SPARSE_WEIGHT", "1.0")),
+        }
+        self.cache_ttl = float(os.getenv("RETRIEVAL_CONFIG_TTL", "60"))
+        self._cache: Dict[Optional[str], Tuple[float, Dict]] = {}
+        self._lock = threading.Lock()
+
+    def _clean(self, overrides: Dict) -> Dict:
+        """Keep known fields and coerce them to their types."""
+        cleaned = {}
+        for field, field_type in _CONFIG_FIELDS.items():
+            if overrides.get(field) is not None:
+                try:
+                    cleaned[field] = field_type(overrides[field])
+                except (TypeError, ValueError):
+                    logger.warning(f"⚠️  Ignoring invalid retrieval setting {field}={overrides[field]!r}")
+        if cleaned.get("mode") not in (None, RETRIEVAL_MODE_HYBRID, RETRIEVAL_MODE_DENSE):
+            cleaned.pop("mode")
+        return cleaned
+
+    def get_config(self, dashboard_user_id: Optional[str] = None) -> Dict:
+        """Get the effective retrieval config for a tenant (or the defaults)."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(dashboard_user_id)
+            if cached and cached[0] > now:
+                return cached[1]
+
+        config = dict(self.defaults)
+        if self.db is not None and dashboard_user_id:
+            try:
+                doc = self.db["ai-settings"].find_one(
+                    {"type": "retrieval", "dashboard_user_id": dashboard_user_id},
+                    {"_id": 0, **{field: 1 for field in _CONFIG_FIELDS}},
+                )
+                if doc:
+                    config.update(self._clean(doc))
+            except Exception as e:
+                logger.warning(f"⚠️  Could not load retrieval config for {dashboard_user_id}: {e}")
+
+        with self._lock:
+            self._cache[dashboard_user_id] = (now + self.cache_ttl, config)
+        return config
+
+    def update_config(self, dashboard_user_id: str, overrides: Dict) -> Dict:
+        """Save a tenant's overrides and return the effective config."""
+        cleaned = self._clean(overrides)
+        if self.db is not None:
+            self.db["ai-settings"].update_one(
+                {"type": "retrieval", "dashboard_user_id": dashboard_user_id},
+                {"$set": cleaned},
+                upsert=True,
+            )
+        with self._lock:
+            self._cache.pop(dashboard_user_id, None)
+        return self.get_config(dashboard_user_id)
+
+
+# Global retrieval config service instance
+_retrieval_config_service: Optional[RetrievalConfigService] = None
+
+
+def init_retrieval_config_service(settings: Settings, db: Optional[Database] = None) -> RetrievalConfigService:
+    """Initialize retrieval config service."""
+    global _retrieval_config_service
+    _retrieval_config_service = RetrievalConfigService(settings, db)
+    return _retrieval_config_service
+
+
+def get_retrieval_config_service() -> RetrievalConfigService:
+    """Get retrieval config service instance."""
+    if not _retrieval_config_service:
+        raise Exception("Retrieval config service not initialized. Call init_retrieval_config_service() first.")
+    return _retrieval_config_service
@@ -0,0 +1,170 @@
+"""
+BM25 keyword index stored next to the FAISS index of each published version.
+
+Dense embeddings are poor at exact identifiers (product codes, SKUs, names), so
+retrieval fuses FAISS results with a keyword ranking from this index. Postings
+are written while a version is saved (bm25.sqlite in the version directory) and
+opened together with the FAISS index, so a search never builds anything; new
+documents are appended to a version's postings without rewriting them. Search
+returns docstore ids, which the caller resolves through the store's docstore,
+so no worker keeps the documents themselves in memory.
+"""
+import re
+import os
+import math
+import heapq
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+BM25_FILE = "bm25.sqlite"
+
+# Identifiers like "AB-1234", "v2.1" or "sku_99" are kept whole and also split into parts
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART = re.compile(r"[a-z0-9]+")
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS bm25_docs (doc_id TEXT PRIMARY KEY, length INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS bm25_postings ("
+    "token TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (token, doc_id)"
+    ") WITHOUT ROWID",
+)
+
+
+def bm25_tokenize(text: str) -> List[str]:
+    """Lowercase tokens for BM25, keeping compound identifiers and their parts."""
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if len(token) > 1 or token.isdigit():
+            tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in _PART.findall(token) if len(part) > 1)
+    return tokens
+
+
+def doc_key(doc: Document):
+    """Key shared by dense and sparse hits for the same stored document."""
+    return getattr(doc, "id", None) or id(doc)
+
+
+class BM25Writer:
+    """Writes (or appends to) the postings file of one index version."""
+
+    def __init__(self, path: Path, batch_size: int = 1000):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self._conn = sqlite3.connect(str(self.path))
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+        self._docs: List[Tuple[str, int]] = []
+        self._postings: List[Tuple[str, str, int]] = []
+        self.count = 0
+
+    def add(self, doc_id: str, doc: Document) -> None:
+        """Index one document (content plus title) under its docstore id."""
+        counts = Counter(bm25_tokenize(f"{doc.metadata.get('title', '')} {doc.page_content or ''}"))
+        if not counts:
+            return
+        self._docs.append((doc_id, sum(counts.values())))
+        self._postings.extend((token, doc_id, tf) for token, tf in counts.items())
+        self.count += 1
+        if len(self._docs) >= self.batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        self._conn.executemany("INSERT INTO bm25_docs VALUES (?, ?)", self._docs)
+        self._conn.executemany("INSERT INTO bm25_postings VALUES (?, ?, ?)", self._postings)
+        self._docs, self._postings = [], []
+
+    def close(self) -> None:
+        try:
+            self._flush()
+            self._conn.commit()
+        finally:
+            self._conn.close()
+
+
+def write_bm25_index(path: Path, documents: Iterable[Tuple[str, Document]]) -> int:
+    """Write a complete postings file for (docstore id, document) pairs atomically. Returns the count."""
+    path = Path(path)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    writer = BM25Writer(tmp)
+    try:
+        for doc_id, doc in documents:
+            writer.add(doc_id, doc)
+    finally:
+        writer.close()
+    os.replace(tmp, path)
+    return writer.count
+
+
+class BM25Index:
+    """Read-only Okapi BM25 search over one version's postings file."""
+
+    def __init__(self, path: Path, k1: float = 1.5, b: float = 0.75):
+        self.path = Path(path)
+        self.k1 = k1
+        self.b = b
+        self._conn = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        n_docs, total_len = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM bm25_docs").fetchone()
+        self._n_docs = n_docs
+        self._avg_len = total_len / n_docs if n_docs else 0.0
+
+    def __len__(self) -> int:
+        return self._n_docs
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Return the top k (docstore id, bm25_score) pairs for a query."""
+        tokens = set(bm25_tokenize(query))
+        if not tokens or not self._n_docs:
+            return []
+
+        scores: Dict[str, float] = defaultdict(float)
+        with self._lock:
+            for token in tokens:
+                postings = self._conn.execute(
+                    "SELECT p.tf, d.length, p.doc_id FROM bm25_postings p "
+                    "JOIN bm25_docs d ON d.doc_id = p.doc_id WHERE p.token = ?",
+                    (token,),
+                ).fetchall()
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (self._n_docs - df + 0.5) / (df + 0.5))
+                for tf, length, doc_id in postings:
+                    norm = self.k1 * (1 - self.b + self.b * length / self._avg_len)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_bm25_index(directory: Path) -> Optional[BM25Index]:
+    """Open a version's postings file, or None if the version has none."""
+    path = Path(directory) / BM25_FILE
+    return BM25Index(path) if path.exists() else None
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Document]],
+    weights: List[float],
+    rrf_k: int = 60
+) -> List[Tuple[Document, float]]:
+    """Fuse several ranked document lists: score = sum(weight / (rrf_k + rank))."""
+    fused: Dict = {}
+    for ranking, weight in zip(rankings, weights):
+        if weight <= 0:
+            continue
+        for rank, doc in enumerate(ranking, 1):
+            key = doc_key(doc)
+            entry = fused.setdefault(key, [doc, 0.0])
+            entry[1] += weight / (rrf_k + rank)
+    return sorted(((doc, score) for doc, score in fused.values()), key=lambda item: item[1], reverse=True)
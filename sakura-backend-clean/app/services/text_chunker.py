@@ -0,0 +1,290 @@
+"""
+Shared text chunking engine used by the website crawler and the file processor.
+
+Chunks are sized in tokens of the embedding model's own tokenizer (so nothing is
+silently truncated at embedding time) and are cut on sentence and heading
+boundaries instead of fixed word windows. Many documents can be chunked in one
+batch, which tokenizes every sentence of every document in a single call.
+"""
+import os
+import re
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from app.core.settings import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+# Sentence boundary: terminal punctuation followed by whitespace and an uppercase
+# letter, digit, quote or bracket. Deliberately conservative (no split on "e.g. foo").
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+(?=["\'(\[A-Z0-9])')
+_MARKDOWN_HEADING = re.compile(r'^\s{0,3}#{1,6}\s+\S')
+_NUMBERED_HEADING = re.compile(r'^\s*(\d+(\.\d+)*\.?|[IVXLC]+\.)\s+[A-Z]')
+
+# Rough wordpiece-per-word ratio used when the tokenizer cannot be loaded
+_TOKENS_PER_WORD = 1.3
+
+
+class _Unit:
+    """A sentence (or heading) with its token and word counts."""
+
+    __slots__ = ("text", "tokens", "words", "start_word", "is_heading", "section")
+
+    def __init__(self, text: str, tokens: int, words: int, start_word: int, is_heading: bool):
+        self.text = text
+        self.tokens = tokens
+        self.words = words
+        self.start_word = start_word
+        self.is_heading = is_heading
+        self.section: Optional[str] = None
+
+
+class _ChunkPacker:
+    """Greedily packs units into chunks under a token budget, carrying state across segments."""
+
+    def __init__(self, max_tokens: int, overlap_tokens: int, min_tokens: int):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = min_tokens
+        self.current: List[_Unit] = []
+        self.current_tokens = 0
+        self.heading: Optional[str] = None
+
+    def _emit(self) -> Dict:
+        first, last = self.current[0], self.current[-1]
+        start = first.start_word
+        end = last.start_word + last.words
+        return {
+            "id": f"chunk_{start}_{end}",
+            "start_word": start,
+            "end_word": end - 1,
+            "text": " ".join(unit.text for unit in self.current),
+            "token_count": self.current_tokens,
+            "heading": first.section,
+        }
+
+    def _reset(self, keep_overlap: bool) -> None:
+        tail: List[_Unit] = []
+        if keep_overlap and self.overlap_tokens > 0:
+            tail_tokens = 0
+            # Keep trailing sentences that fit in the overlap budget, never the whole chunk
+            for unit in reversed(self.current[1:]):
+                if tail_tokens + unit.tokens > self.overlap_tokens:
+                    break
+                tail.insert(0, unit)
+                tail_tokens += unit.tokens
+        self.current = tail
+        self.current_tokens = sum(unit.tokens for unit in tail)
+
+    def add(self, unit: _Unit) -> Iterator[Dict]:
+        if unit.is_heading and self.current and self.current_tokens >= self.min_tokens:
+            # New section: close the current chunk and don't bleed it into the next one
+            yield self._emit()
+            self._reset(keep_overlap=False)
+        if self.current and self.current_tokens + unit.tokens > self.max_tokens:
+            yield self._emit()
+            self._reset(keep_overlap=True)
+            if self.current_tokens + unit.tokens > self.max_tokens:
+                self._reset(keep_overlap=False)
+        if unit.is_heading:
+            self.heading = unit.text
+        unit.section = self.heading
+        self.current.append(unit)
+        self.current_tokens += unit.tokens
+
+    def finish(self) -> Iterator[Dict]:
+        if self.current:
+            yield self._emit()
+            self._reset(keep_overlap=False)
+
+
+class TextChunker:
+    """Token-aware, sentence- and heading-aware chunker."""
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        # Budgets are in embedding-model tokens (all-MiniLM-L6-v2 truncates at 256)
+        self.max_tokens = int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+        self.overlap_tokens = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+        # A heading only closes the current chunk once it holds at least this many tokens
+        self.min_tokens = int(os.getenv("CHUNK_MIN_TOKENS", "40"))
+        self._tokenizer = None
+        self._tokenizer_failed = False
+
+    # ---------- Tokenization ----------
+
+    def _get_tokenizer(self):
+        """Load the embedding model's fast tokenizer once; None if unavailable."""
+        if self._tokenizer is None and not self._tokenizer_failed:
+            try:
+                from transformers import AutoTokenizer
+                self._tokenizer = AutoTokenizer.from_pretrained(
+                    f"sentence-transformers/{self.settings.embedding_model}"
+                )
+                logger.info(f"✅ Loaded tokenizer for {self.settings.embedding_model}")
+            except Exception as e:
+                self._tokenizer_failed = True
+                logger.warning(f"⚠️  Could not load embedding tokenizer, estimating token counts: {e}")
+        return self._tokenizer
+
+    def count_tokens(self, texts: Sequence[str]) -> List[int]:
+        """Count embedding-model tokens for many texts in one batched call."""
+        if not texts:
+            return []
+        tokenizer = self._get_tokenizer()
+        if tokenizer is None:
+            return [max(1, int(len(text.split()) * _TOKENS_PER_WORD + 0.5)) for text in texts]
+        encoded = tokenizer(
+            list(texts),
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+            verbose=False,
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    # ---------- Splitting ----------
+
+    def _is_heading(self, line: str, headings: Optional[Set[str]]) -> bool:
+        if headings and line in headings:
+            return True
+        if _MARKDOWN_HEADING.match(line):
+            return True
+        words = line.split()
+        if not words or len(words) > 12 or line[-1] in ".!?,;:":
+            return False
+        if _NUMBERED_HEADING.match(line):
+            return True
+        letters = [c for c in line if c.isalpha()]
+        return len(letters) >= 3 and all(c.isupper() for c in letters)
+
+    def _heading_set(self, headings: Optional[Iterable[str]]) -> Optional[Set[str]]:
+        """Normalize known heading texts the same way lines are normalized."""
+        if not headings:
+            return None
+        return {" ".join(h.split()) for h in headings if h and h.strip()}
+
+    def split_units(self, text: str, headings: Optional[Set[str]] = None) -> List[Tuple[str, bool]]:
+        """Split text into (sentence, is_heading) units with normalized whitespace."""
+        units = []
+        for line in text.splitlines():
+            line = " ".join(line.split())
+            if not line:
+                continue
+            if self._is_heading(line, headings):
+                units.append((line.lstrip("# "), True))
+                continue
+            for sentence in _SENTENCE_BOUNDARY.split(line):
+                if sentence:
+                    units.append((sentence, False))
+        return units
+
+    def _split_oversized(self, text: str, tokens: int, max_tokens: int) -> List[Tuple[str, int]]:
+        """Split a unit longer than max_tokens into word windows of roughly max_tokens each."""
+        words = text.split()
+        per_piece = max(1, int(len(words) * max_tokens / tokens))
+        pieces = []
+        for i in range(0, len(words), per_piece):
+            piece_words = words[i:i + per_piece]
+            pieces.append((" ".join(piece_words), max(1, int(tokens * len(piece_words) / len(words)))))
+        return pieces
+
+    def _build_units(
+        self,
+        raw_units: List[Tuple[str, bool]],
+        counts: List[int],
+        max_tokens: int,
+        word_offset: int
+    ) -> Tuple[List[_Unit], int]:
+        """Attach token/word counts and global word offsets to raw units."""
+        units = []
+        for (text, is_heading), tokens in zip(raw_units, counts):
+            pieces = self._split_oversized(text, tokens, max_tokens) if tokens > max_tokens else [(text, tokens)]
+            for piece_text, piece_tokens in pieces:
+                words = len(piece_text.split())
+                units.append(_Unit(piece_text, piece_tokens, words, word_offset, is_heading))
+                word_offset += words
+        return units, word_offset
+
+    # ---------- Public API ----------
+
+    def iter_chunks(
+        self,
+        segments: Iterable[str],
+        max_tokens: Optional[int] = None,
+        overlap_tokens: Optional[int] = None,
+        headings: Optional[Iterable[str]] = None
+    ) -> Iterator[Dict]:
+        """
+        Chunk a stream of text segments (pages, row batches, ...) of one document.
+        Only the current segment and the chunk being built are held in memory.
+        """
+        max_tokens = max_tokens or self.max_tokens
+        overlap_tokens = self.overlap_tokens if overlap_tokens is None else overlap_tokens
+        heading_set = self._heading_set(headings)
+        packer = _ChunkPacker(max_tokens, overlap_tokens, self.min_tokens)
+        word_offset = 0
+        for segment in segments:
+            raw_units = self.split_units(segment, heading_set)
+            counts = self.count_tokens([text for text, _ in raw_units])
+            units, word_offset = self._build_units(raw_units, counts, max_tokens, word_offset)
+            for unit in units:
+                yield from packer.add(unit)
+        yield from packer.finish()
+
+    def chunk_text(
+        self,
+        text: str,
+        max_tokens: Optional[int] = None,
+        overlap_tokens: Optional[int] = None,
+        headings: Optional[Iterable[str]] = None
+    ) -> List[Dict]:
+        """Chunk a single document."""
+        return list(self.iter_chunks([text], max_tokens, overlap_tokens, headings))
+
+    def chunk_documents(
+        self,
+        texts: Sequence[str],
+        max_tokens: Optional[int] = None,
+        overlap_tokens: Optional[int] = None,
+        headings: Optional[Sequence[Optional[Iterable[str]]]] = None
+    ) -> List[List[Dict]]:
+        """
+        Chunk many documents at once. Every sentence of every document is
+        tokenized in a single batched tokenizer call.
+        """
+        max_tokens = max_tokens or self.max_tokens
+        overlap_tokens = self.overlap_tokens if overlap_tokens is None else overlap_tokens
+        headings = headings or [None] * len(texts)
+
+        per_doc_units = [
+            self.split_units(text, self._heading_set(doc_headings))
+            for text, doc_headings in zip(texts, headings)
+        ]
+        all_counts = self.count_tokens([text for units in per_doc_units for text, _ in units])
+
+        results = []
+        pos = 0
+        for raw_units in per_doc_units:
+            counts = all_counts[pos:pos + len(raw_units)]
+            pos += len(raw_units)
+            units, _ = self._build_units(raw_units, counts, max_tokens, 0)
+            packer = _ChunkPacker(max_tokens, overlap_tokens, self.min_tokens)
+            chunks = []
+            for unit in units:
+                chunks.extend(packer.add(unit))
+            chunks.extend(packer.finish())
+            results.append(chunks)
+        return results
+
+
+# Global chunker instance
+_text_chunker: Optional[TextChunker] = None
+
+
+def get_text_chunker() -> TextChunker:
+    """Get the shared text chunker, creating it on first use."""
+    global _text_chunker
+    if _text_chunker is None:
+        _text_chunker = TextChunker(get_settings())
+    return _text_chunker
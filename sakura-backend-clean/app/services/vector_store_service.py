@@ -2,13 +2,62 @@
 Real Vector Store service with FAISS.
 """
 import os
+import re
 import json
+import time
+import uuid
+import threading
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
 from app.core.settings import Settings
 from app.services.embeddings_service import EmbeddingsService
+from app.services.faiss_index_factory import (
+    INDEX_TYPE_FLAT,
+    FaissIndexConfig,
+    apply_search_params,
+    build_index,
+    describe_index,
+    recall_latency_report,
+)
+from app.services.sparse_index import BM25Index, doc_key, open_bm25_index, reciprocal_rank_fusion
+from app.services.index_persistence import (
+    copy_vector_store,
+    current_version,
+    ensure_bm25_index,
+    has_persisted_index,
+    load_vector_store,
+    load_version,
+    publish_appended_version,
+    publish_version,
+    version_dir,
+)
+from app.services.index_sync import notify_index_update
+
+_TOKEN = re.compile(r"\w+")
+
+
+def search_terms(text: str) -> str:
+    """
+    Normalized term string used for keyword post-filtering at query time:
+    the unique lowercase tokens longer than two characters, space-padded so
+    a term can be tested with ``f" {token} " in terms``.
+    """
+    tokens = {t for t in _TOKEN.findall(text.lower()) if len(t) > 2}
+    return f" {' '.join(sorted(tokens))} " if tokens else " "
+
+
+def add_search_terms(documents: Iterable[Document]) -> None:
+    """Precompute the search_terms metadata of documents that don't have it yet."""
+    for doc in documents:
+        metadata = doc.metadata
+        if "search_terms" not in metadata:
+            metadata["search_terms"] = search_terms(
+                f"{doc.page_content or ''} {metadata.get('source', '')} {metadata.get('title', '')}"
+            )
 
 
 class VectorStoreService:
@@ -17,32 +66,215 @@ class VectorStoreService:
     def __init__(self, settings: Settings, embeddings_service: EmbeddingsService):
         self.settings = settings
         self.embeddings_service = embeddings_service
-        self.vector_store: Optional[FAISS] = None
+        self._vector_store: Optional[FAISS] = None
+        # Published version the live store was opened from (None for unpublished stores)
+        self.index_version: Optional[str] = None
+        # BM25 postings of the live version, opened and swapped together with FAISS
+        self._sparse_index: Optional[BM25Index] = None
+        self._sparse_lock = threading.Lock()
+        # Serializes publishes and reloads; readers never take it
+        self._write_lock = threading.RLock()
+        self.index_config = FaissIndexConfig()
+        # Recall/latency report from the last rebuild (approximate indexes only)
+        self.index_report: Optional[Dict] = None
         
+    @property
+    def index_root(self) -> Path:
+        return Path(self.settings.faiss_index_path)
+    
+    @property
+    def vector_store(self) -> Optional[FAISS]:
+        return self._vector_store
+    
+    @vector_store.setter
+    def vector_store(self, store: Optional[FAISS]) -> None:
+        """Replace the live store without publishing it (in-process only)."""
+        self._swap(store, None)
+    
+    def _swap(self, store: Optional[FAISS], version: Optional[str], sparse_index: Optional[BM25Index] = None) -> None:
+        """Atomically replace the live snapshot; in-flight searches keep the one they started with."""
+        with self._sparse_lock:
+            self._vector_store = store
+            self.index_version = version
+            self._sparse_index = sparse_index
+    
+    def _snapshot(self) -> Tuple[Optional[FAISS], Optional[BM25Index]]:
+        """The live store and its BM25 index, taken together so they always match."""
+        with self._sparse_lock:
+            return self._vector_store, self._sparse_index
+    
+    @property
+    def sparse_index(self) -> Optional[BM25Index]:
+        """The live version's BM25 index (None for unpublished stores)."""
+        return self._snapshot()[1]
+    
+    def _open_version(self, version: str) -> Tuple[FAISS, Optional[BM25Index]]:
+        """Open a published version's FAISS index and BM25 postings."""
+        directory = version_dir(self.index_root, version)
+        store = load_version(self.index_root, version, self.embeddings_service.get_embeddings())
+        apply_search_params(store.index, self.index_config)
+        try:
+            # Versions published before postings were saved with them get them written once
+            ensure_bm25_index(directory)
+            sparse_index = open_bm25_index(directory)
+        except Exception as e:
+            print(f"⚠️ BM25 index unavailable for version {version}, hybrid search will use FAISS only: {e}")
+            sparse_index = None
+        return store, sparse_index
+    
+    def add_documents(self, documents: List[Document]) -> None:
+        """
+        Add documents and publish the result as a new version. The latest
+        published version (possibly newer than this worker's, if another worker
+        published meanwhile) is copied and appended to, so the cost does not
+        include reading its documents, and concurrent searches never see a
+        partial write. Pass every document of a batch in one call: each call
+        publishes once.
+        """
+        if not documents:
+            return
+        with self._write_lock:
+            base = self._vector_store
+            if base is None:
+                raise Exception("Vector store not initialized")
+            add_search_terms(documents)
+            if self.index_version is None:
+                # Unpublished in-memory store (startup fallback): small, copy it whole
+                store = copy_vector_store(base)
+                store.add_documents(documents)
+                self.publish(store)
+                return
+            embeddings = self.embeddings_service.get_embeddings()
+            vectors = np.asarray(embeddings.embed_documents([doc.page_content for doc in documents]), dtype=np.float32)
+            entries = [(doc.id or str(uuid.uuid4()), doc) for doc in documents]
+            version = publish_appended_version(self.index_root, entries, vectors)
+            self._serve(version)
+        notify_index_update(version)
+    
+    def publish(self, store: FAISS, notify: bool = True) -> str:
+        """
+        Save a store (with its BM25 postings) as a new index version, atomically
+        make it the live version, swap this worker onto it and tell the other
+        workers to reload.
+        """
+        with self._write_lock:
+            version = publish_version(store, self.index_root)
+            self._serve(version)
+        if notify:
+            notify_index_update(version)
+        return version
+    
+    def _serve(self, version: str) -> None:
+        """Swap this worker onto a version it just published."""
+        published, sparse_index = self._open_version(version)
+        self._swap(published, version, sparse_index)
+        print(f"✅ Serving vector index version {version} ({published.index.ntotal} vectors)")
+    
+    def reload_if_changed(self) -> bool:
+        """Open the live version if another worker published a newer one."""
+        version = current_version(self.index_root)
+        if not version or version == self.index_version:
+            return False
+        with self._write_lock:
+            if version == self.index_version:
+                return False
+            store, sparse_index = self._open_version(version)
+            self._swap(store, version, sparse_index)
+            print(f"🔄 Reloaded vector index version {version} ({store.index.ntotal} vectors)")
+            return True
+    
+    def build_vector_store(self, documents: List[Document]) -> FAISS:
+        """
+        Build a new FAISS store for documents. The index type (flat, HNSW, IVF-SQ8
+        or IVF-PQ) is chosen by corpus size; approximate indexes are trained on
+        the documents' vectors and get a recall/latency report.
+        """
+        add_search_terms(documents)
+        embeddings = self.embeddings_service.get_embeddings()
+        texts = [doc.page_content for doc in documents]
+        
+        started = time.perf_counter()
+        vectors = embeddings.encode(texts)
+        embed_seconds = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        index = build_index(vectors, self.index_config)
+        info = describe_index(index)
+        print(
+            f"🧮 Built {info['index_type']} index over {len(vectors)} vectors "
+            f"(embed {embed_seconds:.1f}s, index {time.perf_counter() - started:.1f}s)"
+        )
+        
+        if info["index_type"] != INDEX_TYPE_FLAT and self.index_config.report_enabled:
+            self.index_report = recall_latency_report(index, vectors, self.index_config)
+            print(f"📈 Index recall/latency sweep: {self.index_report['sweep']}")
+        else:
+            self.index_report = {**info, "sweep": []}
+        
+        ids = [str(uuid.uuid4()) for _ in documents]
+        docstore = InMemoryDocstore({
+            doc_id: Document(page_content=doc.page_content, metadata=doc.metadata, id=doc_id)
+            for doc_id, doc in zip(ids, documents)
+        })
+        return FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=dict(enumerate(ids)),
+        )
+    
+    def get_index_info(self) -> Dict:
+        """Describe the live index, with the last rebuild's recall/latency report."""
+        store = self._vector_store
+        if store is None:
+            return {"initialized": False}
+        return {
+            "initialized": True,
+            "version": self.index_version,
+            **describe_index(store.index),
+            "report": self.index_report,
+            "embeddings": self.embeddings_service.get_embeddings().get_stats(),
+        }
+    
     def initialize_vector_store(self) -> None:
         """Initialize FAISS vector store."""
         print("📚 Initializing FAISS vector store...")
         
         try:
             # Try to load existing index
-            faiss_path = Path(self.settings.faiss_index_path)
-            if faiss_path.exists():
-                print("📂 Loading existing FAISS index...")
-                self.vector_store = FAISS.load_local(
+            faiss_path = self.index_root
+            version = current_version(faiss_path)
+            if version:
+                print(f"📂 Opening memory-mapped FAISS index version {version}...")
+                store, sparse_index = self._open_version(version)
+                self._swap(store, version, sparse_index)
+                print(f"✅ Opened FAISS index with {store.index.ntotal} vectors")
+            elif has_persisted_index(faiss_path):
+                # Unversioned memory-mapped layout: publish it as the first version
+                print("📂 Migrating FAISS index to a versioned directory...")
+                store = load_vector_store(faiss_path, self.embeddings_service.get_embeddings())
+                self.publish(store, notify=False)
+            elif faiss_path.exists():
+                print("📂 Loading existing FAISS index (legacy pickle format)...")
+                store = FAISS.load_local(
                     str(faiss_path),
                     self.embeddings_service.get_embeddings(),
                     allow_dangerous_deserialization=True
                 )
-                print(f"✅ Loaded FAISS index with {self.vector_store.index.ntotal} vectors")
+                # Indexes saved before search_terms existed get them backfilled once here
+                add_search_terms(store.docstore._dict.values())
+                # Migrate so later starts memory-map the index instead of unpickling it
+                self.publish(store, notify=False)
+                print(f"✅ Loaded FAISS index with {store.index.ntotal} vectors")
             else:
                 print("🆕 Creating new FAISS index...")
                 # Create empty vector store
-                self.vector_store = FAISS.from_texts(
+                store = FAISS.from_texts(
                     ["Welcome to Sakura AI Assistant!"],
                     self.embeddings_service.get_embeddings()
                 )
                 # Save the index
-                self.vector_store.save_local(str(faiss_path))
+                self.publish(store, notify=False)
                 print("✅ Created new FAISS index")
                 
         except Exception as e:
@@ -56,35 +288,102 @@ class VectorStoreService:
     
     def similarity_search(self, query: str, top_k: int = 3) -> List[Document]:
         """Perform similarity search on the vector store."""
-        if self.vector_store is None:
+        store = self._vector_store
+        if store is None:
             print("❌ Vector store not initialized")
             return []
         
         try:
-            results = self.vector_store.similarity_search(query, k=top_k)
+            results = store.similarity_search(query, k=top_k)
             return results
         except Exception as e:
             print(f"❌ Error during similarity search: {e}")
             return []
     
-    def similarity_search_with_score(self, query: str, top_k: int = 3) -> List[tuple]:
+    def embed_query(self, query: str) -> List[float]:
         """
-        Perform similarity search with scores.
+        Embed a query once so several searches in the same request can share it
+        (served from the embedding engine's query cache when possible).
+        """
+        return self.embeddings_service.get_embeddings().embed_query(query)
+    
+    def similarity_search_with_score(
+        self,
+        query: str,
+        top_k: int = 3,
+        embedding: Optional[List[float]] = None
+    ) -> List[tuple]:
+        """
+        Perform similarity search with scores. Pass embedding (from embed_query)
+        to reuse a query vector that was already computed.
         
         Returns:
             List of tuples (Document, score) where score is the distance
         """
-        if self.vector_store is None:
+        return self._similarity_search_with_score(self._vector_store, query, top_k, embedding)
+    
+    def _similarity_search_with_score(
+        self,
+        store: Optional[FAISS],
+        query: str,
+        top_k: int,
+        embedding: Optional[List[float]] = None
+    ) -> List[tuple]:
+        if store is None:
             print("❌ Vector store not initialized")
             return []
         
         try:
-            results = self.vector_store.similarity_search_with_score(query, k=top_k)
+            if embedding is None:
+                embedding = self.embed_query(query)
+            results = store.similarity_search_with_score_by_vector(embedding, k=top_k)
             return results
         except Exception as e:
             print(f"❌ Error during similarity search with score: {e}")
             return []
     
+    def hybrid_search_with_score(
+        self,
+        query: str,
+        top_k: int = 3,
+        candidate_multiplier: int = 5,
+        rrf_k: int = 60,
+        dense_weight: float = 1.0,
+        sparse_weight: float = 1.0,
+        embedding: Optional[List[float]] = None
+    ) -> List[Tuple[Document, Optional[float]]]:
+        """
+        Dense + BM25 search fused with reciprocal rank fusion. Pass embedding
+        (from embed_query) to reuse a query vector that was already computed.
+        
+        Returns:
+            List of (Document, distance) tuples in fused rank order. distance is
+            the FAISS distance, or None for documents only the BM25 index found.
+        """
+        candidates = max(top_k, top_k * candidate_multiplier)
+        # Dense and sparse results must come from the same index version
+        store, sparse_index = self._snapshot()
+        dense = self._similarity_search_with_score(store, query, candidates, embedding) if dense_weight > 0 else []
+        sparse = []
+        if sparse_weight > 0 and sparse_index is not None:
+            try:
+                for doc_id, score in sparse_index.search(query, candidates):
+                    doc = store.docstore.search(doc_id)
+                    if isinstance(doc, Document):
+                        sparse.append((doc, score))
+            except Exception as e:
+                print(f"❌ Error during BM25 search: {e}")
+        if not sparse:
+            return [(doc, score) for doc, score in dense]
+        
+        distances = {doc_key(doc): score for doc, score in dense}
+        fused = reciprocal_rank_fusion(
+            [[doc for doc, _ in dense], [doc for doc, _ in sparse]],
+            [dense_weight, sparse_weight],
+            rrf_k,
+        )
+        return [(doc, distances.get(doc_key(doc))) for doc, _ in fused[:candidates]]
+    
     def get_vector_store(self) -> Optional[FAISS]:
         """Get the vector store instance."""
         return self.vector_store
@@ -5,16 +5,20 @@ Now stores chunks and metadata in MongoDB instead of JSONL files.
 import os
 import re
 import json
+import uuid
 import logging
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 from urllib.parse import urlparse, urljoin
 from datetime import datetime
 import requests
 from bs4 import BeautifulSoup
+from pymongo import ReturnDocument
 from pymongo.database import Database
 
 from app.core.settings import Settings
+from app.services.text_chunker import get_text_chunker
+from app.services.chunk_deduplicator import IngestDeduplicator
 
 
 logger = logging.getLogger(__name__)
@@ -34,9 +38,16 @@ class WebsiteCrawlerService:
         
         # Configuration
         self.max_pages = int(os.getenv("WEBSITE_MAX_PAGES", "50"))
-        self.chunk_size = int(os.getenv("WEBSITE_CHUNK_SIZE", "200"))
-        self.overlap = int(os.getenv("WEBSITE_CHUNK_OVERLAP", "50"))
+        # Chunk budgets are in embedding-model tokens
+        self.chunker = get_text_chunker()
+        self.chunk_size = int(os.getenv("WEBSITE_CHUNK_SIZE", str(self.chunker.max_tokens)))
+        self.overlap = int(os.getenv("WEBSITE_CHUNK_OVERLAP", str(self.chunker.overlap_tokens)))
         self.request_timeout = int(os.getenv("WEBSITE_REQUEST_TIMEOUT", "10"))
+        # Pages are chunked and written in small batches while the crawl is running
+        self.page_batch_size = int(os.getenv("WEBSITE_PAGE_BATCH", "10"))
+        self.insert_batch_size = int(os.getenv("WEBSITE_CHUNK_INSERT_BATCH", "500"))
+        # Drop repeated boilerplate blocks and (near-)duplicate chunks at ingest time
+        self.dedup_enabled = os.getenv("WEBSITE_DEDUP", "true").lower() == "true"
         
         # Initialize database indexes if database is available
         if self.db is not None:
@@ -63,6 +74,7 @@ class WebsiteCrawlerService:
             chunks_collection.create_index([("dashboard_user_id", 1), ("website_id", 1)])
             chunks_collection.create_index("source")
             chunks_collection.create_index([("website_id", 1), ("source", 1), ("chunk_index", 1)])
+            chunks_collection.create_index([("website_id", 1), ("generation", 1), ("source", 1), ("chunk_index", 1)])
             # Text index for full-text search on chunk text
             chunks_collection.create_index([("text", "text")])
             logger.info("✅ Created indexes on website-chunks collection")
@@ -119,34 +131,27 @@ class WebsiteCrawlerService:
         
         return clean_text, title, headings, links
     
-    def chunk_text(self, text: str, chunk_size: Optional[int] = None, overlap: Optional[int] = None) -> List[Dict]:
-        """Split text into overlapping word chunks."""
+    def chunk_text(
+        self,
+        text: str,
+        chunk_size: Optional[int] = None,
+        overlap: Optional[int] = None,
+        headings: Optional[List[str]] = None
+    ) -> List[Dict]:
+        """Split text into token-budgeted chunks aligned to sentences and page headings."""
         chunk_size = chunk_size or self.chunk_size
-        overlap = overlap or self.overlap
-        
-        words = re.findall(r"\S+", text)
-        chunks = []
-        i = 0
-        while i < len(words):
-            start = i
-            end = min(i + chunk_size, len(words))
-            chunk_words = words[start:end]
-            chunk_text = " ".join(chunk_words)
-            chunks.append({
-                "id": f"chunk_{start}_{end}",
-                "start_word": start,
-                "end_word": end - 1,
-                "text": chunk_text
-            })
-            i = i + chunk_size - overlap
-        return chunks
+        overlap = self.overlap if overlap is None else overlap
+        return self.chunker.chunk_text(text, chunk_size, overlap, headings=headings)
     
     def download_website(self, base_url: str, limit: Optional[int] = None) -> Dict[str, str]:
         """Fetch and store HTML pages from a website (basic internal crawler)."""
+        return dict(self.iter_website_pages(base_url, limit))
+    
+    def iter_website_pages(self, base_url: str, limit: Optional[int] = None) -> Iterator[Tuple[str, str]]:
+        """Crawl a website, yielding (url, html) for each page as soon as it is fetched."""
         limit = limit or self.max_pages
         visited = set()
         to_visit = [base_url]
-        html_files = {}
         
         while to_visit and len(visited) < limit:
             url = to_visit.pop(0)
@@ -172,7 +177,7 @@ class WebsiteCrawlerService:
                 if 'html' not in content_type:
                     continue
                 
-                html_files[url] = resp.text
+                yield url, resp.text
                 
                 # Extract links for further crawling
                 soup = BeautifulSoup(resp.text, "html.parser")
@@ -190,8 +195,6 @@ class WebsiteCrawlerService:
             except Exception as e:
                 logger.warning(f"Error fetching {url}: {e}")
                 continue
-        
-        return html_files
     
     def process_website(self, url: str, website_id: Optional[str] = None, dashboard_user_id: Optional[str] = None) -> Dict:
         """Download and process a live website, storing chunks in MongoDB."""
@@ -250,17 +253,21 @@ class WebsiteCrawlerService:
                     "error": None
                 }
         
-        # Update status to processing
+        # Update status to processing, remembering which generation readers see now
+        previous_generation = None
         if self.db is not None:
-            websites_collection.update_one(
+            before = websites_collection.find_one_and_update(
                 {"website_id": website_id},
                 {
                     "$set": {
                         "status": "processing",
                         "last_updated": now
                     }
-                }
+                },
+                projection={"active_generation": 1},
+                return_document=ReturnDocument.BEFORE
             )
+            previous_generation = before.get("active_generation") if before else None
         else:
             self.websites_metadata[website_id].update({
                 "status": "processing",
@@ -268,91 +275,69 @@ class WebsiteCrawlerService:
             })
             self._save_metadata()
         
+        # Chunks of this crawl are written under a new generation while readers keep
+        # seeing the previous one; the website's active_generation is flipped at the end
+        generation = uuid.uuid4().hex
+        
         try:
-            # Download pages
             logger.info(f"Starting crawl for {url}...")
-            pages = self.download_website(url, self.max_pages)
-            
-            if not pages:
-                raise Exception("No pages could be fetched from the website")
-            
+            pages_count = 0
             total_chunks = 0
-            all_chunks = []  # Collect all chunks for bulk insert
+            page_batch = []
+            chunk_buffer = []
+            dedup = IngestDeduplicator() if self.dedup_enabled else None
             
-            # Process each page
-            for page_url, html_content in pages.items():
-                logger.info(f"Processing page: {page_url}")
-                text, title, headings, links = self.extract_content_from_html(html_content)
-                chunks = self.chunk_text(text, self.chunk_size, self.overlap)
-                
-                # Prepare chunks for database storage
-                for i, chunk in enumerate(chunks):
-                    chunk_doc = {
-                        "website_id": website_id,
-                        "dashboard_user_id": dashboard_user_id,
-                        "source": page_url,
-                        "page_title": title,
-                        "chunk_index": i,
-                        "chunk_id": chunk["id"],
-                        "start_word": chunk["start_word"],
-                        "end_word": chunk["end_word"],
-                        "text": chunk["text"],
-                        "headings": headings,
-                        "links": links,
-                        "domain": domain_name,
-                        "created_at": now
-                    }
-                    all_chunks.append(chunk_doc)
-                
-                total_chunks += len(chunks)
-                logger.info(f"Prepared {len(chunks)} chunks from page: {page_url}")
+            for page_url, html_content in self.iter_website_pages(url, self.max_pages):
+                pages_count += 1
+                page_batch.append((page_url, html_content))
+                if len(page_batch) >= self.page_batch_size:
+                    total_chunks += self._chunk_page_batch(page_batch, chunk_buffer, website_id, dashboard_user_id, domain_name, generation, now, dedup)
+                    page_batch = []
+                    if len(chunk_buffer) >= self.insert_batch_size:
+                        self._write_chunk_batch(chunk_buffer, domain_name)
+                        chunk_buffer = []
             
-            # Store chunks in MongoDB (bulk insert for efficiency)
-            if self.db is not None and all_chunks:
-                chunks_collection = self.db["website-chunks"]
-                # Delete existing chunks for this website first (in case of re-processing)
-                chunks_collection.delete_many({"website_id": website_id})
-                # Bulk insert all chunks
-                chunks_collection.insert_many(all_chunks)
-                logger.info(f"✅ Stored {len(all_chunks)} chunks in MongoDB for website {website_id}")
+            if page_batch:
+                total_chunks += self._chunk_page_batch(page_batch, chunk_buffer, website_id, dashboard_user_id, domain_name, generation, now, dedup)
+            if chunk_buffer:
+                self._write_chunk_batch(chunk_buffer, domain_name)
             
-            # Fallback: Also save to JSONL files for backward compatibility (if no DB)
-            if self.db is None:
-                out_dir = self.websites_data_dir / domain_name
-                out_dir.mkdir(parents=True, exist_ok=True)
-                for chunk_doc in all_chunks:
-                    safe_name = self.safe_stem(urlparse(chunk_doc["source"]).path or "index")
-                    out_file = out_dir / f"{safe_name}_chunks.jsonl"
-                    with open(out_file, "a", encoding="utf-8") as f:
-                        # Convert to JSONL format
-                        jsonl_chunk = {
-                            "id": chunk_doc["chunk_id"],
-                            "start_word": chunk_doc["start_word"],
-                            "end_word": chunk_doc["end_word"],
-                            "text": chunk_doc["text"],
-                            "source": chunk_doc["source"],
-                            "chunk_index": chunk_doc["chunk_index"],
-                            "title": chunk_doc["page_title"],
-                            "headings": chunk_doc["headings"],
-                            "links": chunk_doc["links"],
-                            "website_id": chunk_doc["website_id"],
-                            "domain": chunk_doc["domain"]
-                        }
-                        f.write(json.dumps(jsonl_chunk, ensure_ascii=False) + "\n")
+            if pages_count == 0:
+                raise Exception("No pages could be fetched from the website")
             
-            # Update metadata with success
+            dedup_stats = dedup.stats() if dedup else {}
+            if dedup:
+                logger.info(f"🧹 Deduplication for website {website_id}: {dedup_stats}")
             if self.db is not None:
-                websites_collection.update_one(
-                    {"website_id": website_id},
+                logger.info(f"✅ Stored {total_chunks} chunks in MongoDB for website {website_id} (generation {generation})")
+            
+            # Update metadata with success and atomically switch readers to the new generation,
+            # but only if no concurrent crawl of this website has flipped it in the meantime
+            if self.db is not None:
+                flipped = websites_collection.find_one_and_update(
+                    # None matches websites (and chunks) from before generations existed
+                    {"website_id": website_id, "active_generation": previous_generation},
                     {
                         "$set": {
                             "status": "completed",
-                            "pages_extracted": len(pages),
+                            "pages_extracted": pages_count,
                             "total_chunks": total_chunks,
+                            "active_generation": generation,
+                            "dedup_stats": dedup_stats,
                             "last_updated": datetime.now()
                         }
                     }
                 )
+                if flipped is not None:
+                    # Only the generation this crawl replaced is no longer visible; drop it.
+                    # Generations of crawls still in progress are left alone.
+                    self.db["website-chunks"].delete_many(
+                        {"website_id": website_id, "generation": previous_generation}
+                    )
+                else:
+                    # A concurrent crawl published first and owns the active generation
+                    logger.warning(f"⚠️ Crawl of website {website_id} was superseded by a concurrent crawl; discarding generation {generation}")
+                    self.db["website-chunks"].delete_many({"website_id": website_id, "generation": generation})
                 # Return updated website document
                 updated = websites_collection.find_one({"website_id": website_id})
                 return {
@@ -371,7 +356,7 @@ class WebsiteCrawlerService:
                 # Fallback to file-based metadata
                 self.websites_metadata[website_id].update({
                     "status": "completed",
-                    "pagesExtracted": len(pages),
+                    "pagesExtracted": pages_count,
                     "totalChunks": total_chunks,
                     "lastUpdated": datetime.now().isoformat()
                 })
@@ -384,6 +369,8 @@ class WebsiteCrawlerService:
             
             # Update metadata with error
             if self.db is not None:
+                # Discard the partial generation; readers still see the previous one
+                self.db["website-chunks"].delete_many({"website_id": website_id, "generation": generation})
                 websites_collection = self.db.websites
                 websites_collection.update_one(
                     {"website_id": website_id},
@@ -405,6 +392,102 @@ class WebsiteCrawlerService:
             
             raise
     
+    def _chunk_page_batch(
+        self,
+        page_batch: List[Tuple[str, str]],
+        chunk_buffer: List[Dict],
+        website_id: str,
+        dashboard_user_id: Optional[str],
+        domain_name: str,
+        generation: str,
+        now: datetime,
+        dedup: Optional[IngestDeduplicator] = None
+    ) -> int:
+        """Extract and chunk a batch of pages, appending chunk documents to chunk_buffer."""
+        extracted = []
+        for page_url, html_content in page_batch:
+            logger.info(f"Processing page: {page_url}")
+            text, title, headings, links = self.extract_content_from_html(html_content)
+            if dedup:
+                # extract_content_from_html puts one visible line per block
+                text = "\n\n".join(dedup.filter_boilerplate(text.split("\n\n")))
+            extracted.append((page_url, title, headings, links, text))
+        
+        # One tokenizer call for the whole batch of pages
+        chunks_per_page = self.chunker.chunk_documents(
+            [text for _, _, _, _, text in extracted],
+            self.chunk_size,
+            self.overlap,
+            headings=[headings for _, _, headings, _, _ in extracted]
+        )
+        
+        count = 0
+        for (page_url, title, headings, links, _), chunks in zip(extracted, chunks_per_page):
+            kept = 0
+            for i, chunk in enumerate(chunks):
+                # chunk_index keeps the original position so gaps mark removed duplicates
+                if dedup and dedup.is_duplicate(chunk["text"]):
+                    continue
+                kept += 1
+                chunk_buffer.append({
+                    "website_id": website_id,
+                    "dashboard_user_id": dashboard_user_id,
+                    "generation": generation,
+                    "source": page_url,
+                    "page_title": title,
+                    "chunk_index": i,
+                    "chunk_id": chunk["id"],
+                    "start_word": chunk["start_word"],
+                    "end_word": chunk["end_word"],
+                    "text": chunk["text"],
+                    "headings": headings,
+                    "links": links,
+                    "domain": domain_name,
+                    "created_at": now
+                })
+            count += kept
+            logger.info(f"Prepared {kept} chunks from page: {page_url} ({len(chunks) - kept} duplicates skipped)")
+        return count
+    
+    def _write_chunk_batch(self, chunk_docs: List[Dict], domain_name: str) -> None:
+        """Write a batch of chunk documents to MongoDB (unordered bulk insert) or JSONL files."""
+        if self.db is not None:
+            # ordered=False lets the server apply the batch in parallel and not stop at the first error
+            self.db["website-chunks"].insert_many(chunk_docs, ordered=False)
+            return
+        
+        # Fallback: save to JSONL files for backward compatibility (if no DB)
+        out_dir = self.websites_data_dir / domain_name
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for chunk_doc in chunk_docs:
+            safe_name = self.safe_stem(urlparse(chunk_doc["source"]).path or "index")
+            out_file = out_dir / f"{safe_name}_chunks.jsonl"
+            with open(out_file, "a", encoding="utf-8") as f:
+                # Convert to JSONL format
+                jsonl_chunk = {
+                    "id": chunk_doc["chunk_id"],
+                    "start_word": chunk_doc["start_word"],
+                    "end_word": chunk_doc["end_word"],
+                    "text": chunk_doc["text"],
+                    "source": chunk_doc["source"],
+                    "chunk_index": chunk_doc["chunk_index"],
+                    "title": chunk_doc["page_title"],
+                    "headings": chunk_doc["headings"],
+                    "links": chunk_doc["links"],
+                    "website_id": chunk_doc["website_id"],
+                    "domain": chunk_doc["domain"]
+                }
+                f.write(json.dumps(jsonl_chunk, ensure_ascii=False) + "\n")
+    
+    def _active_chunks_query(self, website_id: str) -> Dict:
+        """Query matching only the chunks of the website's active crawl generation."""
+        website = self.db.websites.find_one({"website_id": website_id}, {"active_generation": 1})
+        generation = website.get("active_generation") if website else None
+        if generation:
+            return {"website_id": website_id, "generation": generation}
+        # Chunks stored before generations existed
+        return {"website_id": website_id, "generation": {"$exists": False}}
+    
     def get_website(self, website_id: str) -> Optional[Dict]:
         """Get website metadata by ID from database or file-based storage."""
         if self.db is not None:
@@ -497,31 +580,65 @@ class WebsiteCrawlerService:
             
             return True
     
+    @staticmethod
+    def _chunk_to_dict(chunk: Dict) -> Dict:
+        """Convert a website-chunks document to the chunk dict format used by callers."""
+        return {
+            "id": chunk.get("chunk_id", ""),
+            "start_word": chunk.get("start_word", 0),
+            "end_word": chunk.get("end_word", 0),
+            "text": chunk.get("text", ""),
+            "source": chunk.get("source", ""),
+            "chunk_index": chunk.get("chunk_index", 0),
+            "title": chunk.get("page_title", ""),
+            "headings": chunk.get("headings", []),
+            "links": chunk.get("links", []),
+            "website_id": chunk.get("website_id", ""),
+            "domain": chunk.get("domain", "")
+        }
+    
+    def iter_chunks_for_websites(self, website_ids: List[str]) -> Iterator[Dict]:
+        """
+        Stream the active-generation chunks of several websites: one query for
+        their generations and one cursor over all their chunks.
+        """
+        website_ids = list(website_ids)
+        if not website_ids:
+            return
+        if self.db is None:
+            for website_id in website_ids:
+                yield from self.get_website_chunks(website_id)
+            return
+        
+        generations = {
+            website["website_id"]: website.get("active_generation")
+            for website in self.db.websites.find(
+                {"website_id": {"$in": website_ids}}, {"website_id": 1, "active_generation": 1}
+            )
+        }
+        clauses = [
+            {"website_id": website_id, "generation": generations[website_id]}
+            if generations.get(website_id)
+            # Chunks stored before generations existed
+            else {"website_id": website_id, "generation": {"$exists": False}}
+            for website_id in website_ids
+        ]
+        cursor = self.db["website-chunks"].find({"$or": clauses}).sort(
+            [("website_id", 1), ("source", 1), ("chunk_index", 1)]
+        )
+        for chunk in cursor:
+            yield self._chunk_to_dict(chunk)
+    
     def get_website_chunks(self, website_id: str) -> List[Dict]:
         """Get all chunks for a website from database or file system."""
         if self.db is not None:
             chunks_collection = self.db["website-chunks"]
-            chunks = list(chunks_collection.find(
-                {"website_id": website_id}
-            ).sort("source", 1).sort("chunk_index", 1))
+            chunks = chunks_collection.find(
+                self._active_chunks_query(website_id)
+            ).sort("source", 1).sort("chunk_index", 1)
             
             # Convert MongoDB documents to dict format (compatible with existing code)
-            result = []
-            for chunk in chunks:
-                result.append({
-                    "id": chunk.get("chunk_id", ""),
-                    "start_word": chunk.get("start_word", 0),
-                    "end_word": chunk.get("end_word", 0),
-                    "text": chunk.get("text", ""),
-                    "source": chunk.get("source", ""),
-                    "chunk_index": chunk.get("chunk_index", 0),
-                    "title": chunk.get("page_title", ""),
-                    "headings": chunk.get("headings", []),
-                    "links": chunk.get("links", []),
-                    "website_id": chunk.get("website_id", ""),
-                    "domain": chunk.get("domain", "")
-                })
-            return result
+            return [self._chunk_to_dict(chunk) for chunk in chunks]
         
         # Fallback to file-based retrieval
         website = self.get_website(website_id)
@@ -0,0 +1,182 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from app.services import aop_runtime
+from app.services.aop_runtime import AOPRuntime, AOPStateStore, register_aop_action
+from app.services.chat_flags_cache import init_chat_flags_cache
+
+
+class _Result:
+    def __init__(self, matched_count):
+        self.matched_count = matched_count
+
+
+class _Collection:
+    """Just enough of a pymongo collection for the AOP handlers."""
+
+    def __init__(self, docs=None):
+        self.docs = list(docs or [])
+
+    def find_one(self, query, projection=None):
+        return next((dict(doc) for doc in self.docs if all(doc.get(k) == v for k, v in query.items())), None)
+
+    def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if all(doc.get(k) == v for k, v in query.items()):
+                doc.update(update.get("$set", {}))
+                return _Result(1)
+        return _Result(0)
+
+
+class _DB(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+
+@pytest.fixture
+def db():
+    return _DB({
+        "bookings": _Collection([
+            {"booking_reference": "ABC123", "status": "Confirmed", "ticket_class": "economy", "fare_type": "flex",
+             "fare_paid": 420, "customer_email": "ana@example.com"},
+            {"booking_reference": "XYZ789", "status": "Confirmed", "customer_email": "someone.else@example.com"},
+        ]),
+        "customers": _Collection([{"_id": "cust-1", "email": "Ana@Example.com"}]),
+        "customer-chats": _Collection([{"chat_id": "chat-1", "user_id": "cust-1", "ai_agent_enabled": True}]),
+    })
+
+
+@pytest.fixture(autouse=True)
+def _flags_cache():
+    return init_chat_flags_cache()
+
+
+@pytest.fixture(autouse=True)
+def _no_broadcast(monkeypatch):
+    announced = []
+    monkeypatch.setattr(aop_runtime, "notify_chat_flags_update", announced.append)
+    return announced
+
+
+class _Store(AOPStateStore):
+    """In-memory state with the test database handed to action handlers."""
+
+    def __init__(self, db):
+        super().__init__(None)
+        self.db = db
+
+    def get_state(self, chat_id):
+        return dict(self._memory.get(chat_id, {}))
+
+    def set_chat_state(self, chat_id, state):
+        self._memory[chat_id] = dict(state)
+
+
+def _runtime(*aops):
+    runtime = AOPRuntime()
+    runtime.load(list(aops))
+    return runtime
+
+
+def _aop(*steps):
+    return {"aop_name": "Test", "steps": list(steps)}
+
+
+_ESCALATE = {"id": "escalate_to_human", "type": "action", "action": "escalate_ticket_to_agent",
+             "success_next": "close_case", "user_prompt": "Handing you over to an agent."}
+_CLOSE = {"id": "close_case", "type": "action", "action": "log_case_closure", "user_prompt": "Case closed."}
+
+
+def test_action_without_handler_takes_escalation_and_disables_ai(db, _no_broadcast, _flags_cache):
+    assert _flags_cache.get_flags(db, "chat-1")["ai_agent_enabled"] is True
+    runtime = _runtime(_aop(
+        {"id": "refund", "type": "action", "action": "no_such_action", "success_next": "close_case",
+         "user_prompt": "Your refund has been issued."},
+        _ESCALATE,
+        _CLOSE,
+    ))
+    result = runtime.run("Test", "refund please", "chat-1", _Store(db))
+    assert "refund has been issued" not in result["response"]
+    assert "Handing you over to an agent." in result["response"]
+    assert result["completed"] is True
+    assert db["customer-chats"].docs[0]["ai_agent_enabled"] is False
+    assert _no_broadcast == ["chat-1"]
+    assert _flags_cache.get_flags(db, "chat-1")["ai_agent_enabled"] is False
+
+
+def test_missing_handlers_are_reported_at_compile_time():
+    runtime = _runtime(_aop({"id": "a", "type": "action", "action": "no_such_action"}))
+    assert runtime._compiled["Test"].missing_actions == ["no_such_action"]
+
+
+def test_failing_escalation_ends_the_run_instead_of_looping():
+    runtime = _runtime(_aop(
+        {"id": "step", "type": "action", "action": "no_such_action", "success_next": None},
+        _ESCALATE,
+        _CLOSE,
+    ))
+    # No database: escalation cannot hand over either
+    result = runtime.run("Test", "hi", "chat-1", AOPStateStore(None))
+    assert result["completed"] is True
+    assert result["response"] == aop_runtime.UNAVAILABLE_MESSAGE
+
+
+def test_input_step_waits_then_decision_branches_on_variables(db):
+    @register_aop_action("test_lookup")
+    def _lookup(variables, step, database, chat_id):
+        return True, {"status": "open" if variables["code"] == "OPEN1234" else "closed"}
+
+    runtime = _runtime(_aop(
+        {"id": "ask", "type": "action", "action": "test_lookup", "requires_response": True, "params": ["code"],
+         "expected_input": "booking reference", "user_prompt": "What is your reference?", "success_next": "route"},
+        {"id": "route", "type": "decision", "decision_logic": [
+            {"condition": "status == 'open'", "next": "done_open"},
+            {"condition": "status == 'closed'", "next": "done_closed"},
+        ]},
+        {"id": "done_open", "type": "action", "user_prompt": "It is open."},
+        {"id": "done_closed", "type": "action", "user_prompt": "It is closed."},
+    ))
+    store = _Store(db)
+    first = runtime.run("Test", "hello", "chat-1", store)
+    assert first == {"response": "What is your reference?", "completed": False}
+    second = runtime.run("Test", "it's OPEN1234", "chat-1", store)
+    assert second["completed"] is True
+    assert second["response"].endswith("It is open.")
+
+
+def test_invalid_replies_retry_then_fail_over(db):
+    runtime = _runtime(_aop(
+        {"id": "ask", "type": "action", "requires_response": True, "expected_input": "yes or no",
+         "user_prompt": "Continue?", "success_next": None},
+        _ESCALATE,
+        _CLOSE,
+    ))
+    store = _Store(db)
+    runtime.run("Test", "start", "chat-1", store)
+    for _ in range(aop_runtime.MAX_INPUT_ATTEMPTS - 1):
+        assert "Sorry" in runtime.run("Test", "banana", "chat-1", store)["response"]
+    result = runtime.run("Test", "banana", "chat-1", store)
+    assert "Handing you over to an agent." in result["response"]
+
+
+def test_identity_requires_the_chats_customer_to_own_the_booking(db):
+    verify = aop_runtime._action_handlers["verify_customer_identity"]
+    ok, updates = verify({"booking_reference": "abc123"}, {}, db, "chat-1")
+    assert ok is True
+    assert updates["booking_status"] == "confirmed" and updates["fare_paid"] == 420
+
+    assert verify({"booking_reference": "XYZ789"}, {}, db, "chat-1") == (False, {})
+    assert verify({"booking_reference": "NOPE999"}, {}, db, "chat-1") == (False, {})
+    assert verify({"booking_reference": "ABC123"}, {}, db, "unknown-chat") == (False, {})
+
+
+def test_bundled_cancel_aop_never_claims_an_unperformed_cancellation(db):
+    aops = json.loads((Path(aop_runtime.__file__).parents[1] / "data" / "aops.json").read_text())
+    aops = aops if isinstance(aops, list) else aops.get("aops", aops)
+    runtime = _runtime(*aops)
+    result = runtime.run("Cancel Flight Ticket", "I want to cancel ABC123", "chat-1", _Store(db))
+    assert "cancelled successfully" not in result["response"]
+    assert "human support agent" in result["response"]
+    assert db["customer-chats"].docs[0]["ai_agent_enabled"] is False
@@ -0,0 +1,80 @@
+from app.services.chat_flags_cache import ChatFlagsCache
+
+
+class _Collection:
+    def __init__(self, doc, on_read=None):
+        self.doc = doc
+        self.on_read = on_read
+        self.reads = 0
+
+    def find_one(self, query, projection=None):
+        self.reads += 1
+        doc = dict(self.doc) if self.doc is not None else None
+        if self.on_read is not None:
+            # Runs after the value was read, as a toggle landing mid-fetch would
+            on_read, self.on_read = self.on_read, None
+            on_read()
+        return doc
+
+
+def _db(collection):
+    return {"customer-chats": collection}
+
+
+def test_miss_is_cached_and_hit():
+    chats = _Collection({"ai_agent_enabled": True, "dashboard_user_id": "u1"})
+    cache = ChatFlagsCache()
+
+    assert cache.get_flags(_db(chats), "c1") == {"ai_agent_enabled": True, "dashboard_user_id": "u1"}
+    assert cache.get_flags(_db(chats), "c1")["dashboard_user_id"] == "u1"
+    assert chats.reads == 1
+    assert cache.get_metrics()["hits"] == 1
+
+
+def test_missing_chat_is_not_cached():
+    chats = _Collection(None)
+    cache = ChatFlagsCache()
+
+    assert cache.get_flags(_db(chats), "c1") is None
+    assert cache.get_flags(_db(chats), "c1") is None
+    assert chats.reads == 2
+
+
+def test_toggle_updates_cached_entry():
+    chats = _Collection({"ai_agent_enabled": True, "dashboard_user_id": "u1"})
+    cache = ChatFlagsCache()
+    cache.get_flags(_db(chats), "c1")
+
+    cache.set_ai_agent_enabled("c1", False)
+
+    assert cache.get_flags(_db(chats), "c1")["ai_agent_enabled"] is False
+    assert chats.reads == 1
+
+
+def test_read_started_before_invalidate_is_not_stored():
+    cache = ChatFlagsCache()
+    chats = _Collection({"ai_agent_enabled": True, "dashboard_user_id": "u1"})
+    chats.on_read = lambda: cache.invalidate("c1")
+
+    # The slow read still answers its own caller...
+    assert cache.get_flags(_db(chats), "c1")["ai_agent_enabled"] is True
+    # ...but does not leave its value behind for the next one
+    chats.doc["ai_agent_enabled"] = False
+    assert cache.get_flags(_db(chats), "c1")["ai_agent_enabled"] is False
+    assert chats.reads == 2
+
+
+def test_read_started_before_toggle_does_not_overwrite_it():
+    cache = ChatFlagsCache()
+    chats = _Collection({"ai_agent_enabled": True, "dashboard_user_id": "u1"})
+    cache.get_flags(_db(chats), "c1")
+    cache.invalidate("c1")
+
+    def toggle():
+        cache.get_flags(_db(_Collection({"ai_agent_enabled": True, "dashboard_user_id": "u1"})), "c1")
+        cache.set_ai_agent_enabled("c1", False)
+
+    chats.on_read = toggle
+    cache.get_flags(_db(chats), "c1")
+
+    assert cache.get_flags(_db(chats), "c1")["ai_agent_enabled"] is False
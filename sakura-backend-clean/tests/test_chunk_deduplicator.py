@@ -0,0 +1,87 @@
+import random
+
+from app.services.chunk_deduplicator import IngestDeduplicator, normalize_text, simhash
+
+
+def _flip_bits(value: int, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def test_normalize_text_ignores_case_punctuation_and_whitespace():
+    assert normalize_text("Hello,   World!\n") == normalize_text("hello world")
+
+
+def test_exact_duplicate_is_dropped():
+    dedup = IngestDeduplicator(max_hamming_distance=6, boilerplate_min_pages=0)
+    assert dedup.is_duplicate("Our office opens at 9am on weekdays.") is False
+    assert dedup.is_duplicate("our office opens at 9AM on weekdays") is True
+    assert dedup.stats()["exact_duplicates"] == 1
+
+
+def test_unrelated_chunks_are_kept():
+    dedup = IngestDeduplicator(max_hamming_distance=6, boilerplate_min_pages=0)
+    assert dedup.is_duplicate("Baggage allowance is 23kg for economy passengers.") is False
+    assert dedup.is_duplicate("Refunds are processed within seven business days.") is False
+
+
+def test_band_lookup_finds_every_fingerprint_within_distance():
+    # Pigeonhole over k + 1 bands: any fingerprint within k bits shares a band
+    rng = random.Random(7)
+    for k in (3, 6):
+        dedup = IngestDeduplicator(max_hamming_distance=k, boilerplate_min_pages=0)
+        for _ in range(200):
+            base = rng.getrandbits(64)
+            near = _flip_bits(base, rng.sample(range(64), k))
+            assert any(a == b for a, b in zip(dedup._band_keys(base), dedup._band_keys(near)))
+
+
+def test_near_duplicate_is_dropped(monkeypatch):
+    dedup = IngestDeduplicator(max_hamming_distance=6, boilerplate_min_pages=0)
+    fingerprints = {"first chunk": 0x0123456789ABCDEF, "second chunk": _flip_bits(0x0123456789ABCDEF, [0, 17, 40, 63])}
+    monkeypatch.setattr("app.services.chunk_deduplicator.simhash", lambda text: fingerprints[text])
+    assert dedup.is_duplicate("first chunk") is False
+    assert dedup.is_duplicate("second chunk") is True
+    assert dedup.stats()["near_duplicates"] == 1
+
+
+def test_fingerprint_beyond_distance_is_kept(monkeypatch):
+    dedup = IngestDeduplicator(max_hamming_distance=3, boilerplate_min_pages=0)
+    fingerprints = {"first chunk": 0, "second chunk": _flip_bits(0, [1, 12, 30, 50])}
+    monkeypatch.setattr("app.services.chunk_deduplicator.simhash", lambda text: fingerprints[text])
+    assert dedup.is_duplicate("first chunk") is False
+    assert dedup.is_duplicate("second chunk") is False
+
+
+def test_simhash_of_small_edit_is_close():
+    text = " ".join(f"word{i}" for i in range(200))
+    edited = text.replace("word100", "changed")
+    assert (simhash(text) ^ simhash(edited)).bit_count() <= 16
+
+
+def test_boilerplate_removal_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("WEBSITE_BOILERPLATE_MIN_PAGES", raising=False)
+    dedup = IngestDeduplicator()
+    footer = "Copyright 2024 Example Airlines. All rights reserved worldwide."
+    for _ in range(5):
+        assert dedup.filter_boilerplate([footer, "Page body"]) == [footer, "Page body"]
+
+
+def test_boilerplate_drops_long_repeated_blocks_only():
+    dedup = IngestDeduplicator(boilerplate_min_pages=3, boilerplate_min_chars=40)
+    footer = "Copyright 2024 Example Airlines. All rights reserved worldwide."
+    pages = [[footer, "Price", f"Body of page {i}"] for i in range(4)]
+    results = [dedup.filter_boilerplate(page) for page in pages]
+    assert results[0] == pages[0]
+    assert results[1] == pages[1]
+    # From the third page on the footer is boilerplate; the short label is kept
+    assert results[2] == ["Price", "Body of page 2"]
+    assert results[3] == ["Price", "Body of page 3"]
+    assert dedup.stats()["boilerplate_blocks"] == 2
+
+
+def test_block_repeated_within_one_page_counts_once():
+    dedup = IngestDeduplicator(boilerplate_min_pages=2, boilerplate_min_chars=0)
+    block = "Subscribe to our newsletter for the latest offers"
+    assert dedup.filter_boilerplate([block, block, block]) == [block, block, block]
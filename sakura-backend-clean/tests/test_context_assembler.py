@@ -0,0 +1,81 @@
+import pytest
+from langchain_core.documents import Document
+
+from app.services import context_assembler
+from app.services.context_assembler import ContextAssembler, _merge_overlapping
+
+
+class _WordCounter:
+    def count_tokens(self, texts):
+        return [len(text.split()) for text in texts]
+
+
+@pytest.fixture
+def assembler(monkeypatch):
+    monkeypatch.setattr(context_assembler, "get_text_chunker", lambda: _WordCounter())
+    monkeypatch.setenv("CONTEXT_TOKEN_BUDGET", "40")
+    monkeypatch.setenv("CONTEXT_MAX_PASSAGE_TOKENS", "30")
+    monkeypatch.setenv("CONTEXT_MIN_PASSAGE_TOKENS", "12")
+    return ContextAssembler(settings=None)
+
+
+def _chunk(text, index, source="https://example.com/baggage"):
+    return Document(page_content=text, metadata={"type": "website", "website_id": "w1", "source": source, "chunk_index": index})
+
+
+def _faq(question, answer):
+    return Document(page_content=f"Q: {question}\n\nA: {answer}", metadata={"type": "faq", "source": "faq", "faq_id": "f1"})
+
+
+def test_merge_overlapping_drops_repeated_words():
+    assert _merge_overlapping("one two three four", "three four five six") == "one two three four five six"
+    assert _merge_overlapping("one two", "three four") == "one two three four"
+
+
+def test_neighbouring_chunks_merge_into_one_passage(assembler):
+    context = assembler.assemble([], [_chunk("bags up to 23kg are free", 1), _chunk("are free in economy class", 2)])
+    assert "1. [https://example.com/baggage] bags up to 23kg are free in economy class" in context
+    assert assembler.get_metrics()["chunks_merged"] == 1
+
+
+def test_duplicate_text_and_chunks_are_dropped(assembler):
+    context = assembler.assemble([], [
+        _chunk("refunds take seven days", 1),
+        _chunk("Refunds take   seven days", 5, source="https://example.com/other"),
+        _chunk("refunds take seven days", 1),
+    ])
+    assert context.count("refunds take seven days") == 1
+    assert assembler.get_metrics()["duplicates_dropped"] == 2
+
+
+def test_faqs_come_first_and_are_kept_whole(assembler):
+    context = assembler.assemble(
+        [_faq("Can I cancel?", "Yes, within 24 hours.")],
+        [_chunk("cancellation fees apply after that", 3)],
+    )
+    assert context.index("FREQUENTLY ASKED QUESTIONS") < context.index("ADDITIONAL INFORMATION")
+    assert "Q: Can I cancel?\nA: Yes, within 24 hours." in context
+
+
+def test_budget_cuts_a_long_passage_to_the_passage_cap(assembler):
+    long_text = " ".join(f"w{i}" for i in range(60))
+    context = assembler.assemble([], [_chunk(long_text, 1), _chunk(" ".join(f"x{i}" for i in range(20)), 10)])
+    # 30 of 40 tokens go to the first passage; the 10 left are below the 12-token minimum
+    assert "w29 …" in context and "w30" not in context
+    assert "x0" not in context
+    assert assembler.get_metrics()["passages_cut"] == 1
+
+
+def test_faq_that_does_not_fit_is_skipped_not_cut(assembler):
+    long_answer = " ".join(f"a{i}" for i in range(50))
+    context = assembler.assemble(
+        [_faq("Long question?", long_answer), _faq("Short?", "Yes.")],
+        [_chunk("bags up to 23kg are free", 1)],
+    )
+    assert "a0" not in context
+    assert "Q: Short?\nA: Yes." in context
+    assert "bags up to 23kg are free" in context
+
+
+def test_nothing_usable_returns_none(assembler):
+    assert assembler.assemble([], [Document(page_content="Welcome to Sakura AI Assistant!", metadata={})]) is None
@@ -0,0 +1,94 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app.services import conversation_memory
+from app.services.conversation_memory import ConversationMemory
+
+
+class _WordCounter:
+    def count_tokens(self, texts):
+        return [len(text.split()) for text in texts]
+
+
+class _Chats:
+    def __init__(self, messages):
+        self.messages = messages
+
+    def aggregate(self, pipeline):
+        projection = pipeline[-1]["$project"]
+        if "count" in projection:
+            limit = -projection["recent"]["$slice"][1]
+            return [{"count": len(self.messages), "recent": self.messages[-limit:]}]
+        _, start, length = projection["messages"]["$slice"]
+        return [{"messages": self.messages[start:start + length]}]
+
+
+class _Memory:
+    def __init__(self, document=None):
+        self.document = document
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def find_one(self, query, projection=None):
+        return self.document
+
+
+class _DB(dict):
+    def __init__(self, messages, memory=None):
+        super().__init__({"customer-chats": _Chats(messages), "chat-memory": _Memory(memory)})
+
+
+@pytest.fixture(autouse=True)
+def _word_tokens(monkeypatch):
+    monkeypatch.setattr(conversation_memory, "get_text_chunker", lambda: _WordCounter())
+    monkeypatch.setenv("MEMORY_WINDOW_TOKENS", "6")
+    monkeypatch.setenv("MEMORY_SUMMARIZE_BATCH", "2")
+
+
+def _chat(*texts):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": text} for i, text in enumerate(texts)]
+
+
+def _memory(messages, summary=None, llm=None):
+    memory = ConversationMemory(settings=None, db=_DB(messages, summary), llm=llm)
+    scheduled = []
+    memory._schedule_summary = lambda chat_id, start, end: scheduled.append((start, end))
+    return memory, scheduled
+
+
+def test_window_keeps_newest_turns_within_token_budget():
+    memory, _ = _memory(_chat("one two", "three four", "five six", "seven eight"))
+    summary, messages = memory.get_context("chat-1", "new question")
+    assert summary is None
+    assert messages == [HumanMessage(content="five six"), AIMessage(content="seven eight")]
+
+
+def test_window_drops_current_query_and_opens_with_user_turn():
+    memory, _ = _memory(_chat("one two", "three four", "five six", "seven eight", "current question"))
+    _, messages = memory.get_context("chat-1", "current question")
+    assert messages[0] == HumanMessage(content="five six")
+    assert all(message.content != "current question" for message in messages)
+
+
+def test_older_messages_are_scheduled_for_summary_once_a_batch_builds_up():
+    memory, scheduled = _memory(_chat("a b", "c d", "e f", "g h", "i j", "k l"))
+    summary, messages = memory.get_context("chat-1", "next")
+    assert len(messages) == 2
+    assert scheduled == [(0, 4)]
+
+
+def test_stored_summary_is_returned_and_not_redone():
+    memory, scheduled = _memory(
+        _chat("a b", "c d", "e f", "g h", "i j", "k l"),
+        summary={"summary": "Customer asked about a refund.", "summarized_through": 4},
+    )
+    summary, _ = memory.get_context("chat-1", "next")
+    assert summary == "Customer asked about a refund."
+    assert scheduled == []
+
+
+def test_disabled_memory_returns_nothing(monkeypatch):
+    monkeypatch.setenv("MEMORY_ENABLED", "false")
+    memory, _ = _memory(_chat("a b", "c d"))
+    assert memory.get_context("chat-1", "next") == (None, [])
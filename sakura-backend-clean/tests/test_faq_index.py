@@ -0,0 +1,68 @@
+import numpy as np
+from langchain_core.documents import Document
+
+from app.services.faq_index import FAQIndex, parse_faq_document
+
+
+def _entry(faq_id, question="q", answer="a"):
+    return {"faq_id": faq_id, "question": question, "answer": answer}
+
+
+def _unit(i, dimension=4):
+    vector = np.zeros(dimension, dtype=np.float32)
+    vector[i] = 1.0
+    return vector
+
+
+def test_search_returns_nearest_entries_with_squared_distance():
+    index = FAQIndex(4, capacity=2)
+    index.add([_entry("a"), _entry("b"), _entry("c")], np.stack([_unit(0), _unit(1), _unit(2)]))
+    results = index.search(_unit(1), k=2)
+    assert results[0][0]["faq_id"] == "b"
+    assert results[0][1] == 0.0
+    assert results[1][1] == 2.0
+    assert len(index) == 3
+
+
+def test_upsert_replaces_entry_and_vector_in_place():
+    index = FAQIndex(4)
+    index.upsert(_entry("a", answer="old"), _unit(0))
+    index.upsert(_entry("a", answer="new"), _unit(3))
+    assert len(index) == 1
+    entry, distance = index.search(_unit(3), k=1)[0]
+    assert entry["answer"] == "new"
+    assert distance == 0.0
+
+
+def test_delete_hides_entry_and_reuses_its_slot():
+    index = FAQIndex(4, capacity=2)
+    index.add([_entry("a"), _entry("b")], np.stack([_unit(0), _unit(1)]))
+    assert index.delete("a") is True
+    assert index.delete("a") is False
+    assert "a" not in index
+    assert [entry["faq_id"] for entry, _ in index.search(_unit(0), k=5)] == ["b"]
+
+    index.upsert(_entry("c"), _unit(2))
+    # The freed slot is reused, so the matrix did not grow
+    assert index._used == 2
+    assert index.search(_unit(2), k=1)[0][0]["faq_id"] == "c"
+
+
+def test_search_on_empty_index():
+    index = FAQIndex(4)
+    assert index.search(_unit(0), k=3) == []
+    index.upsert(_entry("a"), _unit(0))
+    index.delete("a")
+    assert index.search(_unit(0), k=3) == []
+
+
+def test_parse_faq_document_strips_labels():
+    doc = Document(
+        page_content="Q: How do I cancel?\n\nA: Use the manage booking page.",
+        metadata={"type": "faq", "source": "faq", "faq_id": "f1"},
+    )
+    assert parse_faq_document(doc) == {
+        "faq_id": "f1",
+        "question": "How do I cancel?",
+        "answer": "Use the manage booking page.",
+    }
@@ -0,0 +1,152 @@
+import threading
+import time
+
+import pytest
+
+from app.services.llm_scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    LLMOverloadedError,
+    LLMScheduler,
+    invoke_scheduled,
+)
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setenv("LLM_MAX_CONCURRENCY", "1")
+    monkeypatch.setenv("LLM_MAX_QUEUE", "4")
+    monkeypatch.setenv("LLM_QUEUE_SLO_MS", "2000")
+    monkeypatch.setenv("LLM_BACKGROUND_QUEUE_SLO_MS", "2000")
+    monkeypatch.setenv("LLM_DEADLINE_S", "2")
+    return LLMScheduler()
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def _queued(scheduler):
+    return scheduler.get_metrics()["queue_depth"]
+
+
+def test_released_slot_goes_to_highest_priority_waiter(scheduler):
+    order = []
+    holder = scheduler.slot()
+    holder.__enter__()
+
+    def call(name, priority):
+        scheduler.run(lambda: order.append(name), priority=priority)
+
+    background = threading.Thread(target=call, args=("background", PRIORITY_BACKGROUND))
+    background.start()
+    _wait_for(lambda: _queued(scheduler) == 1)
+    interactive = threading.Thread(target=call, args=("interactive", PRIORITY_INTERACTIVE))
+    interactive.start()
+    _wait_for(lambda: _queued(scheduler) == 2)
+
+    holder.__exit__(None, None, None)
+    background.join(2)
+    interactive.join(2)
+    assert order == ["interactive", "background"]
+    assert scheduler.get_metrics()["active"] == 0
+
+
+def test_call_is_shed_when_queue_wait_exceeds_slo(scheduler):
+    scheduler.queue_slo_ms = 50
+    with scheduler.slot():
+        with pytest.raises(LLMOverloadedError):
+            scheduler.run(lambda: "never")
+    metrics = scheduler.get_metrics()
+    assert metrics["shed"] == 1
+    assert metrics["active"] == 0 and metrics["queue_depth"] == 0
+
+
+def test_call_is_shed_when_queue_is_full(scheduler):
+    scheduler.max_queue = 0
+    with scheduler.slot():
+        with pytest.raises(LLMOverloadedError):
+            scheduler.run(lambda: "never")
+
+
+def test_identical_calls_in_flight_share_one_execution(scheduler):
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def leader_fn():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return "answer"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(scheduler.run(leader_fn, key="same prompt")))
+    leader.start()
+    started.wait(2)
+    follower = threading.Thread(target=lambda: results.append(scheduler.run(lambda: "second call", key="same prompt")))
+    follower.start()
+    _wait_for(lambda: scheduler.get_metrics()["coalesced"] == 1)
+    release.set()
+    leader.join(2)
+    follower.join(2)
+    assert results == ["answer", "answer"]
+    assert calls == [1]
+
+
+def test_follower_is_shed_when_leader_runs_past_its_deadline(scheduler):
+    scheduler.queue_slo_ms = 0
+    scheduler.call_deadline_s = 0.05
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(2)
+        return "late"
+
+    leader = threading.Thread(target=lambda: scheduler.run(slow, key="k"))
+    leader.start()
+    started.wait(2)
+    try:
+        with pytest.raises(LLMOverloadedError):
+            scheduler.run(lambda: "unused", key="k")
+    finally:
+        release.set()
+        leader.join(2)
+
+
+def test_models_that_schedule_their_own_requests_are_not_admitted_twice(scheduler):
+    class SelfScheduling:
+        def __init__(self, scheduler):
+            self.scheduler = scheduler
+
+        def invoke(self, messages, priority=PRIORITY_INTERACTIVE):
+            with self.scheduler.slot(priority):
+                return f"{messages} at {priority}"
+
+    # With max_concurrency=1 a second slot would never be granted
+    model = SelfScheduling(scheduler)
+    assert invoke_scheduled(scheduler, model, "hi", PRIORITY_BACKGROUND) == f"hi at {PRIORITY_BACKGROUND}"
+
+
+def test_abandoned_requests_keep_their_slot_until_they_finish(scheduler, monkeypatch):
+    from app.services.resilient_llm import LLMDeadlineExceeded, ResilientChatModel
+
+    monkeypatch.setenv("LLM_ATTEMPT_TIMEOUT_S", "0.05")
+    monkeypatch.setenv("LLM_DEADLINE_S", "0.05")
+    release = threading.Event()
+
+    class Stuck:
+        def invoke(self, messages):
+            release.wait(2)
+            return "late"
+
+    model = ResilientChatModel(Stuck(), scheduler=scheduler)
+    with pytest.raises(LLMDeadlineExceeded):
+        invoke_scheduled(scheduler, model, "hi")
+    # The request is still running in the background and still counts
+    assert scheduler.get_metrics()["active"] == 1
+    release.set()
+    _wait_for(lambda: scheduler.get_metrics()["active"] == 0)
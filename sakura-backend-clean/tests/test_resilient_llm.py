@@ -0,0 +1,114 @@
+import threading
+import time
+
+import pytest
+
+from app.services.resilient_llm import LLMDeadlineExceeded, ResilientChatModel
+
+
+class FakeModel:
+    """Answers from a script of results: a value is returned, an exception raised, a float slept first."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, messages, **kwargs):
+        with self._lock:
+            self.calls += 1
+            step = self.script.pop(0) if len(self.script) > 1 else self.script[0]
+        if isinstance(step, tuple):
+            delay, step = step
+            time.sleep(delay)
+        if isinstance(step, BaseException):
+            raise step
+        return step
+
+
+@pytest.fixture(autouse=True)
+def _fast_retries(monkeypatch):
+    monkeypatch.setenv("LLM_RETRY_BASE_MS", "1")
+    monkeypatch.setenv("LLM_ATTEMPT_TIMEOUT_S", "1")
+    monkeypatch.setenv("LLM_DEADLINE_S", "3")
+    monkeypatch.setenv("LLM_MAX_ATTEMPTS", "3")
+
+
+def test_primary_answer_is_returned():
+    primary, fallback = FakeModel("primary answer"), FakeModel("fallback answer")
+    model = ResilientChatModel(primary, fallback)
+    assert model.invoke("hi") == "primary answer"
+    assert fallback.calls == 0
+
+
+def test_failure_retries_on_the_fallback():
+    primary, fallback = FakeModel(RuntimeError("500")), FakeModel("fallback answer")
+    model = ResilientChatModel(primary, fallback)
+    assert model.invoke("hi") == "fallback answer"
+    metrics = model.get_metrics()
+    assert metrics["retries"] == 1 and metrics["fallbacks"] == 1
+    assert metrics["models"]["primary"]["failures"] == 1
+
+
+def test_single_model_retries_until_it_answers():
+    primary = FakeModel(RuntimeError("500"), RuntimeError("500"), "third time")
+    model = ResilientChatModel(primary)
+    assert model.invoke("hi") == "third time"
+    assert primary.calls == 3
+
+
+def test_last_error_is_raised_when_every_attempt_fails():
+    model = ResilientChatModel(FakeModel(ValueError("bad request")), FakeModel(ValueError("bad request")))
+    with pytest.raises(ValueError):
+        model.invoke("hi")
+
+
+def test_timed_out_attempt_moves_to_the_fallback(monkeypatch):
+    monkeypatch.setenv("LLM_ATTEMPT_TIMEOUT_S", "0.05")
+    primary, fallback = FakeModel((0.5, "too late")), FakeModel("fallback answer")
+    model = ResilientChatModel(primary, fallback)
+    assert model.invoke("hi") == "fallback answer"
+    assert model.get_metrics()["models"]["primary"]["timeouts"] == 1
+
+
+def test_deadline_exceeded_when_nothing_answers(monkeypatch):
+    monkeypatch.setenv("LLM_ATTEMPT_TIMEOUT_S", "0.05")
+    monkeypatch.setenv("LLM_DEADLINE_S", "0.2")
+    model = ResilientChatModel(FakeModel((0.5, "late")), FakeModel((0.5, "late")))
+    with pytest.raises(LLMDeadlineExceeded):
+        model.invoke("hi")
+    assert model.get_metrics()["deadline_exceeded"] == 1
+
+
+def test_repeated_primary_failures_start_calls_on_the_fallback(monkeypatch):
+    monkeypatch.setenv("LLM_PRIMARY_FAILURE_THRESHOLD", "1")
+    primary, fallback = FakeModel(RuntimeError("500")), FakeModel("fallback answer")
+    model = ResilientChatModel(primary, fallback)
+    model.invoke("hi")
+    model.invoke("hi again")
+    assert primary.calls == 1
+    assert model.get_metrics()["primary_in_cooldown"] is True
+
+
+def test_slow_request_is_hedged_and_the_faster_duplicate_wins(monkeypatch):
+    monkeypatch.setenv("LLM_HEDGE_ENABLED", "true")
+    monkeypatch.setenv("LLM_HEDGE_MIN_MS", "20")
+    primary = FakeModel((0.5, "slow original"), "fast duplicate")
+    model = ResilientChatModel(primary)
+    # Enough recent latencies for a p95 to hedge on
+    for _ in range(20):
+        model._record("primary", "success", 1.0)
+    assert model.invoke("hi") == "fast duplicate"
+    metrics = model.get_metrics()
+    assert metrics["hedges"] == 1 and metrics["hedge_wins"] == 1
+
+
+def test_bound_tools_share_stats():
+    class Bindable(FakeModel):
+        def bind_tools(self, tools, **kwargs):
+            return self
+
+    model = ResilientChatModel(Bindable("answer"))
+    bound = model.bind_tools([])
+    bound.invoke("hi")
+    assert model.get_metrics()["models"]["primary"]["successes"] == 1
@@ -0,0 +1,83 @@
+import pytest
+from langchain_core.documents import Document
+
+from app.services.sparse_index import (
+    BM25Writer,
+    bm25_tokenize,
+    open_bm25_index,
+    reciprocal_rank_fusion,
+    write_bm25_index,
+)
+
+
+def _doc(doc_id, text, title=""):
+    return Document(id=doc_id, page_content=text, metadata={"title": title})
+
+
+@pytest.fixture
+def bm25_dir(tmp_path):
+    write_bm25_index(tmp_path / "bm25.sqlite", [
+        ("d1", _doc("d1", "Checked baggage allowance is 23kg for economy")),
+        ("d2", _doc("d2", "Order AB-1234 ships within two days")),
+        ("d3", _doc("d3", "Refunds for cancelled flights take seven days")),
+    ])
+    return tmp_path
+
+
+def test_tokenize_keeps_identifiers_and_their_parts():
+    tokens = bm25_tokenize("Order AB-1234 costs 5 EUR, see v2.1")
+    assert "ab-1234" in tokens and "ab" in tokens and "1234" in tokens
+    assert "v2.1" in tokens and "v2" in tokens
+    assert "5" in tokens
+
+
+def test_search_ranks_exact_identifier_first(bm25_dir):
+    index = open_bm25_index(bm25_dir)
+    try:
+        assert len(index) == 3
+        results = index.search("where is order ab-1234", k=2)
+        assert results[0][0] == "d2"
+        assert all(score > 0 for _, score in results)
+    finally:
+        index.close()
+
+
+def test_search_without_matching_tokens_is_empty(bm25_dir):
+    index = open_bm25_index(bm25_dir)
+    try:
+        assert index.search("lounge access", k=5) == []
+        assert index.search("", k=5) == []
+    finally:
+        index.close()
+
+
+def test_appended_documents_are_searchable(bm25_dir):
+    writer = BM25Writer(bm25_dir / "bm25.sqlite")
+    writer.add("d4", _doc("d4", "Lounge access is included with business class"))
+    writer.close()
+    index = open_bm25_index(bm25_dir)
+    try:
+        assert len(index) == 4
+        assert index.search("lounge access", k=1)[0][0] == "d4"
+    finally:
+        index.close()
+
+
+def test_missing_postings_file_opens_as_none(tmp_path):
+    assert open_bm25_index(tmp_path) is None
+
+
+def test_rrf_rewards_documents_ranked_by_both_lists():
+    a, b, c = _doc("a", "a"), _doc("b", "b"), _doc("c", "c")
+    fused = reciprocal_rank_fusion([[a, b], [c, b]], weights=[1.0, 1.0], rrf_k=60)
+    assert [doc.id for doc, _ in fused] == ["b", "a", "c"]
+    assert fused[0][1] == pytest.approx(1 / 62 + 1 / 62)
+    assert fused[1][1] == pytest.approx(1 / 61)
+
+
+def test_rrf_weights_and_disabled_rankings():
+    a, b = _doc("a", "a"), _doc("b", "b")
+    fused = reciprocal_rank_fusion([[a], [b]], weights=[1.0, 2.0], rrf_k=60)
+    assert [doc.id for doc, _ in fused] == ["b", "a"]
+    fused = reciprocal_rank_fusion([[a], [b]], weights=[1.0, 0.0], rrf_k=60)
+    assert [doc.id for doc, _ in fused] == ["a"]